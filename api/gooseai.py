@@ -1,9 +1,9 @@
 from api.utilities.gooseutils import GooseAIEngines
 from config import goose_api_key, goose_engine_fallback_order
 from utilities import Utilities
+from utilities.metrics import timed
 from structlog import get_logger
 from typing import Any
-import asyncio
 import json
 import requests
 
@@ -22,6 +22,7 @@ class GooseAI:
         self._url = "https://api.goose.ai/v1"
         self._headers = {"Authorization": "Bearer " + goose_api_key}
 
+    @timed("external_call", service="gooseai")
     def get(self, url: str):
         """
         Calls the API specified with url using HTTP GET.
@@ -31,6 +32,7 @@ class GooseAI:
         response = requests.get(f"{self._url}{url}", headers=self._headers)
         return json.loads(response.text)
 
+    @timed("external_call", service="gooseai")
     def post(self, url: str, data: dict[str, Any]):
         """
         Calls the API specified with url using HTTP GET.
@@ -48,9 +50,7 @@ class GooseAI:
                     return engine
             except Exception as e:
                 log.error(self.class_name, _msg=f"Got error checking if {engine.name} is online.", e=e)
-                loop = asyncio.get_running_loop()
-                loop.create_task(utils.log_error(f"Got error checking if {engine.name} is online."))
-                loop.create_task(utils.log_exception(e))
+                utils.log_error_threadsafe(f"Got error checking if {engine.name} is online.", e)
         log.critical(self.class_name, error="No engines for GooseAI are online!")
 
     def completion(
@@ -85,8 +85,8 @@ class GooseAI:
         if "error" in response:
             error = response["error"]
             log.error(self.class_name, code=error["code"], error=error["message"], info=error["type"])
-            loop = asyncio.get_running_loop()
-            loop.create_task(utils.log_error(f'GooseAI Error {error["code"]} ({error["type"]}): {error["message"]}'))
+            # this runs on a worker thread, through run_blocking
+            utils.log_error_threadsafe(f'GooseAI Error {error["code"]} ({error["type"]}): {error["message"]}')
             return ""
 
         if response["choices"]:
@@ -5,6 +5,7 @@ from servicemodules.discordConstants import rob_id
 from servicemodules.serviceConstants import Services, openai_channel_ids
 from utilities.serviceutils import ServiceMessage
 from utilities import utilities, Utilities
+from utilities.metrics import timed
 import openai
 import discord
 
@@ -35,25 +36,23 @@ class OpenAI:
         See https://beta.openai.com/docs/engines/content-filter for details"""
 
         try:
-            response = openai.Completion.create(
-                engine="content-filter-alpha",
-                prompt="<|endoftext|>" + prompt + "\n--\nLabel:",
-                temperature=0,
-                max_tokens=1,
-                top_p=0,
-                logprobs=10,
-            )
+            with timed("external_call", service="openai"):
+                response = openai.Completion.create(
+                    engine="content-filter-alpha",
+                    prompt="<|endoftext|>" + prompt + "\n--\nLabel:",
+                    temperature=0,
+                    max_tokens=1,
+                    top_p=0,
+                    logprobs=10,
+                )
         except openai.error.AuthenticationError as e:
             self.log.error(self.class_name, error="OpenAI Authentication Failed")
-            loop = asyncio.get_running_loop()
-            loop.create_task(utils.log_error(f"OpenAI Authenication Failed"))
-            loop.create_task(utils.log_exception(e))
+            # this runs on a worker thread, through run_blocking
+            utils.log_error_threadsafe("OpenAI Authenication Failed", e)
             return 2
         except openai.error.RateLimitError as e:
             self.log.warning(self.class_name, error="OpenAI Rate Limit Exceeded")
-            loop = asyncio.get_running_loop()
-            loop.create_task(utils.log_error(f"OpenAI Rate Limit Exceeded"))
-            loop.create_task(utils.log_exception(e))
+            utils.log_error_threadsafe("OpenAI Rate Limit Exceeded", e)
             return 2
 
         output_label = response["choices"][0]["text"]
@@ -122,27 +121,25 @@ class OpenAI:
             return ""
 
         try:
-            response = openai.Completion.create(
-                engine=str(engine),
-                prompt=prompt,
-                temperature=0,
-                max_tokens=100,
-                top_p=1,
-                # stop=["\n"],
-                logit_bias=logit_bias,
-                # user=str(message.author.id),
-            )
+            with timed("external_call", service="openai"):
+                response = openai.Completion.create(
+                    engine=str(engine),
+                    prompt=prompt,
+                    temperature=0,
+                    max_tokens=100,
+                    top_p=1,
+                    # stop=["\n"],
+                    logit_bias=logit_bias,
+                    # user=str(message.author.id),
+                )
         except openai.error.AuthenticationError as e:
             self.log.error(self.class_name, error="OpenAI Authentication Failed")
-            loop = asyncio.get_running_loop()
-            loop.create_task(utils.log_error(f"OpenAI Authenication Failed"))
-            loop.create_task(utils.log_exception(e))
+            # this runs on a worker thread, through run_blocking
+            utils.log_error_threadsafe("OpenAI Authenication Failed", e)
             return ""
         except openai.error.RateLimitError as e:
             self.log.warning(self.class_name, error="OpenAI Rate Limit Exceeded")
-            loop = asyncio.get_running_loop()
-            loop.create_task(utils.log_error(f"OpenAI Rate Limit Exceeded"))
-            loop.create_task(utils.log_exception(e))
+            utils.log_error_threadsafe("OpenAI Rate Limit Exceeded", e)
             return ""
 
         if response["choices"]:
@@ -56,7 +56,11 @@ class SemanticWiki(Persistence):
     def post(self, body):
         """Most basic way to comunicate with the Mediawiki API. body must be a dictionary of things that make sense
         in the context of the API."""
-        response = self._session.post(self._uri, data=body)
+        # not at the top, since importing utilities imports this module
+        from utilities.metrics import timed
+
+        with timed("external_call", service="wiki"):
+            response = self._session.post(self._uri, data=body)
         response.raise_for_status()
         
         json = response.json()
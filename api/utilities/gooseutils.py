@@ -1,15 +1,18 @@
 from api.utilities import tokenizers
 from enum import Enum
-from transformers import PreTrainedTokenizerFast
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerFast
 
 
 class GooseAIEngines(Enum):
-    def __new__(cls, value: str, name: str, description: str, tokenizer: PreTrainedTokenizerFast):
+    def __new__(cls, value: str, name: str, description: str, tokenizer_name: str):
         obj = object.__new__(cls)
         obj._value_ = value
         obj.name = name
         obj.description = description
-        obj.tokenizer = tokenizer
+        obj._tokenizer_name = tokenizer_name
         return obj
 
     @property
@@ -29,12 +32,9 @@ class GooseAIEngines(Enum):
         self._description = value
 
     @property
-    def tokenizer(self) -> PreTrainedTokenizerFast:
-        return self._tokenizer
-
-    @tokenizer.setter
-    def tokenizer(self, value: PreTrainedTokenizerFast) -> None:
-        self._tokenizer = value
+    def tokenizer(self) -> "PreTrainedTokenizerFast":
+        """Loaded the first time any engine that uses it asks for it"""
+        return tokenizers.get_tokenizer(self._tokenizer_name)
 
     def __str__(self) -> str:
         return str(self._value_)
@@ -43,59 +43,59 @@ class GooseAIEngines(Enum):
         "gpt-neo-20b",
         "GPT-NeoX 20B",
         "20B parameter EleutherAI model trained on the Pile, using the NeoX framework.",
-        tokenizers.gpt_neo_x,
+        "gpt_neo_x",
     )
     GPT_6B = (
         "gpt-j-6b",
         "GPT-J 6B",
         "6B parameter EleutherAI model trained on the Pile, using the Mesh Transformer JAX framework.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     GPT_2_7B = (
         "gpt-neo-2-7b",
         "GPT-Neo 2.7B",
         "20B parameter EleutherAI model trained on the Pile, using the NeoX framework.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     GPT_1_3B = (
         "gpt-neo-1-3b",
         "GPT-Neo 1.3B",
         "1.3B parameter EleutherAI model trained on the Pile, using the Neo framework.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     GPT_125M = (
         "gpt-neo-125m",
         "GPT-Neo 125M",
         "125M parameter EleutherAI model trained on the Pile, using the Neo framework.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     FAIRSEQ_13B = (
         "fairseq-13b",
         "Fairseq 13B",
         "13B parameter Facebook Mixture of Experts model trained on RoBERTa and CC100 subset data.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     FAIRSEQ_6_7B = (
         "fairseq-6-7b",
         "Fairseq 6.7B",
         "6.7B parameter Facebook Mixture of Experts model trained on RoBERTa and CC100 subset data.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     FAIRSEQ_2_7B = (
         "fairseq-2-7b",
         "Fairseq 2.6B",
         "2.7B parameter Facebook Mixture of Experts model trained on RoBERTa and CC100 subset data.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     FAIRSEQ_1_3B = (
         "fairseq-1-3b",
         "Fairseq 1.3B",
         "1.3B parameter Facebook Mixture of Experts model trained on RoBERTa and CC100 subset data.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     FAIRSEQ_125M = (
         "fairseq-125m",
         "Fairseq 125M",
         "125M parameter Facebook Mixture of Experts model trained on RoBERTa and CC100 subset data.",
-        tokenizers.gpt2,
+        "gpt2",
     )
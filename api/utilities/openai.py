@@ -1,15 +1,18 @@
 from api.utilities import tokenizers
 from enum import Enum
-from transformers import PreTrainedTokenizerFast
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerFast
 
 
 class OpenAIEngines(Enum):
-    def __new__(cls, value: str, name: str, description: str, tokenizer: PreTrainedTokenizerFast):
+    def __new__(cls, value: str, name: str, description: str, tokenizer_name: str):
         obj = object.__new__(cls)
         obj._value_ = value
         obj.name = name
         obj.description = description
-        obj.tokenizer = tokenizer
+        obj._tokenizer_name = tokenizer_name
         return obj
 
     @property
@@ -29,12 +32,9 @@ class OpenAIEngines(Enum):
         self._description = value
 
     @property
-    def tokenizer(self) -> PreTrainedTokenizerFast:
-        return self._tokenizer
-
-    @tokenizer.setter
-    def tokenizer(self, value: PreTrainedTokenizerFast) -> None:
-        self._tokenizer = value
+    def tokenizer(self) -> "PreTrainedTokenizerFast":
+        """Loaded the first time any engine that uses it asks for it"""
+        return tokenizers.get_tokenizer(self._tokenizer_name)
 
     def __str__(self) -> str:
         return str(self._value_)
@@ -43,17 +43,17 @@ class OpenAIEngines(Enum):
         "text-davinci-003",
         "Davinci 003",
         "Should only be used for Rob.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     CURIE = (
         "text-curie-001",
         "Curie 001",
         "Should only be used for bot devs.",
-        tokenizers.gpt2,
+        "gpt2",
     )
     BABBAGE = (
         "text-babbage-001",
         "Babbage 001",
         "Should be used by everyone else.",
-        tokenizers.gpt2,
+        "gpt2",
     )
@@ -1,5 +1,45 @@
-from enum import Enum
-from transformers import GPT2TokenizerFast, GPTNeoXTokenizerFast
+import os
+from threading import Lock
+from typing import TYPE_CHECKING
 
-gpt2 = GPT2TokenizerFast.from_pretrained("gpt2")
-gpt_neo_x = GPTNeoXTokenizerFast.from_pretrained("EleutherAI/gpt-neox-20b")
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerFast
+
+# tokenizer name -> (the transformers class, the HuggingFace model it comes from)
+pretrained = {
+    "gpt2": ("GPT2TokenizerFast", "gpt2"),
+    "gpt_neo_x": ("GPTNeoXTokenizerFast", "EleutherAI/gpt-neox-20b"),
+}
+
+_loaded: dict[str, "PreTrainedTokenizerFast"] = {}
+_lock = Lock()
+
+
+def get_tokenizer(name: str) -> "PreTrainedTokenizerFast":
+    """Load the named tokenizer the first time it's asked for, and reuse it after that.
+    Loading one is slow and needs the HuggingFace cache or the network, so nothing does it at import time.
+    If tokenizers_dir is set in config, it's loaded from there instead: either <name>.json, a single
+    tokenizer file, or a <name> directory saved with save_pretrained()"""
+    if name in _loaded:
+        return _loaded[name]
+    with _lock:
+        if name not in _loaded:
+            import transformers  # this alone takes a while
+            from config import tokenizers_dir
+
+            class_name, model = pretrained[name]
+            tokenizer_class = getattr(transformers, class_name)
+            if tokenizers_dir and os.path.isfile(os.path.join(tokenizers_dir, f"{name}.json")):
+                _loaded[name] = tokenizer_class(tokenizer_file=os.path.join(tokenizers_dir, f"{name}.json"))
+            elif tokenizers_dir and os.path.isdir(os.path.join(tokenizers_dir, name)):
+                _loaded[name] = tokenizer_class.from_pretrained(os.path.join(tokenizers_dir, name))
+            else:
+                _loaded[name] = tokenizer_class.from_pretrained(model)
+    return _loaded[name]
+
+
+def __getattr__(name: str) -> "PreTrainedTokenizerFast":
+    # so tokenizers.gpt2 and friends still work, loading on first use
+    if name in pretrained:
+        return get_tokenizer(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -18,6 +18,56 @@ def getenv(env_var, default=NOT_PROVIDED):
 
 
 maximum_recursion_depth = 30
+dispatcher_max_workers = 8  # how many messages the dispatcher will handle at once, across all channels
+module_executor_workers = 16  # threads available for running modules' (synchronous) process_message
+module_process_message_deadline = 2.0  # seconds a module gets to answer before its response is dropped
+# How many speculative callbacks (see modules.module.Response) may run ahead of their turn at once. 0 turns it off
+speculative_callback_limit = 0
+speculative_response_deadline = 30.0  # when speculating, give up on callbacks after this many seconds
+inbound_channel_limit = 20  # messages waiting in one channel before the dispatcher starts shedding load
+inbound_service_limit = 200  # messages waiting across all of a service's channels before it starts shedding load
+# What to try, in order, when a message arrives and its queue is full:
+#   "collapse": if the same person already has the same message waiting, answer both with one response
+#   "drop_unaddressed": drop messages that aren't directed at Stampy, the new one or else the oldest waiting one
+# Messages directed at Stampy are never dropped, they wait their turn even if the queue is over the limit
+inbound_overflow_policies = ["collapse", "drop_unaddressed"]
+blocking_pool_workers = 16  # threads for blocking calls (sync callbacks, HTTP APIs), separate from the module threads
+# How many blocking calls to each backend may run at once. Sync callbacks count against their module's class name
+blocking_backend_limits = {"openai": 4, "gooseai": 4, "wiki": 2, "youtube": 2, "DuckDuckGo": 4, "Wolfram": 2}
+blocking_default_limit = 4
+blocking_slow_call_seconds = 10.0  # log a warning about blocking calls that take longer than this
+module_tick_interval = 1.0  # seconds between calls to Module.tick, for modules that have one
+youtube_check_interval = 10.0  # seconds between looking at whether it's time to check for new YouTube comments
+youtube_min_cooldown = 60  # seconds between YouTube comment polls, going up by this much each time nothing's new
+youtube_max_cooldown = 1200
+youtube_max_pages = 10  # most pages of comments one poll will go back through
+youtube_daily_quota = 10000  # YouTube API quota units we're allowed per day
+youtube_question_batch_size = 10  # most new comments added to the question queue at a time
+# (messages, per seconds) each channel may be sent, by service. Discord's per-channel bucket is 5 per 5 seconds
+outbox_rate_limits = {"Discord": (5, 5.0), "Slack": (1, 1.0)}
+outbox_message_length_limits = {"Discord": 2000, "Slack": 4000}
+question_check_interval = 60.0  # seconds between looking at whether it's time to post a question from the queue
+module_loader_workers = 8  # threads constructing modules at startup
+database_pragmas = ["journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY", "cache_size=-8000"]  # per connection
+database_busy_timeout = 5.0  # seconds to wait for another connection's write lock before giving up
+database_cached_statements = 256  # prepared statements each connection keeps around
+message_cache_size = 512  # Discord messages kept after being fetched, mostly so reactions don't refetch them
+message_cache_ttl = 600.0  # seconds a fetched Discord message is kept
+stamp_solver_tolerance = 1e-12  # stop iterating once no user's stamp score changes by more than this
+stamp_solver_max_iterations = 10000  # give up and use what we've got after this many
+stamp_leaderboard_size = 10  # how many people the stamp leaderboard lists, unless asked for more
+stamp_export_interval = 60.0  # seconds between checking whether the stamp scores need exporting for the website
+stamp_export_threshold = 0.01  # only export if someone's stamps have changed by more than this
+stamp_rebuild_concurrency = 4  # channels scanned at once when rebuilding the stamp history
+stamp_rebuild_rate_limit = (20, 1.0)  # (Discord API calls, per seconds) the stamp history rebuild may make
+stamp_rebuild_batch_size = 500  # messages scanned between saving votes and checkpoints during a rebuild
+stamp_rebuild_progress_interval = 60.0  # seconds between progress reports while rebuilding the stamp history
+stamp_snapshot_interval = 3600  # seconds; the stamp score history keeps the last snapshot from each interval
+stamp_snapshot_retention = 400 * 24 * 3600  # seconds to keep stamp score snapshots for
+stamp_recalculation_window = 10.0  # seconds stamp votes are buffered for before being written and the scores recalculated
+# upper bounds, in seconds, of the latency histogram buckets published on the Flask app's /metrics route
+metrics_latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+metrics_summary_lines = 15  # how many of the slowest things the stats command lists
 subs_dir = "./database/subs"
 youtube_api_service_name = "youtube"
 youtube_api_version = "v3"
@@ -74,6 +124,8 @@ wolfram_token = getenv("WOLFRAM_TOKEN", default=None)
 # These defaults are just to not break production until slack is set up.
 slack_app_token = getenv("SLACK_APP_TOKEN", default=None)
 slack_bot_token = getenv("SLACK_BOT_TOKEN", default=None)
+# Where to find local copies of the GPT tokenizers, instead of the HuggingFace cache (see api/utilities/tokenizers.py)
+tokenizers_dir = getenv("TOKENIZERS_DIR", default=None)
 
 wiki_config = {"uri": "https://stampy.ai/w/api.php", "user": "Stampy@stampy", "password": wiki_password}
 
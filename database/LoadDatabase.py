@@ -8,10 +8,12 @@ script_name = os.path.basename(__file__)
 
 
 def drop_tables():
-    db.query("drop table questions")
-    db.query("drop table users")
-    db.query("drop table uservotes")
-    db.commit()
+    with db.transaction():
+        db.query("drop table questions")
+        db.query("drop table users")
+        db.query("drop table uservotes")
+        db.query("DROP TABLE IF EXISTS stamp_snapshots")
+        db.query("DROP TABLE IF EXISTS vote_events")
 
 
 def create_tables():
@@ -23,61 +25,61 @@ def create_tables():
         "CREATE TABLE uservotes (user INT NOT NULL, votedFor INT NOT "
         "NULL, votecount INT DEFAULT 1, PRIMARY KEY(user,votedFor))"
     )
+    util.create_stamp_snapshots_table()
+    util.create_vote_events_table()
 
 
 def load_questions(file):
     with open(file) as qqfile:
         qq = json.load(qqfile)
 
-    db.query("DELETE FROM questions")
+    with db.transaction():
+        db.query("DELETE FROM questions")
 
-    for question in qq:
+        for question in qq:
 
-        url = question["url"]
-        username = question["username"]
-        title = question["title"]
-        text = question["text"]
-        log.info(script_name, msg="Inserting question: {0}".format(url))
-        db.query(
-            "INSERT INTO questions VALUES (?,?,?,?,?,?,?);", (url, username, title, text, False, False, None),
-        )
-
-    db.commit()
+            url = question["url"]
+            username = question["username"]
+            title = question["title"]
+            text = question["text"]
+            log.info(script_name, msg="Inserting question: {0}".format(url))
+            db.query(
+                "INSERT INTO questions VALUES (?,?,?,?,?,?,?);", (url, username, title, text, False, False, None),
+            )
 
 
 def load_users(file):
     with open(file) as usersFile:
         users = json.load(usersFile)
 
-    db.query("DELETE FROM users")
-
-    for i in users:
-        user = users[i]
-        vote_count = user["votecount"]
-        log.info(script_name, msg="Loading user vote for " + i)
-        db.query("INSERT INTO users VALUES (?,?)", (i, vote_count))
+    with db.transaction():
+        db.query("DELETE FROM users")
 
-    db.commit()
+        for i in users:
+            user = users[i]
+            vote_count = user["votecount"]
+            log.info(script_name, msg="Loading user vote for " + i)
+            db.query("INSERT INTO users VALUES (?,?)", (i, vote_count))
 
 
 def load_votes(file):
     with open(file) as usersFile:
         users = json.load(usersFile)
 
-    db.query("DELETE FROM uservotes")
-
-    for i in users:
-        user = users[i]
-        votes = user["votes"]
-        for vote in votes:
-            log.info(
-                script_name,
-                msg="adding vote for user: {0} votedFor: {1} count: {2}".format(i, vote, votes[vote]),
-            )
+    with db.transaction():
+        db.query("DELETE FROM uservotes")
+        db.query("DELETE FROM vote_events")
 
-            db.query("INSERT INTO uservotes VALUES (?,?,?)", (i, vote, votes[vote]))
+        for i in users:
+            user = users[i]
+            votes = user["votes"]
+            for vote in votes:
+                log.info(
+                    script_name,
+                    msg="adding vote for user: {0} votedFor: {1} count: {2}".format(i, vote, votes[vote]),
+                )
 
-    db.commit()
+                util.add_vote_events([(0, None, None, i, vote, votes[vote])])
 
 
 util = utilities.Utilities.get_instance()
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from database.database import Database
+from structlog import get_logger
+from typing import Callable
+from utilities.metrics import Metrics, timed
+
+log = get_logger()
+class_name = "AsyncDatabase"
+
+
+class AsyncDatabase:
+    """Runs database work on a dedicated thread, so async code can await it instead of stalling the event loop
+    while SQLite waits on the disk, or while the stamps are recalculated.
+
+    Requests run one at a time, in the order they were made, so writes never wait on each other's locks.
+    How long each request waited and took is recorded in the metrics, along with how many are queued up.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Database")
+        self.depth = 0  # requests waiting or running
+        self.depth_lock = threading.Lock()
+        Metrics.get_instance().register_gauge("database_queue_depth", lambda: self.depth)
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """Queue func to be called on the database thread, without waiting for it. Can be called from any thread.
+        func can use the Database, or anything that does (like the vote methods on Utilities)"""
+        queued = time.monotonic()
+        operation = getattr(func, "__name__", "call")
+
+        def call():
+            Metrics.get_instance().observe("database_wait", time.monotonic() - queued, operation=operation)
+            with timed("database", operation=operation):
+                return func(*args, **kwargs)
+
+        def finished(future: Future) -> None:
+            with self.depth_lock:
+                self.depth -= 1
+            if not future.cancelled() and future.exception():
+                log.error(class_name, msg=f"Database request {operation} failed", error=future.exception())
+
+        with self.depth_lock:
+            self.depth += 1
+        future = self.executor.submit(call)
+        future.add_done_callback(finished)
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Call func on the database thread, and wait for its result"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    async def query(self, sql, args=None) -> list[tuple]:
+        return await self.run(self.db.query, sql, args)
+
+    async def execute_many(self, sql, rows) -> None:
+        await self.run(self.db.execute_many, sql, list(rows))
+
+    async def transaction(self, func: Callable, *args, **kwargs):
+        """Call func on the database thread, inside one transaction"""
+
+        def in_transaction():
+            with self.db.transaction():
+                return func(*args, **kwargs)
+
+        in_transaction.__name__ = getattr(func, "__name__", "transaction")
+        return await self.run(in_transaction)
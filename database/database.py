@@ -1,6 +1,9 @@
+from collections.abc import Iterable, Iterator
+from config import database_pragmas, database_busy_timeout, database_cached_statements
+from contextlib import contextmanager
 from structlog import get_logger
-from threading import RLock
 import sqlite3
+import threading
 
 ###########################################################################
 #   SQLite Database Wrapper
@@ -9,65 +12,105 @@ log = get_logger()
 
 
 class Database:
+    """Long-lived SQLite connections, one per thread, opened the first time each thread uses the database.
+
+    Each new connection gets the `database_pragmas` from config (WAL mode and friends), and keeps a cache of
+    prepared statements, so running the same SQL again doesn't recompile it. Statements are committed as
+    they run, unless they're inside a `transaction()`, which commits them all at once at the end (or rolls
+    them all back if anything goes wrong). `query()` returns every row, and `iterate()` streams them instead.
+    """
+
     def __init__(self, name=None):
         self.class_name = self.__class__.__name__
-        self.connected = False
-        self.conn = None
-        self.cursor = None
         self.name = name
-        self.lock = RLock()
+        self.local = threading.local()
+        self.connections: list[sqlite3.Connection] = []  # every thread's, so close() can get them all
+        self.lock = threading.Lock()
 
-    def open(self):
-        name = self.name
-        if name:
-            try:
-                self.conn = sqlite3.connect(name)
-                self.cursor = self.conn.cursor()
-                self.connected = True
-                return
-            except sqlite3.Error as e:
-                log.error(self.class_name, error="Error connecting to database!", exception=e)
-        log.error(self.class_name, error="Database not specified! Cannot open!")
+    @property
+    def connected(self) -> bool:
+        """Whether this thread has a connection open"""
+        return getattr(self.local, "conn", None) is not None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This thread's connection"""
+        if not self.connected:
+            if not self.name:
+                log.error(self.class_name, error="Database not specified! Cannot open!")
+                raise sqlite3.OperationalError("Database not specified")
+            conn = sqlite3.connect(
+                self.name,
+                timeout=database_busy_timeout,
+                isolation_level=None,  # we BEGIN and COMMIT ourselves, in transaction()
+                check_same_thread=False,  # only so close() can close every thread's connection
+                cached_statements=database_cached_statements,
+            )
+            for pragma in database_pragmas:
+                conn.execute(f"PRAGMA {pragma}")
+            self.local.conn = conn
+            self.local.transaction_depth = 0
+            with self.lock:
+                self.connections.append(conn)
+        return self.local.conn
 
     def close(self):
-        if self.conn:
-            self.conn.commit()
-            self.cursor.close()
-            self.conn.close()
-        self.connected = False
-        self.lock.release()
-
-    def try_open(self):
-        self.lock.acquire()
-        while not self.connected:
-            self.open()
-
-    def __enter__(self):
+        """Close every thread's connection. They'll be opened again if they're used"""
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+    def query(self, sql, args=None) -> list[tuple]:
+        """Run one statement, and return all the rows it produces"""
+        return self.conn.execute(sql, args or ()).fetchall()
+
+    def iterate(self, sql, args=None) -> Iterator[tuple]:
+        """Run one statement, and yield the rows it produces one at a time, without loading them all at once"""
+        cursor = self.conn.execute(sql, args or ())
         try:
-            self.try_open()
-            return self
-        except sqlite3.Error:
-            self.close()
-            raise
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def execute_many(self, sql, rows: Iterable) -> None:
+        """Run one statement for each set of arguments in rows, all in one transaction"""
+        with self.transaction():
+            self.conn.executemany(sql, rows)
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
+    @contextmanager
+    def transaction(self):
+        """Run everything inside as one transaction, committed at the end, or rolled back if anything raises.
+        A transaction inside another one just becomes part of the outer one"""
+        conn = self.conn
+        if self.local.transaction_depth:
+            self.local.transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self.local.transaction_depth -= 1
+            return
 
-    def query(self, sql, args=None):
-        self.try_open()
-        if args is not None:
-            self.cursor.execute(sql, args)
+        conn.execute("BEGIN IMMEDIATE")
+        self.local.transaction_depth = 1
+        try:
+            yield self
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
         else:
-            self.cursor.execute(sql)
-        data = self.cursor.fetchall()
-        self.close()
+            conn.execute("COMMIT")
+        finally:
+            self.local.transaction_depth = 0
 
-        return data
+    def has_table(self, table) -> bool:
+        return bool(self.query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)))
 
     def commit(self):
         """
-        This now commits with every query so this function is not necessary.
-        Changed to pass to not break existing code.
+        Statements outside a transaction() are committed as they run, so this function is not necessary.
+        Kept as pass to not break existing code.
         """
         pass
 
@@ -1,10 +1,12 @@
 import re
 import zipfile
+from functools import cached_property
 import requests
 from io import BytesIO
 from lxml import etree
 from structlog import get_logger
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
+from utilities.blocking import run_blocking
 
 spreadsheet_url = (
     "https://docs.google.com/spreadsheets/d/1PwWbWZ6FPqAgZWOoOcXM8N_tUCuxpEyMbN1NYYC02aM/export?format=zip"
@@ -30,8 +32,15 @@ class AlignmentNewsletterSearch(Module):
             + noun_regex
             + """ [Ss]earch) (?P<query>.+)"""
         )
-        self.items = []
-        self.load_items()
+        self.triggers = Triggers(addressed=True, prefixes=[self.re_search])
+
+    def warm_up(self):
+        self.items  # loads them, if they haven't been already
+
+    @cached_property
+    def items(self):
+        """The newsletter's items, downloaded the first time they're needed"""
+        return self.load_items()
 
     class Item:
         def __init__(self):
@@ -57,6 +66,8 @@ class AlignmentNewsletterSearch(Module):
         # regex for pulling the first markdown link, with its title and url
         re_markdown_link = re.compile(rb"""\[(?P<title>[^\]]+)\]\((?P<url>[^\)]+)\)""")
 
+        items = []
+
         # download the sheet as zipped html from the google sheets API.
         response = requests.get(spreadsheet_url)
 
@@ -109,7 +120,9 @@ class AlignmentNewsletterSearch(Module):
                         etree.tostring(row[10], method="text", encoding="UTF-8").decode("utf-8") or ""
                     )
 
-                    self.items.append(item)
+                    items.append(item)
+
+        return items
 
     @staticmethod
     def extract_keywords(query):
@@ -166,13 +179,13 @@ class AlignmentNewsletterSearch(Module):
         return matches
 
     def process_message(self, message):
-        if self.is_at_me(message):
-            text = self.is_at_me(message)
-
+        if text := self.is_at_me(message):
             m = re.match(self.re_search, text)
             if m:
                 query = m.group("query")
-                return Response(confidence=9, callback=self.process_search_request, args=[query])
+                return Response(
+                    confidence=9, callback=self.process_search_request, args=[query], speculative=True
+                )
 
         # This is either not at me, or not something we can handle
         return Response()
@@ -196,7 +209,7 @@ class AlignmentNewsletterSearch(Module):
 
     async def process_search_request(self, query):
         self.log.info(self.class_name, newsletter_querry=query)
-        result = self.search(query)
+        result = await run_blocking("newsletter", self.search, query)  # may load the items, if warm_up hasn't yet
         if result:
             self.log.info(self.class_name, newsletter_querry_result=result)
             return Response(
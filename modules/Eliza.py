@@ -1,11 +1,13 @@
 import re
 import random
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
 from database.eliza_db import psychobabble, reflections
 from utilities.serviceutils import ServiceMessage
 
 
 class Eliza(Module):
+    triggers = Triggers(addressed=True)
+
     def __init__(self):
         super().__init__()
         self.class_name = self.__class__.__name__
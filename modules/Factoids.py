@@ -25,7 +25,6 @@ class Factoids(Module):
         self.class_name = self.__class__.__name__
         dbpath = "factoids.db"
         self.db = self.FactoidDb(dbpath)
-        self.who = "Someone"
         self.re_replace = re.compile(r".*?({{.+?}})")
         self.re_verb = re.compile(r".*?<([^>]+)>")
 
@@ -113,8 +112,9 @@ class Factoids(Module):
 
     def process_message(self, message):
         atme = False
-        self.who = message.author.name
-        self.utils.people.add(self.who)
+        # process_message can run for several messages at once, so keep per-message state local
+        who = message.author.name
+        self.utils.people.add(who)
         result = ""
 
         try:
@@ -141,8 +141,8 @@ class Factoids(Module):
         m = re.match(re_factoid_request, text)
         if m:
             query = m.group("query")
-            query = re.sub(r"\bmy\b", f"{self.who}'s", query)
-            query = re.sub(r"\bme\b", self.who, query)
+            query = re.sub(r"\bmy\b", f"{who}'s", query)
+            query = re.sub(r"\bme\b", who, query)
             self.log.info(self.class_name, query=query)
 
             if not factoids:
@@ -155,8 +155,8 @@ class Factoids(Module):
             pf = self.prevFactoid[room]
             del self.prevFactoid[room]
             self.db.remove(*pf)
-            result += """Ok %s, forgetting that "%s" %s "%s"\n""" % (self.who, pf[0], pf[3], pf[1],)
-            why = """%s told me to forget that "%s" %s "%s"\n""" % (self.who, pf[0], pf[3], pf[1],)
+            result += """Ok %s, forgetting that "%s" %s "%s"\n""" % (who, pf[0], pf[3], pf[1],)
+            why = """%s told me to forget that "%s" %s "%s"\n""" % (who, pf[0], pf[3], pf[1],)
             return Response(confidence=10, text=result, why=why)
 
         # if the text is a valid factoid, maybe reply
@@ -168,9 +168,9 @@ class Factoids(Module):
             if verb == "reply":
                 result = value
             else:
-                result = "%s %s %s" % (re.sub(f"{self.who}'s", "your", key), verb, value)
+                result = "%s %s %s" % (re.sub(f"{who}'s", "your", key), verb, value)
 
-            why = '%s said the factoid "%s" so I said "%s"' % (self.who, key, rawvalue,)
+            why = '%s said the factoid "%s" so I said "%s"' % (who, key, rawvalue,)
             self.prevFactoid[room] = (key, rawvalue, by, verb)  # key, value, verb
             if atme:
                 return Response(confidence=9, text=result, why=why)
@@ -207,16 +207,16 @@ class Factoids(Module):
                     else:
                         key, _, value = text.partition(" %s " % verb)
 
-                    key = re.sub(r"\bmy\b", f"{self.who}'s", key)
+                    key = re.sub(r"\bmy\b", f"{who}'s", key)
 
-                    new_key = re.sub(r"\bI\b", f"{self.who}", key)
+                    new_key = re.sub(r"\bI\b", f"{who}", key)
                     if new_key != key:
                         key = new_key
                         if verb == "am":
                             verb = "is"
 
-                    result = """Ok %s, remembering that "%s" %s "%s" """ % (self.who, key, verb, value,)
-                    why = "%s told me to remember that '%s' %s '%s'" % (self.who, key, verb, value,)
+                    result = """Ok %s, remembering that "%s" %s "%s" """ % (who, key, verb, value,)
+                    why = "%s told me to remember that '%s' %s '%s'" % (who, key, verb, value,)
                     self.log.info(
                         self.class_name,
                         msg="adding factoid %s : %s" % (key, value),
@@ -239,7 +239,7 @@ class Factoids(Module):
                     result += "\n<%s> '%s' by %s" % value
                 if len(values) > count:
                     result += "\n and %s more" % (len(values) - count)
-                why = "%s asked me to list the values for the factoid '%s'" % (self.who, fact,)
+                why = "%s asked me to list the values for the factoid '%s'" % (who, fact,)
                 return Response(confidence=10, text=result, why=why)
 
         # This is either not at me, or not something we can handle
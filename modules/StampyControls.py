@@ -1,10 +1,16 @@
+import re
 import sys
 import discord
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
 from config import TEST_RESPONSE_PREFIX
+from servicemodules.dispatcher import Dispatcher
+from servicemodules.outbox import Outbox
 from servicemodules.serviceConstants import Services
 from servicemodules.discordConstants import bot_admin_role_id, stampy_control_channel_ids, can_invite_role_id, member_role_id
 from utilities import Utilities, get_github_info, get_memory_usage, get_running_user_info, get_question_id
+from utilities.blocking import BlockingPool
+from utilities.metrics import Metrics
+from utilities.scheduler import Scheduler
 
 
 class StampyControls(Module):
@@ -24,6 +30,9 @@ class StampyControls(Module):
             "stats": self.get_stampy_stats,
             "add member role to everyone": self.add_member_role,
         }
+        self.triggers = Triggers(
+            addressed=True, prefixes=[re.compile("(%s)$" % "|".join(map(re.escape, self.routines)), re.I)]
+        )
 
     def is_at_module(self, message):
         text = self.is_at_me(message)
@@ -81,7 +90,7 @@ class StampyControls(Module):
             )
         self.log.info(self.class_name, msg="[resetting can-invite roles]")
         await self.send_control_message(message, self.RESET_INVITES_MESSAGE)
-        guild = discord.utils.find(lambda g: g.name == self.utils.GUILD, self.utils.client.guilds)
+        guild = self.utils.get_guild()
         self.log.info(
             self.class_name,
             utility_guild=self.utils.GUILD,
@@ -164,7 +173,17 @@ class StampyControls(Module):
         runtime_message = self.utils.get_time_running()
         modules_message = self.utils.list_modules()
         # scores_message = self.utils.modules_dict["StampsModule"].get_user_scores()
-        return "\n\n".join([git_message, run_message, memory_message, runtime_message, modules_message])
+        messages = [git_message, run_message, memory_message, runtime_message, modules_message]
+        if blocking_message := BlockingPool.get_instance().summary():
+            messages.append("Blocking calls:\n" + blocking_message)
+        if jobs_message := Scheduler.get_instance().summary():
+            messages.append("Scheduled jobs:\n" + jobs_message)
+        if metrics_message := Metrics.get_instance().summary():
+            messages.append("Slowest:\n" + metrics_message)
+        messages.append("Inbound: " + Dispatcher.get_instance().inbound_summary())
+        messages.append("Outbox: " + Outbox.get_instance().summary())
+        messages.append("Message cache: " + self.utils.message_cache.summary())
+        return "\n\n".join(messages)
 
     async def get_stampy_stats(self, message):
         """
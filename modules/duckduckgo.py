@@ -1,10 +1,13 @@
 import re
 import json
 import urllib
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
+from utilities.metrics import timed
 
 
 class DuckDuckGo(Module):
+    triggers = Triggers(addressed=True)
+
     IRRELEVANT_WORDS = ["film", "movie", "tv", "song", "album", "band"]
 
     def process_message(self, message):
@@ -14,6 +17,7 @@ class DuckDuckGo(Module):
                 return Response(
                     confidence=6,
                     callback=self.ask,
+                    speculative=True,
                     args=[text],
                     why="It's a question, we might be able to answer it",
                 )
@@ -21,6 +25,7 @@ class DuckDuckGo(Module):
                 return Response(
                     confidence=2,
                     callback=self.ask,
+                    speculative=True,
                     args=[text],
                     why="It's not a question but we might be able to look it up",
                 )
@@ -49,7 +54,8 @@ class DuckDuckGo(Module):
             % urllib.parse.quote_plus(q)
         )
         try:
-            data = urllib.request.urlopen(url).read()
+            with timed("external_call", service="duckduckgo"):
+                data = urllib.request.urlopen(url).read()
             j = json.loads(data)
 
             self.log.info("DuckDuckGo", query=q, url=url)
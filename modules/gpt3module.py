@@ -1,11 +1,14 @@
 from api.gooseai import GooseAI
 from api.openai import OpenAI
+from api.utilities.gooseutils import GooseAIEngines
+from api.utilities.openai import OpenAIEngines
 from config import (
     CONFUSED_RESPONSE,
     openai_api_key,
     goose_api_key,
 )
 from modules.module import Module, Response
+from utilities.blocking import run_blocking
 from utilities.serviceutils import ServiceMessage
 from servicemodules.serviceConstants import service_italics_marks, default_italics_mark
 from servicemodules.discordConstants import rob_id, stampy_id
@@ -54,6 +57,13 @@ class GPT3Module(Module):
                 self.class_name,
                 warning="No API key found in env for any of the GPT3 providers."
             )
+
+    def warm_up(self):
+        # the tokenizers are slow to load, so don't leave it to the first chat, which would block the event loop
+        engines = (list(OpenAIEngines) if self.openai else []) + (list(GooseAIEngines) if self.gooseai else [])
+        for engine in engines:
+            engine.tokenizer  # loads it, if it hasn't been already
+
     def process_message(self, message: ServiceMessage) -> Response:
         self.message_log_append(message)
 
@@ -65,7 +75,7 @@ class GPT3Module(Module):
         if not self.is_at_me(message):
             return Response()
 
-        return Response(confidence=2, callback=self.gpt3_chat, args=[message], kwargs={})
+        return Response(confidence=2, callback=self.gpt3_chat, args=[message], kwargs={}, speculative=True)
 
     def process_message_from_stampy(self, message):
         self.message_log_append(message)
@@ -182,7 +192,7 @@ class GPT3Module(Module):
 
         if self.openai.is_channel_allowed(message):
             self.log.info(self.class_name, msg="sending chat prompt to openai", engine=engine)
-            response = self.openai.get_response(engine, prompt, logit_bias)
+            response = await run_blocking("openai", self.openai.get_response, engine, prompt, logit_bias)
             self.log.info(self.class_name, response=response)
             if response != "":
                 return Response(confidence=10, text=f"{im}{response}{im}", why="OpenAI GPT-3 made me say it!")
@@ -205,7 +215,7 @@ class GPT3Module(Module):
 
 
         self.log.info(self.class_name, msg="sending chat prompt to goose.ai", engine=engine)
-        response = self.gooseai.get_response(engine, prompt, logit_bias)
+        response = await run_blocking("gooseai", self.gooseai.get_response, engine, prompt, logit_bias)
         self.log.info(self.class_name, response=response)
         if response != "":
             return Response(confidence=10, text=f"{im}{response}{im}", why="GooseAI GPT-3 made me say it!")
@@ -230,7 +240,9 @@ class GPT3Module(Module):
                 )
 
             try:
-                response = openai.Completion.create(
+                response = await run_blocking(
+                    "openai",
+                    openai.Completion.create,
                     engine=engine,
                     prompt=prompt,
                     temperature=0,
@@ -2,7 +2,7 @@ import re
 import discord
 from servicemodules.discordConstants import rob_id
 from servicemodules.serviceConstants import Services
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
 
 
 class InviteManager(Module):
@@ -13,6 +13,7 @@ class InviteManager(Module):
             r"([pP]lease )?(([cC]an|[cC]ould) you )?(([Cc]reate|[mM]ake|[gG]ive|[gG]enerate) (me )?|"
             "([Cc]an|[mM]ay) [iI] (get|have) )((an|a new|my|\d+) )?[Ii]nvites?( link)?s?,?( please| pls)?"
         )
+        self.triggers = Triggers(addressed=True, prefixes=[self.re_request], services=[Services.DISCORD])
         self.sorry_message = (
             "Sorry, you don't have the `can-invite` role.\nEither you recently "
             "joined the server, or you've already been given an invite this week"
@@ -22,9 +23,7 @@ class InviteManager(Module):
         if message.service != Services.DISCORD:
             return Response()
         guild, invite_role = self.get_guild_and_invite_role()
-        if self.is_at_me(message):
-            text = self.is_at_me(message)
-
+        if text := self.is_at_me(message):
             m = re.match(self.re_request, text)
             if m:
                 member = guild.get_member(int(message.author.id))
@@ -44,7 +43,7 @@ class InviteManager(Module):
     async def post_invite(self, message):
         """Generate and send one or more invites"""
         guild, invite_role = self.get_guild_and_invite_role()
-        welcome = discord.utils.find(lambda c: c.name == "welcome", guild.channels)
+        welcome = self.utils.get_channel_by_name("welcome", guild)
         member = guild.get_member(message.author.id)
 
         text = self.is_at_me(message)
@@ -2,15 +2,41 @@ import re
 import random
 import discord
 from structlog import get_logger
-from config import TEST_QUESTION_PREFIX
 from dataclasses import dataclass, field
-from utilities import Utilities, get_question_id
-from utilities.utilities import is_stampy_mentioned, stampy_is_author, get_guild_and_invite_role
-from typing import Callable, Iterable, Literal, Optional, Union
+from utilities import Utilities
+from utilities.utilities import clean_test_prefixes, get_guild_and_invite_role
+from typing import Callable, Iterable, Literal, Optional, Pattern, Union
+from servicemodules.serviceConstants import Services
 from utilities.serviceutils import ServiceMessage
 
 log = get_logger()
 
+@dataclass
+class Triggers:
+    """Which messages a module could possibly respond to, so the dispatcher can skip asking it about the rest.
+
+    A module that sets `triggers` is only asked about a message if all of these hold:
+        - `services` is empty, or the message came from one of them
+        - `addressed` is False, or the message is directed at Stampy (see `Module.is_at_me`)
+        - `prefixes` and `keywords` are both empty, or the text starts with a match for one of the
+          `prefixes` regexes, or contains one of the `keywords` as whole words, ignoring case.
+          Prefixes are matched against the text with Stampy's name stripped off if `addressed` is set
+
+    For example, a module which only handles "stampy, reboot" could declare
+
+        triggers = Triggers(addressed=True, prefixes=[r"(?i:reboot$)"])
+
+    It's only asked about reaction events whose emoji name is in `reactions`.
+    Modules that leave `triggers` as None are asked about every message and every reaction, so only
+    declare triggers if `process_message` never responds to anything outside them.
+    """
+
+    addressed: bool = False
+    prefixes: Iterable[Union[str, Pattern]] = ()
+    keywords: Iterable[str] = ()
+    services: Iterable[Services] = ()
+    reactions: Iterable[str] = ()
+
 
 @dataclass
 class Response:
@@ -75,6 +101,11 @@ class Response:
     "What confidence of response would another module have to give, such that it would be not worth
     running this callback?". This will vary depending on: how good the response could be, how likely
     a good response is, and how slow/expensive the callback function is.
+
+    If a callback only looks something up, and it's harmless to run it and then throw the result away,
+    set `speculative=True`. When `speculative_callback_limit` is set in the config, Stampy may then start
+    it before it's the top response, alongside other speculative callbacks, and cancel it if a
+    better response comes back first. Never set this on callbacks that change anything.
     """
 
     embed: Optional[discord.Embed] = None
@@ -83,6 +114,7 @@ class Response:
     callback: Optional[Callable] = None
     args: list = field(default_factory=list)
     kwargs: dict = field(default_factory=dict)
+    speculative: bool = False
 
     module: object = None
 
@@ -95,6 +127,13 @@ class Response:
 class Module:
     utils: Utilities
 
+    # Seconds this module's process_message gets before the dispatcher drops its response.
+    # None means use the default, config.module_process_message_deadline
+    process_message_deadline: Optional[float] = None
+
+    # Which messages this module cares about, see Triggers. None means ask it about everything
+    triggers: Optional[Triggers] = None
+
     def __init__(self):
         self.utils = Utilities.get_instance()
         self.class_name = "BaseModule"
@@ -108,7 +147,8 @@ class Module:
 
     def process_message(self, message: ServiceMessage):
         """Handle the message, return a string which is your response.
-        This is an async function so it can interact with the Discord API if it needs to.
+        This may be a plain or an async function. Plain functions are run in a worker thread, at the same
+        time as the other modules are being asked, so don't keep per-message state on `self`.
         If confidence is more than zero, and the message is empty, `processMessage` may be called
         `can_process_message` should contain only operations which can be executed safely even if
         another module reports a higher confidence and ends up being the one to respond.If your
@@ -145,14 +185,19 @@ class Module:
         Use this to allow modules to handle adding and removing reactions on messages"""
         return Response()
 
+    def warm_up(self):
+        """If a module has this, it's called once in the background after Stampy has connected to Discord.
+        Anything slow a module needs but can start without (downloads, parsing big files) should be loaded
+        lazily on first use and warmed up here, rather than in __init__, so Stampy gets going faster."""
+        pass
+
     async def tick(self):
-        """This function will be called all the time, whenever anything happens on the discord.
-        Use it for things that need to happen regularly, but RATE LIMIT IT!
-        ALWAYS call self.utils.rate_limit() first thing in the function, so it doesn't happen too much.
-        For example:
+        """If a module has this, it's called every `module_tick_interval` seconds (see config) once Stampy
+        has connected to Discord. Use it for things that need to happen regularly.
+        For anything that should happen less often, use self.utils.rate_limit() first thing in the function,
+        or register a job of your own with the Scheduler instead. For example:
 
-        if self.utils.rate_limit("check youtube API", seconds=30):
-            return"""
+        Scheduler.get_instance().register("check youtube API", self.check_youtube, interval=30)"""
         pass
 
     def __str__(self):
@@ -177,12 +222,7 @@ class Module:
 
     @staticmethod
     def clean_test_prefixes(message, prefix):
-        text = message.clean_content
-        prefix_number = get_question_id(message)
-        prefix_with_number = prefix + str(prefix_number) + ": "
-        if prefix_with_number == text[: len(prefix_with_number)]:
-            return text[len(prefix_with_number) :]
-        return text
+        return clean_test_prefixes(message, prefix)
 
     def is_at_me(self, message: ServiceMessage) -> Union[str, Literal[False]]:
         """
@@ -190,34 +230,7 @@ class Module:
         If it's not, return False. If it is, strip away the
         name part and return the remainder of the message
         """
-        text = message.clean_content
-        if self.utils.test_mode:
-            if stampy_is_author(message):
-                if TEST_QUESTION_PREFIX in message.clean_content:
-                    text = "stampy " + self.clean_test_prefixes(message, TEST_QUESTION_PREFIX)
-        at_me = is_stampy_mentioned(message)
-        re_at_me = re.compile(r"^@?[Ss]tampy\W? ")
-
-        if (re_at_me.match(text) is not None) or re.search(r"^[sS][,:]? ", text):
-            at_me = True
-            text = text.partition(" ")[2]
-        elif re.search(",? @?[sS](tampy)?[.!?]?$", text):  # name can also be at the end
-            text = re.sub(",? @?[sS](tampy)?(?P<punctuation>[.!?]*)$", "\g<punctuation>", text)
-            at_me = True
-
-        if message.is_dm:
-            # DMs are always at you
-            at_me = True
-
-        if Utilities.get_instance().client.user in message.mentions:
-            # regular mentions are already covered above, this covers the case that someone reply @'s Stampy
-            self.log.info(self.class_name, msg="Classified as 'at stampy' because of mention")
-            at_me = True
-
-        if at_me:
-            return text
-        else:
-            return False
+        return message.addressed_text
 
     def get_guild_and_invite_role(self):
         return get_guild_and_invite_role()
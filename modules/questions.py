@@ -1,12 +1,15 @@
 import re
 from api.semanticwiki import SemanticWiki
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
+from utilities.blocking import run_blocking
 from utilities.serviceutils import ServiceMessage
 
 
 class QuestionQueueManager(Module):
     """Module to manage commands about the question queue"""
 
+    triggers = Triggers(addressed=True)
+
     EMPTY_QUEUE_MESSAGE = "There are no questions in the queue"
     
     def __init__(self):
@@ -100,7 +103,7 @@ class QuestionQueueManager(Module):
     ) -> Response:
         if self.utils.test_mode:
             return Response(confidence=9, text=self.EMPTY_QUEUE_MESSAGE, why="test")
-        result = self.utils.get_question(wiki_question_bias=wiki_question_bias)
+        result = await run_blocking("wiki", self.utils.get_question, wiki_question_bias=wiki_question_bias)
         self.log.info("QQManager", post_question_result=result, message_author=message.author.name)
         if result:
             return Response(
@@ -3,14 +3,17 @@ import json
 import discord
 from datetime import datetime
 from api.semanticwiki import QuestionSource
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
 from config import stampy_youtube_channel_id, comment_posting_threshold_factor
+from utilities.blocking import run_blocking
 from utilities.discordutils import DiscordMessage
 
 
 class Reply(Module):
     POST_MESSAGE = "Ok, I'll post this when it has more than %s stamp points"
 
+    triggers = Triggers(addressed=True, reactions=["stamp", "goldstamp"])
+
     def __str__(self):
         return "YouTube Reply Posting Module"
 
@@ -73,9 +76,7 @@ class Reply(Module):
         return self.utils.get_total_votes() * comment_posting_threshold_factor
 
     def process_message(self, message):
-        if self.is_at_me(message):
-            text = self.is_at_me(message)
-
+        if text := self.is_at_me(message):
             if self.is_post_request(text):
                 self.log.info(self.class_name, msg="this is a posting request")
 
@@ -119,7 +120,7 @@ class Reply(Module):
                     question_user = "Unknown User"
                 ####
                 video_url, comment_id = question_url.split("&lc=")
-                video_titles = self.utils.get_title(video_url)
+                video_titles = await run_blocking("youtube", self.utils.get_title, video_url)
                 if not video_titles:
                     # this should actually only happen in dev
                     video_titles = ["Video Title Unknown", "Video Title Unknown"]
@@ -163,13 +164,20 @@ class Reply(Module):
         )
         answer_time = datetime.now()
 
-        self.utils.wiki.add_answer(
-            answer_title, message.author.display_name, approvers, answer_time, reply_message, question_title,
+        await run_blocking(
+            "wiki",
+            self.utils.wiki.add_answer,
+            answer_title,
+            message.author.display_name,
+            approvers,
+            answer_time,
+            reply_message,
+            question_title,
         )
 
         if source == QuestionSource.YOUTUBE:
             question_id = re.match(r".*lc=([^&]+)", question_url).group(1)
-            self.post_reply(reply_message, question_id)
+            await run_blocking("youtube", self.post_reply, reply_message, question_id)
 
         return report
 
@@ -218,18 +226,23 @@ class Reply(Module):
 
         if emoji in ["stamp", "goldstamp"]:
             self.log.info(self.class_name, guild=self.utils.GUILD)
-            guild = discord.utils.find(lambda g: g.name == self.utils.GUILD, self.utils.client.guilds)
-            channel = discord.utils.find(lambda c: c.id == event.channel_id, guild.channels)
-            message = await channel.fetch_message(event.message_id)
-            if self.is_at_me(DiscordMessage(message)) and self.is_post_request(
-                self.is_at_me(DiscordMessage(message))
-            ):
+            guild = self.utils.get_guild()
+            if guild is None or event.guild_id != guild.id:
+                return
+            message = await self.utils.fetch_message(event.channel_id, event.message_id)
+            if message is None:
+                return
+            if self.is_post_request(self.is_at_me(DiscordMessage(message))):
+                # the cached message could be missing the reaction we're handling, so get it fresh
+                message = await self.utils.fetch_message(event.channel_id, event.message_id, refresh=True)
+                channel = message.channel
 
                 if self.has_been_replied_to(message):
                     return
 
                 stamp_score, approvers = await self.evaluate_message_stamps(message)
-                if stamp_score > self.comment_posting_threshold():
+                threshold = await self.utils.async_db.run(self.comment_posting_threshold)
+                if stamp_score > threshold:
                     report = await self.post_message(message, approvers)
 
                     # mark it with an envelope to show it was sent
@@ -239,7 +252,7 @@ class Reply(Module):
                 else:
                     report = "This reply has %s stamp points. I will send it when it has %s" % (
                         stamp_score,
-                        self.comment_posting_threshold(),
+                        threshold,
                     )
                     await channel.send(report)
 
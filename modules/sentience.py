@@ -1,8 +1,10 @@
 from config import CONFUSED_RESPONSE
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
 
 
 class Sentience(Module):
+    triggers = Triggers(addressed=True)
+
     def process_message(self, message):
         if self.is_at_me(message):
             self.log.info("Sentience", msg="Confused Response Sent")
@@ -1,23 +1,196 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
 import re
-from typing import Union
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Union
 import discord
 import numpy as np
+from structlog import get_logger
 from utilities import utilities
-from modules.module import Module, Response
-from config import stamp_scores_csv_file_path
+from utilities.utilities import write_atomically
+from utilities.scheduler import Scheduler
+from modules.module import Module, Response, Triggers
+from servicemodules.outbox import TokenBucket
+from config import (
+    stamp_scores_csv_file_path,
+    stamp_export_interval,
+    stamp_rebuild_concurrency,
+    stamp_rebuild_rate_limit,
+    stamp_rebuild_batch_size,
+    stamp_rebuild_progress_interval,
+    stamp_export_threshold,
+    stamp_leaderboard_size,
+    stamp_recalculation_window,
+    stamp_snapshot_interval,
+    stamp_snapshot_retention,
+    stamp_solver_tolerance,
+    stamp_solver_max_iterations,
+)
 from servicemodules.serviceConstants import Services
 from servicemodules.discordConstants import stampy_id, bot_admin_role_id
 from utilities.discordutils import DiscordMessage
 
+log = get_logger()
+class_name = "StampsModule"
+
+# asking where you come on the stamp leaderboard. Anchored, since "what is rank collapse?" isn't for us
+rank_question = r"what(?:'?s| is) my (?:stamp )?rank\??$|what rank am i\??$"
 
 vote_strengths_per_emoji = {
  "stamp": 1,
  "goldstamp": 5
 }
 
+
+def vote_strength(emoji: str, from_id: int, to_id: int, negative: bool = False) -> int:
+    """How much a vote counts for. Zero if it doesn't count at all"""
+    if (to_id == stampy_id  # votes for stampy do nothing
+        or to_id == from_id # votes for yourself do nothing
+        or emoji not in vote_strengths_per_emoji): # votes with emojis other than stamp and goldstamp do nothing
+        return 0
+    return -vote_strengths_per_emoji[emoji] if negative else vote_strengths_per_emoji[emoji]
+
+
+def user_id_of(user) -> Optional[int]:
+    """The id of a user, whether we're given a discord or service user, an id, or an id as a string"""
+    try:
+        return int(getattr(user, "id", user))
+    except (ValueError, TypeError):
+        return None
+
+
+def vote_array(votes) -> np.ndarray:
+    """Rows of (from_id, to_id, votecount) as an n x 3 array"""
+    return np.array(votes, dtype=np.int64).reshape(-1, 3)
+
+
+def apply_vote_deltas(votes: np.ndarray, events) -> np.ndarray:
+    """The vote table after the (id, from_id, to_id, delta) events, given it before them, as rows of
+    (from_id, to_id, votecount) sorted the same way as get_all_user_votes, so the fingerprint is the same"""
+    if not len(events):
+        return votes
+    rows = np.concatenate([votes, vote_array([event[1:] for event in events])])
+    pairs, inverse = np.unique(rows[:, :2], axis=0, return_inverse=True)
+    counts = np.zeros(len(pairs), dtype=np.int64)
+    np.add.at(counts, inverse.ravel(), rows[:, 2])
+    return np.column_stack([pairs, counts])
+
+
+def fingerprint(votes: np.ndarray) -> str:
+    """Identifies the contents of the vote table, given all of it in order"""
+    return hashlib.sha256(votes.tobytes()).hexdigest()
+
+
+def solve_fixed_point(
+    to_indices: np.ndarray, from_indices: np.ndarray, weights: np.ndarray, size: int, start=None
+) -> tuple[np.ndarray, int]:
+    """Iterate scores = e0 + W @ scores, where W is the sparse matrix with weights[k] at
+    (to_indices[k], from_indices[k]), until no score changes by more than stamp_solver_tolerance.
+    Every column of W adds up to at most gamma < 1, so this converges like PageRank does.
+    Returns the scores and how many iterations it took"""
+    if size == 0:
+        return np.zeros(0), 0
+    base = np.zeros(size)
+    base[0] = 1.0  # God has 1 karma
+    scores = base.copy() if start is None else np.array(start, dtype=float)
+    for iteration in range(1, stamp_solver_max_iterations + 1):
+        new_scores = base + np.bincount(to_indices, weights=weights * scores[from_indices], minlength=size)
+        change = np.abs(new_scores - scores).max(initial=0.0)
+        scores = new_scores
+        if change <= stamp_solver_tolerance:
+            return scores, iteration
+    log.warning(
+        class_name,
+        msg=f"Stamp scores hadn't converged after {stamp_solver_max_iterations} iterations",
+        change=change,
+    )
+    return scores, stamp_solver_max_iterations
+
+
+class StampRanking:
+    """Everyone's stamps in order, highest first, for leaderboards. Looking someone up is a dict lookup,
+    and their rank and percentile are binary searches. It's rebuilt after each recalculation, so it doesn't
+    include votes waiting to be counted"""
+
+    def __init__(self, ids: np.ndarray, stamps: np.ndarray):
+        users = ids != 0  # God isn't in the running
+        order = np.argsort(-stamps[users], kind="stable")
+        self.ids = ids[users][order]
+        self.stamps = stamps[users][order]
+        self.ascending = self.stamps[::-1]
+        self.stamps_by_id = dict(zip(self.ids.tolist(), self.stamps.tolist()))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def stamps_for(self, user_id: int) -> Optional[float]:
+        return self.stamps_by_id.get(user_id)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1 for whoever has the most stamps. People with the same number of stamps share a rank"""
+        stamps = self.stamps_by_id.get(user_id)
+        if stamps is None:
+            return None
+        return len(self) - int(np.searchsorted(self.ascending, stamps, side="right")) + 1
+
+    def percentile(self, user_id: int) -> Optional[float]:
+        """The percentage of people with fewer stamps"""
+        stamps = self.stamps_by_id.get(user_id)
+        if stamps is None:
+            return None
+        return int(np.searchsorted(self.ascending, stamps, side="left")) / len(self) * 100
+
+    def top(self, count: int) -> list[tuple[int, float]]:
+        return list(zip(self.ids[:count].tolist(), self.stamps[:count].tolist()))
+
+
+@dataclass
+class RebuildProgress:
+    channels: int
+    channels_done: int = 0
+    messages: int = 0
+    votes: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def summary(self) -> str:
+        minutes = (time.monotonic() - self.started) / 60
+        return (
+            f"Stamp history: {self.channels_done}/{self.channels} channels done, {self.messages} messages "
+            f"and {self.votes} votes so far, {minutes:.1f} minutes in"
+        )
+
+
+@dataclass
+class ChannelScan:
+    """How far a channel's history scan has got, and the votes it's found since it last saved"""
+
+    position: Optional[int] = None
+    events: list = field(default_factory=list)
+
+
 class StampsModule(Module):
+    triggers = Triggers(
+        addressed=True,
+        prefixes=[
+            r"(?i:how many stamps am i worth)",
+            r"(?i:how (?:has|have) my stamps? (?:value |worth )?changed)",
+            r"(?i:stamps? leaderboard)",
+            rf"(?i:{rank_question})",
+            r"reloadallstamps$",
+            r"recountallstamps$",
+        ],
+        reactions=list(vote_strengths_per_emoji),
+    )
 
     STAMPS_RESET_MESSAGE = "full stamp history reset complete"
+    STAMPS_RECOUNTED_MESSAGE = "stamps recounted from the vote log"
     UNAUTHORIZED_MESSAGE = "You can't do that!"
 
     def __str__(self):
@@ -28,107 +201,451 @@ class StampsModule(Module):
         self.class_name = "StampsModule"
         self.gamma = 0.99
         self.total_votes = self.utils.get_total_votes()
-        self.calculate_stamps()
+        # votes waiting to be written, as (from_id, to_id) -> change in votecount. Votes move to
+        # counting_votes while they're being written and the scores recalculated
+        self.votes_lock = threading.Lock()
+        self.pending_votes: Counter = Counter()
+        self.counting_votes: Counter = Counter()
+        # and each of those votes as (timestamp, message id, emoji, from_id, to_id, delta), for the vote log
+        self.pending_events: list[tuple] = []
+        # the votes the scores were last calculated from, as rows of (from_id, to_id, votecount), and (ids, scores)
+        # including the uncounted votes as well, worked out when someone asks and kept until the next vote.
+        # If we started from a snapshot, counted_votes is None until check_snapshot has read the votes
+        self.counted_votes: Optional[np.ndarray] = None
+        self.last_event_id = 0  # the last event in the vote log that counted_votes includes
+        self.provisional_scores: Optional[tuple[np.ndarray, list]] = None
+        self.votes_version = 0  # goes up with every vote, so we know whether provisional scores are out of date
+        # (ids, stamps) as last calculated and as last exported, for export_scores_if_changed
+        self.latest_stamps: Optional[tuple[np.ndarray, np.ndarray]] = None
+        self.ranking = StampRanking(np.zeros(0, dtype=np.int64), np.zeros(0))
+        self.exported_stamps: Optional[tuple[np.ndarray, np.ndarray]] = None
+        # while a stamp history rebuild is unfinished, the checkpoints it's saved (or is saving), and the scans
+        # running now. Only changed on the event loop
+        self.history_checkpoints: dict[int, tuple] = self.utils.get_history_checkpoints()
+        self.channel_scans: dict[int, ChannelScan] = {}
+
+        # the votes the latest snapshot was taken from, and the last vote log event they include, if it has them
+        self.snapshot_votes: Optional[np.ndarray] = None
+        self.snapshot_event_id: Optional[int] = None
+        # only read from the database here. Without a snapshot there are no scores until set_up_database,
+        # from warm_up, has calculated them, so that they're only solved for once
+        self.snapshot_fingerprint = self.load_snapshot()
+        if self.snapshot_fingerprint is None:
+            self.utils.users = []
+            self.utils.update_ids_list()
+            self.utils.scores = []
+        Scheduler.get_instance().register(
+            "recalculate stamps", self.recalculate_if_needed, interval=stamp_recalculation_window
+        )
+        Scheduler.get_instance().register(
+            "export stamps", self.export_scores_if_changed, interval=stamp_export_interval
+        )
 
     def reset_stamps(self):
         self.log.info(self.class_name, status="WIPING STAMP RECORDS")
 
+        with self.votes_lock:
+            self.pending_votes.clear()
+            self.pending_events.clear()
+            self.counted_votes = None
         self.utils.clear_votes()
         self.update_utils()
         self.calculate_stamps()
 
-    def update_vote(self, emoji: str, from_id: int, to_id: int,
-                    *, negative: bool = False, recalculate: bool = True):
-
-        if (to_id == stampy_id  # votes for stampy do nothing
-            or to_id == from_id # votes for yourself do nothing
-            or emoji not in vote_strengths_per_emoji): # votes with emojis other than stamp and goldstamp do nothing            
+    def update_vote(
+        self, emoji: str, from_id: int, to_id: int, *, negative: bool = False, message_id: Optional[int] = None
+    ):
+        """Count the vote straight away, but only write it to the database with the next recalculation,
+        which happens at most once every stamp_recalculation_window seconds. Anything adding lots of votes
+        at once can call calculate_stamps() itself when it's done"""
+        strength = vote_strength(emoji, from_id, to_id, negative)
+        if not strength:
             return
-        
-        vote_strength = vote_strengths_per_emoji[emoji]
-        if negative:
-            vote_strength *= -1
 
-        self.total_votes += vote_strength
-        self.utils.update_vote(from_id, to_id, vote_strength)
-        self.update_utils()
-        if recalculate:
-            self.calculate_stamps()
+        with self.votes_lock:
+            self.total_votes += strength
+            self.pending_votes[(from_id, to_id)] += strength
+            self.pending_events.append((time.time(), message_id, emoji, from_id, to_id, strength))
+            self.votes_version += 1
+            self.provisional_scores = None
+
+    def record_vote(
+        self, emoji: str, from_id: int, to_id: int, *, negative: bool = False, message_id: Optional[int] = None
+    ):
+        """update_vote, and log it. This used to log the recipient's stamps before and after, but that would
+        mean solving for the scores twice per vote, which is what buffering the votes is there to avoid"""
+        self.update_vote(emoji, from_id, to_id, negative=negative, message_id=message_id)
+        self.log.info(
+            self.class_name,
+            message_id=message_id,
+            reaction_message_author_id=to_id,
+            emoji=emoji,
+            negative_reaction=negative,
+            pending_votes=len(self.pending_votes),
+        )
 
     def update_utils(self) -> None:
         self.utils.users = self.utils.get_users()
         self.utils.update_ids_list()
 
+    async def recalculate_if_needed(self) -> None:
+        # counted_votes is set once set_up_database has run, and the votes can't be written before then
+        if self.pending_votes and self.counted_votes is not None:
+            await self.utils.async_db.run(self.calculate_stamps)
+
+    def write_pending_votes(self) -> None:
+        """Log all the buffered votes, and add them up in the vote table, in one transaction"""
+        with self.votes_lock:
+            votes, self.pending_votes = self.pending_votes, Counter()
+            events, self.pending_events = self.pending_events, []
+            self.counting_votes.update(votes)
+        try:
+            self.utils.add_vote_events(events)
+        except Exception:
+            # put them back for next time
+            with self.votes_lock:
+                self.counting_votes.subtract(votes)
+                self.pending_votes.update(votes)
+                self.pending_events[:0] = events
+            raise
+
     def calculate_stamps(self):
-        """Set up and solve the system of linear equations"""
+        """Write any buffered votes, then set up and solve the system of linear equations. If we know what the
+        vote table looked like last time, only the votes logged since then are read back"""
         self.log.info(self.class_name, status="RECALCULATING STAMP SCORES")
 
-        self.utils.users = self.utils.get_users()
-        self.utils.update_ids_list()
-
-        user_count = len(self.utils.users)
-
-        users_matrix = np.zeros((user_count, user_count))
+        self.write_pending_votes()
+        previous = (self.utils.ids, self.utils.scores)
 
-        votes = self.utils.get_all_user_votes()
+        if self.counted_votes is None:
+            votes, last_event_id = self.read_all_votes()
+        else:
+            events = self.utils.get_vote_events_since(self.last_event_id)
+            votes = apply_vote_deltas(self.counted_votes, events)
+            last_event_id = events[-1][0] if events else self.last_event_id
         # self.log.debug(self.class_name, votes=votes)
+        ids = self.solve_vote_table(votes, previous)
+
+        with self.votes_lock:
+            self.counted_votes = votes
+            self.last_event_id = last_event_id
+            self.counting_votes = Counter()
+            self.provisional_scores = None
+            # recount, rather than trust the running total
+            self.total_votes = int(votes[votes[:, 0] != 0, 2].sum()) + sum(self.pending_votes.values())
+
+        self.set_latest_stamps(ids, np.array(self.utils.scores) * self.total_votes)
+        self.save_snapshot(ids, votes)
+        # self.print_all_scores()
 
-        for from_id, to_id, votes_for_user in votes:
-            from_id_index = self.utils.index[from_id]
-            toi = self.utils.index[to_id]
-            total_votes_by_user = self.utils.get_votes_by_user(from_id)
-            if total_votes_by_user != 0:
-                score = (self.gamma * votes_for_user) / total_votes_by_user
-                users_matrix[toi, from_id_index] = score
-        for i in range(1, user_count):
-            users_matrix[i, i] = -1.0
-        users_matrix[0, 0] = 1.0
+    def solve_vote_table(self, votes: np.ndarray, previous=None) -> np.ndarray:
+        """Solve for everyone's scores from the whole vote table, and put them in utils. Returns the ids"""
+        ids = np.unique(votes[:, :2])  # the same users as get_users(), without asking the database again
+        self.utils.users = ids.tolist()
+        self.utils.update_ids_list()
+        self.utils.scores = self.solve_scores(ids, votes, previous)
+        return ids
+
+    def read_all_votes(self) -> tuple[np.ndarray, int]:
+        """The whole vote table, and the id of the last event in the vote log it includes"""
+        with self.utils.db.transaction():
+            return vote_array(self.utils.get_all_user_votes()), self.utils.get_last_vote_event_id()
+
+    def set_latest_stamps(self, ids: np.ndarray, stamps: np.ndarray) -> None:
+        self.ranking = StampRanking(ids, stamps)
+        self.latest_stamps = (ids, stamps)
+
+    def save_snapshot(self, ids: np.ndarray, votes: np.ndarray) -> None:
+        """Store the scores just calculated from `votes`, keeping the last one from every stamp_snapshot_interval"""
+        now = time.time()
+        self.utils.add_stamp_snapshot(
+            now,
+            fingerprint(votes),
+            self.total_votes,
+            ids.astype(np.int64).tobytes(),
+            np.array(self.utils.scores, dtype=np.float64).tobytes(),
+            self.last_event_id,
+            votes.astype(np.int64).tobytes(),
+            replace_since=now - now % stamp_snapshot_interval,
+            keep_since=now - stamp_snapshot_retention,
+        )
 
-        user_count_matrix = np.zeros(user_count)
-        user_count_matrix[0] = 1.0  # God has 1 karma
+    def load_snapshot(self) -> Optional[str]:
+        """Start from the latest snapshot of the scores, if there is one, and return its fingerprint.
+        check_snapshot makes sure it's still right once we're up and running"""
+        snapshot = self.utils.get_latest_stamp_snapshot()
+        if snapshot is None:
+            return None
+        timestamp, snapshot_fingerprint, total_votes, ids, scores, self.snapshot_event_id, votes = snapshot
+        ids, scores = np.frombuffer(ids, dtype=np.int64), np.frombuffer(scores, dtype=np.float64)
+        if votes is not None:
+            self.snapshot_votes = np.frombuffer(votes, dtype=np.int64).reshape(-1, 3)
+        self.utils.users = ids.tolist()
+        self.utils.update_ids_list()
+        self.utils.scores = scores.tolist()
+        if total_votes is not None:
+            self.total_votes = total_votes  # the scores are shares of the votes there were then
+        self.set_latest_stamps(ids, scores * self.total_votes)
+        self.log.info(
+            self.class_name,
+            status="LOADED STAMP SCORES SNAPSHOT",
+            taken=datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+            users=len(self.utils.users),
+        )
+        return snapshot_fingerprint
+
+    def check_snapshot(self) -> None:
+        """If we started from a snapshot, carry on from the votes it was taken from, applying any votes logged
+        since. If the vote log has been cleared since, recalculate unless the vote table is the same"""
+        if self.counted_votes is not None:
+            return  # recalculated since, so there's nothing to check
+        if self.snapshot_votes is not None and self.utils.has_vote_event(self.snapshot_event_id):
+            with self.votes_lock:
+                self.counted_votes = self.snapshot_votes
+                self.last_event_id = self.snapshot_event_id or 0
+                self.provisional_scores = None
+            if self.utils.get_last_vote_event_id() > self.last_event_id:
+                self.calculate_stamps()  # which only reads the new events
+            return
 
-        self.utils.scores = list(np.linalg.solve(users_matrix, user_count_matrix))
+        votes, last_event_id = self.read_all_votes()
+        with self.votes_lock:
+            self.counted_votes = votes
+            self.last_event_id = last_event_id
+            self.provisional_scores = None
+        if fingerprint(votes) != self.snapshot_fingerprint:
+            if self.snapshot_fingerprint is not None:
+                self.log.warning(self.class_name, msg="Stamp scores snapshot is out of date, recalculating")
+            self.calculate_stamps()  # from the votes just read, plus anything logged since
+
+    def set_up_database(self) -> None:
+        """Make the tables the stamps need, if they aren't there yet, then check the scores we started with
+        and save them if they weren't from a snapshot"""
+        self.utils.create_vote_events_table()
+        self.utils.create_stamp_snapshots_table()
+        self.check_snapshot()
+
+    def warm_up(self):
+        # on the database thread, so it doesn't race with votes being counted
+        self.utils.async_db.submit(self.set_up_database).result()
+
+    def get_user_stamps_history(self, user, since: float) -> list[tuple[float, float]]:
+        """(timestamp, stamps) from each snapshot taken since the given time, oldest first"""
+        user_id = user_id_of(user)
+        if user_id is None:
+            return []
+        history = []
+        for timestamp, total_votes, ids, scores in self.utils.get_stamp_snapshots(since):
+            ids = np.frombuffer(ids, dtype=np.int64)
+            user_index = int(np.searchsorted(ids, user_id))
+            stamps = 0.0
+            if 0 < user_index < len(ids) and ids[user_index] == user_id:
+                stamps = float(np.frombuffer(scores, dtype=np.float64)[user_index]) * total_votes
+            history.append((timestamp, stamps))
+        return history
+
+    def get_stamps_at(self, timestamp: float) -> tuple[np.ndarray, np.ndarray]:
+        """(ids, stamps) as they were at that time, replayed from the vote log. Starts the solver from the
+        last snapshot before then, if we still have one. Votes from before the log was started all count
+        as having been there from the beginning"""
+        votes = vote_array(self.utils.get_votes_at(timestamp))
+        ids = np.union1d([0], votes[:, :2])
+        previous = None
+        if snapshot := self.utils.get_stamp_snapshot_before(timestamp):
+            ids_blob, scores_blob = snapshot
+            previous = (np.frombuffer(ids_blob, np.int64).tolist(), np.frombuffer(scores_blob, np.float64).tolist())
+        scores = np.array(self.solve_scores(ids, votes, previous))
+        return ids, scores * int(votes[votes[:, 0] != 0, 2].sum())
+
+    def get_user_stamps_at(self, user, timestamp: float) -> float:
+        user_id = user_id_of(user)
+        if user_id is None:
+            return 0.0
+        ids, stamps = self.get_stamps_at(timestamp)
+        user_index = int(np.searchsorted(ids, user_id))
+        return float(stamps[user_index]) if 0 < user_index < len(ids) and ids[user_index] == user_id else 0.0
+
+    def recount_stamps(self) -> None:
+        """Rebuild the vote table from the vote log and recalculate, which is much quicker than rereading
+        the whole Discord history, for when the vote table is wrong but the log is right"""
+        self.write_pending_votes()
+        self.utils.recount_votes()
+        with self.votes_lock:
+            self.counted_votes = None
+        self.calculate_stamps()
 
-        self.export_scores_csv()
-        # self.print_all_scores()
+    def solve_scores(self, ids: np.ndarray, votes: np.ndarray, previous=None) -> list:
+        """Each user's score is gamma times the share of each voter's votes they got times the voter's score,
+        summed over the voters. God has a score of 1.
+
+        `ids` are the sorted user ids, God first, and `votes` rows of (from_id, to_id, votecount), which can
+        repeat a pair of users. Starts from the `previous` (ids, scores) if given, since one vote doesn't
+        move things much"""
+        from_indices = np.searchsorted(ids, votes[:, 0])
+        to_indices = np.searchsorted(ids, votes[:, 1])
+        counts = votes[:, 2].astype(float)
+
+        votes_by_user = np.bincount(from_indices, weights=counts, minlength=len(ids))[from_indices]
+        # God's score is fixed, whoever votes for Them
+        edges = (votes_by_user != 0) & (to_indices != 0)
+        weights = self.gamma * counts[edges] / votes_by_user[edges]
+
+        start = None
+        if previous is not None and previous[0] and len(previous[0]) == len(previous[1] or ()):
+            previous_ids, previous_scores = np.asarray(previous[0]), np.asarray(previous[1])
+            positions = np.searchsorted(previous_ids, ids).clip(max=len(previous_ids) - 1)
+            start = np.where(previous_ids[positions] == ids, previous_scores[positions], 0.0)
+
+        scores, iterations = solve_fixed_point(to_indices[edges], from_indices[edges], weights, len(ids), start)
+        self.log.info(self.class_name, status="SOLVED STAMP SCORES", users=len(ids), iterations=iterations)
+        return list(scores)
+
+    def get_provisional_scores(self) -> Optional[tuple[np.ndarray, list]]:
+        """(ids, scores) as they'll be once the buffered votes are counted, or None if there aren't any.
+        This only solves in memory, from the votes last read from the database plus the buffered ones"""
+        with self.votes_lock:
+            if self.provisional_scores is not None or not (self.pending_votes or self.counting_votes):
+                return self.provisional_scores
+            if self.counted_votes is None:
+                return None  # until check_snapshot has run, the uncounted votes will have to wait
+            # a pair of users can have more than one row, which adds up the way we want
+            uncounted = [*self.counting_votes.items(), *self.pending_votes.items()]
+            votes = np.concatenate([self.counted_votes, vote_array([(*voters, count) for voters, count in uncounted])])
+            votes_version = self.votes_version
+
+        ids = np.union1d([0], votes[:, :2])
+        scores = self.solve_scores(ids, votes, (self.utils.ids, self.utils.scores))
+
+        with self.votes_lock:
+            # don't keep them if more votes came in, or they were counted properly, while we were working
+            if self.votes_version == votes_version and (self.pending_votes or self.counting_votes):
+                self.provisional_scores = (ids, scores)
+        return ids, scores
 
     # done
     def get_user_scores(self):
         message = "Here are the discord users and how many stamps they're worth:\n"
-        self.utils.users = self.utils.get_users()
-        for user_id in self.utils.users:
+        for user_id, stamps in self.ranking.top(len(self.ranking)):
             name = self.utils.client.get_user(user_id)
             if not name:
                 name = "<@" + str(user_id) + ">"
-            stamps = self.get_user_stamps(user_id)
             message += str(name) + ": \t" + str(stamps) + "\n"
         return message
 
-    def export_scores_csv(self):
+    def get_leaderboard(self, count: int = stamp_leaderboard_size) -> list[dict]:
+        """The people with the most stamps, most first"""
+        leaderboard = []
+        for user_id, stamps in self.ranking.top(count):
+            user = self.utils.client.get_user(user_id)
+            leaderboard.append(
+                {
+                    "rank": self.ranking.rank(user_id),
+                    "id": str(user_id),  # too big for JavaScript's numbers
+                    "name": user.name if user else None,
+                    "stamps": stamps,
+                }
+            )
+        return leaderboard
+
+    def get_user_ranking(self, user) -> Optional[dict]:
+        """Where the user comes in the rankings, or None if they've never been stamped"""
+        user_id = user_id_of(user)
+        if user_id is None or self.ranking.stamps_for(user_id) is None:
+            return None
+        return {
+            "id": str(user_id),
+            "stamps": self.ranking.stamps_for(user_id),
+            "rank": self.ranking.rank(user_id),
+            "percentile": self.ranking.percentile(user_id),
+            "users": len(self.ranking),
+        }
+
+    def describe_leaderboard(self) -> str:
+        leaderboard = self.get_leaderboard()
+        if not leaderboard:
+            return "Nobody has any stamps yet"
+        lines = ["Here's who's worth the most stamps to me:"]
+        for entry in leaderboard:
+            # names rather than mentions, so nobody gets pinged
+            lines.append(f"{entry['rank']}. {entry['name'] or 'someone who has left'}: {entry['stamps']:.2f}")
+        return "\n".join(lines)
+
+    def describe_rank(self, user) -> str:
+        ranking = self.get_user_ranking(user)
+        if ranking is None:
+            return "You're not on the leaderboard yet. Nobody has stamped any of your messages"
+        return (
+            f"You're number {ranking['rank']} of {ranking['users']}, with {ranking['stamps']:.2f} stamps. "
+            f"That's more than {ranking['percentile']:.0f}% of people"
+        )
+
+    def export_scores_if_changed(self) -> bool:
+        """Export the scores if anyone's stamps have changed by more than stamp_export_threshold,
+        or anyone's come or gone, since the last export. Runs as a scheduled job"""
+        if self.latest_stamps is None:
+            return False
+        ids, stamps = self.latest_stamps
+        if self.exported_stamps is not None:
+            exported_ids, exported_stamps = self.exported_stamps
+            if np.array_equal(ids, exported_ids):
+                if np.abs(stamps - exported_stamps).max(initial=0.0) <= stamp_export_threshold:
+                    return False
+        if self.export_scores(ids, stamps):
+            self.exported_stamps = (ids, stamps)
+            return True
+        return False
+
+    def export_scores(self, ids: np.ndarray, stamps: np.ndarray) -> bool:
+        """Write the scores for the website as CSV and JSON, gzipped as well, plus a .meta.json file with
+        each file's ETag and size. Every file is swapped in whole, so readers never see half of one"""
         self.log.info(self.class_name, msg=f"Logging scores to {stamp_scores_csv_file_path}")
-        csv_lines = []
-        for user_id in self.utils.get_users():
-            score = self.get_user_stamps(user_id)
+        rows = []
+        for user_id, user_stamps in zip(ids.tolist(), stamps.tolist()):
             user = self.utils.client.get_user(user_id)
             if user_id and user:  # don't bother for id 0 or if the user is None
-                csv_lines.append(f"""{user_id},"{user.name}",{user.discriminator},{score}\n""")
-        if not csv_lines:
+                rows.append((user_id, user.name, user.discriminator, user_stamps))
+        if not rows:
             self.log.error(self.class_name, csv_error="No valid users to export to CSV?")
-            return
+            return False
+
+        csv_data = "".join(
+            f"""{user_id},"{name}",{discriminator},{score}\n""" for user_id, name, discriminator, score in rows
+        )
+        # the ids are strings because they're too big for JavaScript's numbers
+        json_data = json.dumps(
+            [
+                {"id": str(user_id), "name": name, "discriminator": discriminator, "stamps": score}
+                for user_id, name, discriminator, score in rows
+            ]
+        )
+        base_path = os.path.splitext(stamp_scores_csv_file_path)[0]
+        files = {stamp_scores_csv_file_path: csv_data.encode(), base_path + ".json": json_data.encode()}
+        # mtime=0 so the same scores always compress to the same bytes, and keep the same ETag
+        files.update({path + ".gz": gzip.compress(data, mtime=0) for path, data in list(files.items())})
+        metadata = {
+            "generated": datetime.now(timezone.utc).isoformat(),
+            "users": len(rows),
+            "files": {
+                os.path.basename(path): {"etag": f'"{hashlib.sha256(data).hexdigest()[:32]}"', "size": len(data)}
+                for path, data in files.items()
+            },
+        }
         try:
-            with open(stamp_scores_csv_file_path, "w") as csv_file:
-                csv_file.write("".join(csv_lines))
+            for path, data in files.items():
+                write_atomically(path, data)
+            # last, so it never describes files that aren't there yet
+            write_atomically(base_path + ".meta.json", json.dumps(metadata, indent=2).encode())
         except Exception as e:
             self.log.error(self.class_name, error=e)
+            return False
+        return True
 
     def print_all_scores(self):
         total_stamps = 0
-        self.utils.users = self.utils.get_users()
-        for user_id in self.utils.users:
+        for user_id, stamps in self.ranking.top(len(self.ranking)):
             name = self.utils.client.get_user(user_id)
             if not name:
                 name = "<@" + str(user_id) + ">"
-            stamps = self.get_user_stamps(user_id)
             total_stamps += stamps
             self.log.info(self.class_name, name=name, stamps=stamps)
 
@@ -136,12 +653,15 @@ class StampsModule(Module):
         self.log.info(self.class_name, total_stamps=total_stamps)
 
     def get_user_stamps(self, user):
-        index = self.utils.index_dammit(user)
-        if index:
-            stamps = self.utils.scores[index] * self.total_votes
-        else:
-            stamps = 0.0
-        return stamps
+        user_id = user_id_of(user)
+        if user_id is None:
+            return 0.0
+        if provisional_scores := self.get_provisional_scores():
+            ids, scores = provisional_scores
+            user_index = int(np.searchsorted(ids, user_id))
+            found = user_index < len(ids) and ids[user_index] == user_id
+            return scores[user_index] * self.total_votes if found and user_index else 0.0
+        return self.ranking.stamps_for(user_id) or 0.0
 
     def load_votes_from_csv(self, filename="stamps.csv"):
 
@@ -149,75 +669,155 @@ class StampsModule(Module):
             stamps_file.readline()  # throw away the first line, it's headers
             for line in stamps_file:
                 msg_id, emoji, from_id, to_id = line.strip().split(",")
-                self.update_vote(emoji, int(from_id), int(to_id), recalculate=False)
+                self.update_vote(emoji, int(from_id), int(to_id), message_id=int(msg_id))
 
         self.calculate_stamps()
 
-    async def load_votes_from_history(self):
-        """Load up every time any stamp has been awarded by anyone in the whole history of the Discord
-        This is omega slow, should basically only need to be called once"""
-        guild = discord.utils.find(lambda g: g.name == self.utils.GUILD, self.utils.client.guilds)
-
-        with open("stamps.csv", "w") as stamplog:
-            stamplog.write("msgid,type,from,to\n")
-
-            for channel in guild.channels:
-                self.log.info(
-                    self.class_name,
-                    operation="load_votes_from_history",
-                    channel_name=channel.name,
-                    channel_type=channel.type,
-                    channel_type_type=type(channel.type),
-                )
-                if channel.type == discord.ChannelType.text:
-                    async for message in channel.history(limit=None):
-                        message = DiscordMessage(message)
-                        reactions = message.reactions
-                        if utilities.stampy_is_author(message):
-                            text = message.clean_content
-                            if re.match(r"[0-9]+.+stamped.+", text):
-                                users = re.findall(r"[0-9]+", text)
-                                from_id = int(users[0])
-                                to_id = int(users[1])
-                                stamps_before_update = self.get_user_stamps(to_id)
-                                negative = bool(re.match(r"[0-9]+.+unstamped.+", text))
-                                self.update_vote("stamp", from_id, to_id, negative=negative)
-                                self.log.info(
-                                    self.class_name,
-                                    reaction_message_author_id=to_id,
-                                    stamps_before_update=stamps_before_update,
-                                    stamps_after_update=self.get_user_stamps(to_id),
-                                    negative_reaction=negative,
-                                )
-                        elif reactions:
-                            for reaction in reactions:
-                                emoji = getattr(reaction.emoji, "name", "")
-                                if emoji in ["stamp", "goldstamp"]:
-                                    users = await reaction.users().flatten()
-                                    for user in users:
-                                        string = f"{message.id},{emoji},{user.id},{message.author.id}"
-                                        self.log.info(
-                                            self.class_name,
-                                            user_id=user.id,
-                                            message_id=message.id,
-                                            reaction_type=emoji,
-                                            author_name=message.author.name,
-                                            message_author_id=message.author.id,
-                                        )
-                                        stamplog.write(string + "\n")
-                                        self.update_vote(
-                                            emoji, user.id, message.author.id, recalculate=False,
-                                        )
+    async def load_votes_from_history(self, progress_channel=None):
+        """Load up every time any stamp has been awarded by anyone in the whole history of the Discord.
+        Channels are scanned stamp_rebuild_concurrency at a time, oldest message first, sharing one budget of
+        Discord API calls. Each batch of votes is saved along with how far through its channel it got,
+        so if this is interrupted, calling it again carries on from there rather than starting over.
+        The scores are only recalculated once, at the end"""
+        guild = self.utils.get_guild()
+        channels = [channel for channel in guild.channels if channel.type == discord.ChannelType.text]
+
+        await self.utils.async_db.run(self.utils.create_history_checkpoints_table)
+        checkpoints = await self.utils.async_db.run(self.utils.get_history_checkpoints)
+        if not checkpoints:
+            # from here on, live votes are left for the scans to find
+            self.history_checkpoints = {channel.id: (None, False) for channel in channels}
+            await self.utils.async_db.run(self.start_history_rebuild, [channel.id for channel in channels])
+        else:
+            self.history_checkpoints = dict(checkpoints)
+
+        progress = RebuildProgress(channels=len(channels))
+        progress.channels_done = sum(done for _, done in checkpoints.values())
+        budget = TokenBucket(*stamp_rebuild_rate_limit)
+        concurrency = asyncio.Semaphore(stamp_rebuild_concurrency)
+
+        async def scan(channel) -> None:
+            last_message_id, done = checkpoints.get(channel.id, (None, False))
+            if done:
+                return
+            async with concurrency:
+                await self.scan_channel_history(channel, last_message_id, budget, progress)
+
+        reporter = asyncio.create_task(self.report_rebuild_progress(progress, progress_channel))
+        try:
+            # if one channel fails, let the rest finish and checkpoint before giving up
+            results = await asyncio.gather(*[scan(channel) for channel in channels], return_exceptions=True)
+        finally:
+            reporter.cancel()
+            self.channel_scans.clear()
+        if errors := [result for result in results if isinstance(result, BaseException)]:
+            # a batch that failed to save isn't in the database, so go back to what is
+            self.history_checkpoints = await self.utils.async_db.run(self.utils.get_history_checkpoints)
+            raise errors[0]
+
+        await self.utils.async_db.run(self.finish_history_rebuild)
+        self.history_checkpoints = {}
+        self.log.info(self.class_name, status="STAMP HISTORY REBUILT", progress=progress.summary())
+
+    def start_history_rebuild(self, channel_ids: list) -> None:
+        """Wipe the votes and mark every channel as not scanned yet, all at once"""
+        with self.utils.db.transaction():
+            self.reset_stamps()
+            for channel_id in channel_ids:
+                self.utils.set_history_checkpoint(channel_id, None)
+
+    def finish_history_rebuild(self) -> None:
         self.calculate_stamps()
+        self.utils.clear_history_checkpoints()
+
+    async def scan_channel_history(self, channel, after, budget: TokenBucket, progress: "RebuildProgress") -> None:
+        scan = self.channel_scans[channel.id] = ChannelScan(position=after)
+        scanned = 0
+        try:
+            history = channel.history(limit=None, oldest_first=True, after=discord.Object(after) if after else None)
+            async for message in history:
+                if scanned % 100 == 0:
+                    await budget.take()  # history comes in pages of 100 messages, one API call each
+                scanned += 1
+                # Discord doesn't say when reactions were added, so they're logged as of the message
+                timestamp = message.created_at.timestamp()
+                for emoji, from_id, to_id, negative in await self.votes_in_message(DiscordMessage(message), budget):
+                    if strength := vote_strength(emoji, from_id, to_id, negative):
+                        scan.events.append((timestamp, message.id, emoji, from_id, to_id, strength))
+                        progress.votes += 1
+                scan.position = message.id
+                progress.messages += 1
+                if scanned % stamp_rebuild_batch_size == 0:
+                    await self.save_channel_scan(channel.id, scan)
+        except discord.Forbidden:
+            self.log.warning(self.class_name, msg="Can't read channel history, skipping it", channel=channel.name)
+        await self.save_channel_scan(channel.id, scan, done=True)
+        progress.channels_done += 1
+
+    async def save_channel_scan(self, channel_id: int, scan: ChannelScan, done: bool = False) -> None:
+        events, scan.events = scan.events, []
+        # live votes on messages up to here go straight in now. They're queued behind this batch, so if it
+        # doesn't save, the rebuild fails before they're written
+        self.history_checkpoints[channel_id] = (scan.position, done)
+        await self.utils.async_db.run(self.save_history_batch, channel_id, scan.position, events, done)
+
+    def left_to_history_rebuild(self, channel_id: int, vote: tuple) -> bool:
+        """Whether a vote that's just come in, as (timestamp, message id, emoji, from_id, to_id, delta), is for
+        an unfinished stamp history rebuild to count rather than us, so it isn't counted twice. The rebuild will
+        find votes on messages it hasn't got to yet. Votes on messages it's scanned but not saved yet are added
+        to its next batch, so they're saved with it, or dropped with it and found again when it carries on"""
+        if not self.history_checkpoints:
+            return False
+        message_id = vote[1]
+        last_message_id, done = self.history_checkpoints.get(channel_id, (None, False))
+        if done or (last_message_id is not None and message_id <= last_message_id):
+            return False
+        scan = self.channel_scans.get(channel_id)
+        if scan is not None and scan.position is not None and message_id <= scan.position:
+            scan.events.append(vote)
+        return True
+
+    async def votes_in_message(self, message: DiscordMessage, budget: TokenBucket) -> list[tuple]:
+        """(emoji, from_id, to_id, negative) for each vote for the message, or announced by it"""
+        if utilities.stampy_is_author(message):
+            text = message.clean_content
+            if re.match(r"[0-9]+.+stamped.+", text):
+                users = re.findall(r"[0-9]+", text)
+                negative = bool(re.match(r"[0-9]+.+unstamped.+", text))
+                return [("stamp", int(users[0]), int(users[1]), negative)]
+            return []
+
+        votes = []
+        for reaction in message.reactions:
+            emoji = getattr(reaction.emoji, "name", "")
+            if emoji in vote_strengths_per_emoji:
+                await budget.take()
+                async for user in reaction.users():
+                    votes.append((emoji, user.id, int(message.author.id), False))
+        return votes
+
+    def save_history_batch(self, channel_id: int, last_message_id, events: list, done: bool = False) -> None:
+        """Log the votes and move the channel's checkpoint past them, in one transaction"""
+        with self.utils.db.transaction():
+            self.utils.add_vote_events(events)
+            self.utils.set_history_checkpoint(channel_id, last_message_id, done)
+
+    async def report_rebuild_progress(self, progress: "RebuildProgress", channel) -> None:
+        while True:
+            await asyncio.sleep(stamp_rebuild_progress_interval)
+            self.log.info(self.class_name, status="REBUILDING STAMP HISTORY", progress=progress.summary())
+            if channel is not None:
+                await channel.send(progress.summary())
 
     async def process_raw_reaction_event(self, event):
         event_type = event.event_type
-        guild = discord.utils.find(lambda g: g.name == self.utils.GUILD, self.utils.client.guilds)
-        channel = discord.utils.find(lambda c: c.id == event.channel_id, guild.channels)
-
-        if not channel:
+        guild = self.utils.get_guild()
+        if guild is None or event.guild_id != guild.id:
+            return
+        message = await self.utils.fetch_message(event.channel_id, event.message_id)
+        if message is None:
             return
-        message = DiscordMessage(await channel.fetch_message(event.message_id))
+        message = DiscordMessage(message)
         emoji = getattr(event.emoji, "name", event.emoji)
 
         author_id_int = int(message.author.id)
@@ -248,15 +848,16 @@ class StampsModule(Module):
     
             # I believe this call was a duplicate and it should not be called twice
             # self.update_vote(emoji, from_id, to_id, False, False)
-            
-            stamps_before_update = self.get_user_stamps(to_id)
-            self.update_vote(emoji, from_id, to_id, negative=(event_type == "REACTION_REMOVE"))
-            self.log.info(
-                self.class_name,
-                reaction_message_author_id=to_id,
-                stamps_before_update=stamps_before_update,
-                stamps_after_update=self.get_user_stamps(to_id),
-                negative_reaction=bool(event_type == "REACTION_REMOVE"),
+
+            negative = event_type == "REACTION_REMOVE"
+            strength = vote_strength(emoji, from_id, to_id, negative)
+            vote = (time.time(), event.message_id, emoji, from_id, to_id, strength)
+            if strength and self.left_to_history_rebuild(event.channel_id, vote):
+                self.log.info(self.class_name, msg="Leaving the vote for the stamp history rebuild", vote=vote)
+                return
+
+            await self.utils.async_db.run(
+                self.record_vote, emoji, from_id, to_id, negative=negative, message_id=event.message_id
             )
 
     def process_message(self, message):
@@ -269,6 +870,27 @@ class StampsModule(Module):
                     why=f"{message.author.name} asked how many stamps they're worth",
                 )
 
+            elif re.match(r"how (has|have) my stamps? (value |worth )?changed", text.lower()):
+                return Response(
+                    confidence=9,
+                    text=self.describe_stamps_change(message.author),
+                    why=f"{message.author.name} asked how their stamp value has changed",
+                )
+
+            elif re.match(r"stamps? leaderboard", text.lower()):
+                return Response(
+                    confidence=9,
+                    text=self.describe_leaderboard(),
+                    why=f"{message.author.name} asked for the stamp leaderboard",
+                )
+
+            elif re.match(rank_question, text.lower()):
+                return Response(
+                    confidence=9,
+                    text=self.describe_rank(message.author),
+                    why=f"{message.author.name} asked where they rank by stamps",
+                )
+
             elif text == "reloadallstamps":
                 if message.service == Services.DISCORD:
                     asked_by_admin = discord.utils.get(message.author.roles, id=bot_admin_role_id)
@@ -277,35 +899,65 @@ class StampsModule(Module):
                 else:
                     return Response(confidence=10, text=self.UNAUTHORIZED_MESSAGE, args=[message])
 
+            elif text == "recountallstamps":
+                if message.service == Services.DISCORD:
+                    asked_by_admin = discord.utils.get(message.author.roles, id=bot_admin_role_id)
+                    if asked_by_admin:
+                        return Response(confidence=10, callback=self.recountallstamps, args=[message])
+                else:
+                    return Response(confidence=10, text=self.UNAUTHORIZED_MESSAGE, args=[message])
+
         return Response()
 
+    def describe_stamps_change(self, user) -> str:
+        stamps = self.get_user_stamps(user)
+        history = self.get_user_stamps_history(user, time.time() - 7 * 24 * 3600)
+        if not history:
+            return f"You're worth {stamps:.2f} stamps to me. I don't remember what you were worth a week ago"
+        timestamp, stamps_then = history[0]
+        change = stamps - stamps_then
+        since = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+        return (
+            f"You're worth {stamps:.2f} stamps to me, {'up' if change >= 0 else 'down'} {abs(change):.2f} "
+            f"from {stamps_then:.2f} on {since}"
+        )
+
     def process_message_from_stampy(self, message):
         text = message.clean_content
         if re.match(r"[0-9]+.+stamped.+", text):
             users = re.findall(r"[0-9]+", text)
             from_id = int(users[0])
             to_id = int(users[1])
-            stamps_before_update = self.get_user_stamps(to_id)
             negative = bool(re.match(r"[0-9]+.+unstamped.+", text))
-
-            self.update_vote("stamp", from_id, to_id, negative=negative)
-            self.log.info(
-                self.class_name,
-                reaction_message_author_id=to_id,
-                stamps_before_update=stamps_before_update,
-                stamps_after_update=self.get_user_stamps(to_id),
-                negative_reaction=negative,
+            strength = vote_strength("stamp", from_id, to_id, negative)
+            vote = (time.time(), int(message.id), "stamp", from_id, to_id, strength)
+            if strength and self.left_to_history_rebuild(int(message.channel.id), vote):
+                return
+
+            # this is called on the event loop, so don't wait for the database
+            self.utils.async_db.submit(
+                self.record_vote, "stamp", from_id, to_id, negative=negative, message_id=int(message.id)
             )
 
     async def reloadallstamps(self, message):
         self.log.info(self.class_name, ALERT="FULL STAMP HISTORY RESET BAYBEEEEEE")
-        await message.channel.send("Doing full stamp history reset, could take a while")
-        self.reset_stamps()
-        await self.load_votes_from_history()
+        await self.utils.async_db.run(self.utils.create_history_checkpoints_table)
+        if await self.utils.async_db.run(self.utils.get_history_checkpoints):
+            await message.channel.send("Carrying on with the stamp history reset from where it got to")
+        else:
+            await message.channel.send("Doing full stamp history reset, could take a while")
+        await self.load_votes_from_history(progress_channel=message.channel)
         return Response(
             confidence=10, text=self.STAMPS_RESET_MESSAGE, why="robertskmiles reset the stamp history",
         )
 
+    async def recountallstamps(self, message):
+        self.log.info(self.class_name, ALERT="RECOUNTING STAMPS FROM THE VOTE LOG")
+        await self.utils.async_db.run(self.recount_stamps)
+        return Response(
+            confidence=10, text=self.STAMPS_RECOUNTED_MESSAGE, why="An admin asked me to recount the stamps",
+        )
+
     @property
     def test_cases(self):
         return [
@@ -1,6 +1,8 @@
 import re
 import os
-from modules.module import Module, Response
+from functools import cached_property
+from modules.module import Module, Response, Triggers
+from utilities.blocking import run_blocking
 from config import subs_dir
 
 
@@ -19,9 +21,16 @@ class VideoSearch(Module):
 ?([Ii]n )?([Ww]hich|[Ww]hat)('?s| is| was| are| were)? ?(it|that|the|they|those)? ?vid(eo)?s? ?(where|in which|which)?|
 ?[Vv]id(eo)? ?[Ss]earch) (?P<query>.+)"""
         )
+        self.triggers = Triggers(addressed=True, prefixes=[self.re_search])
         self.subsdir = subs_dir
-        self.videos = []
-        self.load_videos()
+
+    def warm_up(self):
+        self.videos  # loads them, if they haven't been already
+
+    @cached_property
+    def videos(self):
+        """All the videos we have subtitles for, read in the first time they're needed"""
+        return self.load_videos()
 
     class Video:
         def __init__(self, title, stub, text="", description=""):
@@ -61,6 +70,7 @@ class VideoSearch(Module):
         return "\n".join(lines)
 
     def load_videos(self):
+        videos = []
         with os.scandir(self.subsdir) as entries:
             for entry in entries:
                 if entry.name.endswith(".en.vtt"):
@@ -78,7 +88,8 @@ class VideoSearch(Module):
                         description = ""
 
                     video = self.Video(title, stub, text, description)
-                    self.videos.append(video)
+                    videos.append(video)
+        return videos
 
     @staticmethod
     def extract_keywords(query):
@@ -130,13 +141,13 @@ class VideoSearch(Module):
         return matches
 
     def process_message(self, message):
-        if self.is_at_me(message):
-            text = self.is_at_me(message)
-
+        if text := self.is_at_me(message):
             m = re.match(self.re_search, text)
             if m:
                 query = m.group("query")
-                return Response(confidence=9, callback=self.process_search_request, args=[query])
+                return Response(
+                    confidence=9, callback=self.process_search_request, args=[query], speculative=True
+                )
 
         # This is either not at me, or not something we can handle
         return Response()
@@ -157,7 +168,7 @@ class VideoSearch(Module):
 
     async def process_search_request(self, query):
         self.log.info(self.class_name, operation="process_search_request", video_query=query)
-        result = self.search(query)
+        result = await run_blocking("videosearch", self.search, query)  # may load the videos, if warm_up hasn't yet
         if result:
             self.log.info(self.class_name, operation="process_search_request", search_resutl=result)
             return Response(
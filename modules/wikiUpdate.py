@@ -1,8 +1,11 @@
 import re
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
+from utilities.blocking import run_blocking
 
 
 class WikiUpdate(Module):
+    triggers = Triggers(addressed=True)
+
     UNCLEAR_REQUEST_MESSAGE = "It is not clear what question you are referring to"
 
     def __str__(self):
@@ -64,7 +67,7 @@ class WikiUpdate(Module):
                 + "Or for some other reason the appropriate wiki page to change could not be found.",
             )
 
-        self.utils.wiki.set_question_property(wiki_title, property_name, new_value)
+        await run_blocking("wiki", self.utils.wiki.set_question_property, wiki_title, property_name, new_value)
 
         return Response(
             confidence=8,
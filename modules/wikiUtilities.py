@@ -1,11 +1,13 @@
 import re
 from typing import Generator
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
 
 
 class WikiUtilities(Module):
     """Module to manage commands about moving wiki pages"""
 
+    triggers = Triggers(addressed=True)
+
     shared_regex_part = (
         r"(?:,? matching (?P<page>'[^']+'|\"[^\"]+\"|`[^`]+`|.+))?"
         r"(?:,? offset (?P<offset>\d+))?"
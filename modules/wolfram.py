@@ -1,9 +1,12 @@
 import urllib
 from config import wolfram_token
-from modules.module import Module, Response
+from modules.module import Module, Response, Triggers
+from utilities.metrics import timed
 
 
 class Wolfram(Module):
+    triggers = Triggers(addressed=True)
+
     def __init__(self):
         super().__init__()
         self.class_name = "Wolfram"
@@ -21,6 +24,7 @@ class Wolfram(Module):
             return Response(
                 confidence=5,
                 callback=self.ask,
+                speculative=True,
                 args=[text],
                 why="It's a question, we might be able to answer it",
             )
@@ -28,6 +32,7 @@ class Wolfram(Module):
             return Response(
                 confidence=1,
                 callback=self.ask,
+                speculative=True,
                 args=[text],
                 why="It's not a question but we might be able to look it up",
             )
@@ -37,7 +42,8 @@ class Wolfram(Module):
             self.log.info(self.class_name, wolfram_alpha_question=question)
             question_escaped = urllib.parse.quote_plus(question.strip())
             url = "http://api.wolframalpha.com/v1/result?appid=%s&i=%s" % (wolfram_token, question_escaped,)
-            answer = urllib.request.urlopen(url).read().decode("utf-8")
+            with timed("external_call", service="wolfram"):
+                answer = urllib.request.urlopen(url).read().decode("utf-8")
             if "olfram" not in answer:
                 return Response(confidence=8, text=answer, why="That's what Wolfram Alpha suggested")
         except Exception as e:
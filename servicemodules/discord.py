@@ -1,29 +1,33 @@
 import sys
 import asyncio
-import inspect
 import discord
 import threading
+import time
 import unicodedata
 from utilities import (
     Utilities,
     utilities,
-    get_question_id,
-    is_test_response,
     is_test_message,
-    is_test_question,
     get_git_branch_info,
 )
-from utilities.discordutils import DiscordMessage, DiscordUser
+from utilities.blocking import run_blocking
+from utilities.discordutils import DiscordMessage
+from utilities.metrics import timed
+from utilities.scheduler import Scheduler
+from utilities.youtubepoller import YouTubePoller
 from structlog import get_logger
-from modules.module import Response
-from collections.abc import Iterable
+from typing import Optional
+from modules.module import Module, Response
 from datetime import datetime, timezone, timedelta
-from typing import Generator
 from config import (
     discord_token,
-    TEST_RESPONSE_PREFIX,
-    maximum_recursion_depth,
+    module_tick_interval,
+    question_check_interval,
+    youtube_check_interval,
+    youtube_question_batch_size,
 )
+from servicemodules.dispatcher import Dispatcher
+from servicemodules.outbox import Outbox
 from servicemodules.discordConstants import stampy_dev_priv_channel_id, automatic_question_channel_id
 
 log = get_logger()
@@ -35,6 +39,12 @@ class DiscordHandler:
         self.utils = Utilities.get_instance()
         self.service_utils = self.utils
         self.modules = self.utils.modules_dict.values()
+        self.dispatcher = Dispatcher.get_instance()
+        self.outbox = Outbox.get_instance()
+        self.scheduler = Scheduler.get_instance()
+        self.youtube_poller = YouTubePoller.get_instance()
+        self.warm_up_task: Optional[asyncio.Task] = None
+        self.register_jobs()
         """
         All Discord Functions need to be under another function in order to
         use self.
@@ -48,7 +58,7 @@ class DiscordHandler:
                 searching_for_guild=self.utils.GUILD,
                 guilds=self.utils.client.guilds,
             )
-            guild = discord.utils.get(self.utils.client.guilds, name=self.utils.GUILD)
+            guild = self.utils.get_guild()
             if guild is None:
                 raise Exception("Guild Not Found : '%s'" % self.utils.GUILD)
 
@@ -59,6 +69,9 @@ class DiscordHandler:
             await self.utils.client.get_channel(int(stampy_dev_priv_channel_id)).send(
                 f"I just (re)started {get_git_branch_info()}!"
             )
+            self.scheduler.start(self.dispatcher.loop)
+            if self.warm_up_task is None:
+                self.warm_up_task = asyncio.get_running_loop().create_task(self.warm_up_modules())
 
         @self.utils.client.event
         async def on_message(message: discord.message.Message) -> None:
@@ -96,162 +109,7 @@ class DiscordHandler:
                 log.info(class_name, msg="the latest general discord channel message was not from stampy")
                 self.utils.last_message_was_youtube_question = False
 
-            responses = [Response()]
-            for module in self.modules:
-                log.info(class_name, msg=f"# Asking module: {module}")
-                try:
-                    response = module.process_message(message)
-                except Exception as e:
-                    await self.utils.log_exception(e)
-                if response:
-                    response.module = module  # tag it with the module it came from, for future reference
-
-                    if response.callback:  # break ties between callbacks and text in favour of text
-                        response.confidence -= 0.001
-
-                    responses.append(response)
-
-            for i in range(maximum_recursion_depth):  # don't hang if infinite regress
-                responses = sorted(responses, key=(lambda x: x.confidence), reverse=True)
-                for response in responses:
-                    args_string = ""
-
-                    if response.callback:
-                        args_string = ", ".join([a.__repr__() for a in response.args])
-                        if response.kwargs:
-                            args_string += ", " + ", ".join(
-                                [f"{k}={v.__repr__()}" for k, v in response.kwargs.items()]
-                            )
-                    log.info(
-                        class_name,
-                        response_module=response.module,
-                        response_confidence=response.confidence,
-                        response_is_callback=bool(response.callback),
-                        response_callback=response.callback,
-                        response_args=args_string,
-                        response_text=(
-                            response.text if not isinstance(response.text, Generator) else "[Generator]"
-                        ),
-                        response_reasons=response.why,
-                    )
-
-                top_response = responses.pop(0)
-                try:
-                    if top_response.callback:
-                        log.info(class_name, msg="Top response is a callback. Calling it")
-                        if inspect.iscoroutinefunction(top_response.callback):
-                            new_response = await top_response.callback(*top_response.args, **top_response.kwargs)
-                        else:
-                            new_response = top_response.callback(*top_response.args, **top_response.kwargs)
-
-                        new_response.module = top_response.module
-                        responses.append(new_response)
-                    else:
-                        if top_response:
-                            if self.utils.test_mode:
-                                if is_test_response(message.clean_content):
-                                    return  # must return after process message is called so that response can be evaluated
-                                if is_test_question(message.clean_content):
-                                    top_response.text = (
-                                        TEST_RESPONSE_PREFIX
-                                        + str(get_question_id(message))
-                                        + ": "
-                                        + (
-                                            top_response.text
-                                            if not isinstance(top_response.text, Generator)
-                                            else "".join(list(top_response.text))
-                                        )
-                                    )
-                            log.info(class_name, top_response=top_response.text)
-                            # TODO: check to see if module is allowed to embed via a config?
-                            if top_response.embed:
-                                await message.channel.send(top_response.text, embed=top_response.embed)
-                            elif isinstance(top_response.text, str):
-                                # Discord allows max 2000 characters, use a list or other iterable to sent multiple messages for longer text
-                                await message.channel.send(top_response.text[:2000])
-                            elif isinstance(top_response.text, Iterable):
-                                for chunk in top_response.text:
-                                    await message.channel.send(chunk)
-                        sys.stdout.flush()
-                        return
-                except Exception as e:
-                    log.error(e)
-                    await self.utils.log_exception(e)
-
-            # if we ever get here, we've gone maximum_recursion_depth layers deep without the top response being text
-            # so that's likely an infinite regress
-            await message.channel.send("[Stampy's ears start to smoke. There is a strong smell of recursion]")
-
-        @self.utils.client.event
-        async def on_socket_raw_receive(_) -> None:
-            """
-            This event fires whenever basically anything at all happens.
-            Anyone joining, leaving, sending anything, even typing and not sending...
-            So I'm going to use it as a kind of 'update' or 'tick' function,
-            for things the bot needs to do regularly. Yes this is hacky.
-            Rate limit these things, because this function might be firing a lot
-            """
-            # die if needed
-            if self.utils.stop.is_set():
-                exit()
-
-            # keep the log file fresh
-            sys.stdout.flush()
-
-            # give all the modules a chance to do things
-            for module in self.modules:
-                await module.tick()
-
-            # never fire more than once a second
-            if self.utils.rate_limit("on_socket_raw_receive", seconds=1):
-                return
-
-            # this is needed for later checks, which should all be replaced with rate_limit calls (TODO)
-            now = datetime.now(timezone.utc)
-
-            # check for new youtube comments
-            new_comments = self.utils.check_for_new_youtube_comments()
-            if new_comments:
-                for comment in new_comments:
-                    if "?" in comment["text"]:
-                        self.utils.add_youtube_question(comment)
-            # add_question should maybe just take in the dict, but to make sure
-            # nothing is broken extra fields have been added as optional params
-            # This is just checking if there _are_ questions
-            question_count = self.utils.get_question_count()
-            if question_count:
-                # ask a new question if it's been long enough since we last asked one
-                question_ask_cooldown = timedelta(hours=12)
-
-                if (now - self.utils.last_question_asked_timestamp) > question_ask_cooldown:
-                    if not self.utils.last_message_was_youtube_question:
-                        # Don't ask anything if the last thing posted in the chat was stampy asking a question
-                        self.utils.last_question_asked_timestamp = now
-                        # this actually gets the question and sets it to asked, then sends the report
-                        report = self.utils.get_question(order_type=utilities.OrderType.LATEST)
-                        guild = discord.utils.find(
-                            lambda g: g.name == self.utils.GUILD, self.utils.client.guilds
-                        )
-                        general = discord.utils.get(guild.channels, id=int(automatic_question_channel_id))
-                        await general.send(report)
-                        self.utils.last_message_was_youtube_question = True
-                    else:
-                        # wait the full time again
-                        self.utils.last_question_asked_timestamp = now
-                        log.info(
-                            class_name,
-                            msg="Not asking question: previous post in the channel was a question stampy asked.",
-                        )
-                else:
-                    remaining_cooldown = str(
-                        question_ask_cooldown - (now - self.utils.last_question_asked_timestamp)
-                    )
-                    log.info(
-                        class_name,
-                        msg="%s Questions in queue, waiting %s to post"
-                        % (question_count, remaining_cooldown),
-                    )
-                    return
+            await self.dispatcher.dispatch(message)
 
         @self.utils.client.event
         async def on_raw_reaction_add(payload: discord.raw_models.RawReactionActionEvent) -> None:
@@ -263,26 +121,136 @@ class DiscordHandler:
                 log.info(class_name, emoji=payload.emoji.name.upper())
             log.info(class_name, payload=payload)
 
-            for module in self.modules:
-                await module.process_raw_reaction_event(payload)
+            for module in self.dispatcher.trigger_index.modules_for_reaction(payload.emoji.name):
+                with timed("reaction", module=type(module).__name__):
+                    await module.process_raw_reaction_event(payload)
 
         @self.utils.client.event
         async def on_raw_reaction_remove(payload: discord.raw_models.RawReactionActionEvent) -> None:
             log.info(class_name, msg="RAW REACTION REMOVE")
             log.info(class_name, payload=payload)
 
-            for module in self.modules:
-                await module.process_raw_reaction_event(payload)
-
-    def start(self, event: threading.Event) -> threading.Timer:
-        try:
-            # This line is deprecated in 3.10, but doesn't work otherwise.
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        loop.create_task(self.utils.client.start(discord_token))
-        t = threading.Thread(target=loop.run_forever)
-        t.name = "Discord Thread"
-        t.start()
-        return t
+            for module in self.dispatcher.trigger_index.modules_for_reaction(payload.emoji.name):
+                with timed("reaction", module=type(module).__name__):
+                    await module.process_raw_reaction_event(payload)
+
+        @self.utils.client.event
+        async def on_raw_message_edit(payload: discord.raw_models.RawMessageUpdateEvent) -> None:
+            self.utils.message_cache.forget(payload.message_id)
+
+        @self.utils.client.event
+        async def on_raw_message_delete(payload: discord.raw_models.RawMessageDeleteEvent) -> None:
+            self.utils.message_cache.forget(payload.message_id)
+
+        @self.utils.client.event
+        async def on_raw_bulk_message_delete(payload: discord.raw_models.RawBulkMessageDeleteEvent) -> None:
+            for message_id in payload.message_ids:
+                self.utils.message_cache.forget(message_id)
+
+        # keep the guild and channel lookups up to date
+        for event in (
+            "guild_join",
+            "guild_remove",
+            "guild_update",
+            "guild_channel_create",
+            "guild_channel_delete",
+            "guild_channel_update",
+        ):
+            self.utils.client.event(self.forget_guilds_on(event))
+
+    def forget_guilds_on(self, event: str):
+        async def handler(*args) -> None:
+            self.utils.forget_guilds()
+
+        handler.__name__ = f"on_{event}"
+        return handler
+
+    def register_jobs(self) -> None:
+        """Things the bot needs to do regularly. They start once we've connected to Discord"""
+        self.scheduler.register("check for stop", self.check_for_stop, interval=1)
+        self.scheduler.register("flush log", sys.stdout.flush, interval=1)  # keep the log file fresh
+        self.scheduler.register(
+            "poll youtube", self.youtube_poller.poll, interval=youtube_check_interval, jitter=1, max_runtime=120
+        )
+        self.scheduler.register(
+            "add youtube questions", self.add_youtube_questions, interval=youtube_check_interval, max_runtime=120
+        )
+        self.scheduler.register(
+            "ask queued question", self.ask_queued_question, interval=question_check_interval, jitter=5, max_runtime=60
+        )
+        for module in self.modules:
+            if type(module).tick is not Module.tick:
+                self.scheduler.register(f"{module} tick", module.tick, interval=module_tick_interval, max_runtime=60)
+
+    async def warm_up_modules(self) -> None:
+        """Let the modules load whatever they put off at startup, now that we're up and running"""
+
+        async def warm_up(module: Module) -> None:
+            start = time.monotonic()
+            try:
+                await run_blocking("warm up", module.warm_up)
+            except Exception as e:
+                await self.utils.log_exception(e)
+            else:
+                log.info(class_name, msg=f"Warmed up {module} in {time.monotonic() - start:.2f} seconds")
+
+        await asyncio.gather(*[warm_up(m) for m in self.modules if type(m).warm_up is not Module.warm_up])
+
+    def check_for_stop(self) -> None:
+        if self.utils.stop is not None and self.utils.stop.is_set():
+            self.dispatcher.loop.call_soon_threadsafe(self.dispatcher.loop.stop)
+
+    async def add_youtube_questions(self) -> None:
+        """Add a batch of the new comments the poller found to the question queue, if they're questions"""
+        comments = self.youtube_poller.take_comments(youtube_question_batch_size)
+        questions = [comment for comment in comments if "?" in comment["text"]]
+        results = await asyncio.gather(
+            *[run_blocking("wiki", self.utils.add_youtube_question, question) for question in questions],
+            return_exceptions=True,
+        )
+        for question, result in zip(questions, results):
+            if isinstance(result, Exception):
+                log.error(class_name, msg="Couldn't add YouTube question", url=question["url"], error=result)
+
+    async def ask_queued_question(self) -> None:
+        # add_question should maybe just take in the dict, but to make sure
+        # nothing is broken extra fields have been added as optional params
+        # This is just checking if there _are_ questions
+        question_count = await run_blocking("wiki", self.utils.get_question_count)
+        if not question_count:
+            return
+
+        # ask a new question if it's been long enough since we last asked one
+        now = datetime.now(timezone.utc)
+        question_ask_cooldown = timedelta(hours=12)
+
+        if (now - self.utils.last_question_asked_timestamp) > question_ask_cooldown:
+            if not self.utils.last_message_was_youtube_question:
+                # Don't ask anything if the last thing posted in the chat was stampy asking a question
+                self.utils.last_question_asked_timestamp = now
+                # this actually gets the question and sets it to asked, then sends the report
+                report = await run_blocking("wiki", self.utils.get_question, order_type=utilities.OrderType.LATEST)
+                general = self.utils.get_channel(automatic_question_channel_id)
+                await general.send(report)
+                self.utils.last_message_was_youtube_question = True
+            else:
+                # wait the full time again
+                self.utils.last_question_asked_timestamp = now
+                log.info(
+                    class_name, msg="Not asking question: previous post in the channel was a question stampy asked.",
+                )
+        else:
+            remaining_cooldown = str(question_ask_cooldown - (now - self.utils.last_question_asked_timestamp))
+            log.info(
+                class_name, msg="%s Questions in queue, waiting %s to post" % (question_count, remaining_cooldown),
+            )
+
+    async def send_response(self, message: DiscordMessage, response: Response) -> None:
+        # TODO: check to see if module is allowed to embed via a config?
+        # Discord allows max 2000 characters, the outbox splits longer text into several messages
+        self.outbox.send(message, response)
+
+    def start(self, event: threading.Event) -> threading.Thread:
+        # the discord client shares the dispatcher's loop, so its events are handled there directly
+        asyncio.run_coroutine_threadsafe(self.utils.client.start(discord_token), self.dispatcher.loop)
+        return self.dispatcher.start()
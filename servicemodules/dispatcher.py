@@ -0,0 +1,348 @@
+import asyncio
+import inspect
+import sys
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import (
+    TEST_RESPONSE_PREFIX,
+    maximum_recursion_depth,
+    dispatcher_max_workers,
+    inbound_channel_limit,
+    inbound_service_limit,
+    inbound_overflow_policies,
+    module_executor_workers,
+    module_process_message_deadline,
+    speculative_callback_limit,
+    speculative_response_deadline,
+)
+from modules.module import Module, Response
+from servicemodules.serviceConstants import Services
+from servicemodules.triggerindex import TriggerIndex
+from structlog import get_logger
+from typing import Generator, Optional
+from utilities import Utilities, is_test_response, is_test_question, get_question_id
+from utilities.blocking import run_blocking
+from utilities.metrics import timed
+from utilities.serviceutils import ServiceMessage
+
+log = get_logger()
+class_name = "Dispatcher"
+
+RECURSION_RESPONSE = "[Stampy's ears start to smoke. There is a strong smell of recursion]"
+
+
+class Dispatcher:
+    """Routes incoming ServiceMessages through the modules and hands the winning response back to the service.
+
+    There is one Dispatcher per process. It owns a single long-lived event loop, running in its own thread,
+    which every service module submits messages to. Messages in the same channel are handled in the order
+    they were submitted, and at most `dispatcher_max_workers` messages are handled at once.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get_instance() -> "Dispatcher":
+        if Dispatcher.__instance is None:
+            return Dispatcher()
+        return Dispatcher.__instance
+
+    def __init__(self):
+        if Dispatcher.__instance is not None:
+            raise Exception("This class is a singleton!")
+        Dispatcher.__instance = self
+        self.utils = Utilities.get_instance()
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.worker_slots = None
+        self.module_executor = ThreadPoolExecutor(max_workers=module_executor_workers, thread_name_prefix="Module")
+        self._trigger_index = None
+
+        # (service, channel id) -> deque of (message, future) still waiting to be handled
+        self.channel_queues: dict[tuple, deque] = {}
+        # (service, channel id) -> the task draining that channel's queue
+        self.channel_workers: dict[tuple, asyncio.Task] = {}
+        # service -> how many messages are waiting in all its channels' queues
+        self.service_depth: Counter = Counter()
+        # how many messages were queued behind others ("delayed"), dropped, or collapsed into another
+        self.inbound_counts: Counter = Counter()
+
+    def start(self) -> threading.Thread:
+        """Start the dispatcher loop in its own thread, if it isn't running already"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="Dispatcher Thread")
+            self.thread.start()
+        return self.thread
+
+    def stop(self) -> None:
+        """Stop the dispatcher loop and wait for its thread to finish"""
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.worker_slots = asyncio.Semaphore(dispatcher_max_workers)
+        self.loop.run_forever()
+
+    def submit(self, message: ServiceMessage) -> Future:
+        """Thread-safe way to hand a message to the dispatcher.
+        Returns a concurrent.futures.Future which resolves to the response that was chosen"""
+        return asyncio.run_coroutine_threadsafe(self.dispatch(message), self.loop)
+
+    async def dispatch(self, message: ServiceMessage) -> Response:
+        """Queue the message behind any others from the same channel, and wait for its response.
+        Must be awaited on the dispatcher loop"""
+        key = self._ordering_key(message)
+        if self._is_full(key, message.service):
+            future = self._shed_load(key, message)
+            if future is not None:
+                return await future
+
+        future = self.loop.create_future()
+        queue = self.channel_queues.setdefault(key, deque())
+        if queue:
+            self.inbound_counts["delayed"] += 1
+        queue.append((message, future))
+        self.service_depth[message.service] += 1
+        if key not in self.channel_workers:
+            self.channel_workers[key] = self.loop.create_task(self._drain_channel(key))
+        return await future
+
+    def _is_full(self, key: tuple, service: Services) -> bool:
+        return (
+            len(self.channel_queues.get(key, ())) >= inbound_channel_limit
+            or self.service_depth[service] >= inbound_service_limit
+        )
+
+    def _shed_load(self, key: tuple, message: ServiceMessage) -> Optional[asyncio.Future]:
+        """Apply the inbound_overflow_policies to a message whose queue is full.
+        Returns the future to wait on instead of queueing the message, or None if it should be queued after all"""
+        for policy in inbound_overflow_policies:
+            if policy == "collapse":
+                for queued, future in self.channel_queues.get(key, ()):
+                    if queued.author.id == message.author.id and queued.content == message.content:
+                        self.inbound_counts["collapsed"] += 1
+                        return future
+            elif policy == "drop_unaddressed":
+                if not message.is_addressed:
+                    self.inbound_counts["dropped"] += 1
+                    future = self.loop.create_future()
+                    future.set_result(Response())
+                    return future
+                if self._drop_oldest_unaddressed(key, message.service):
+                    return None
+        return None
+
+    def _drop_oldest_unaddressed(self, key: tuple, service: Services) -> bool:
+        """Make room by dropping the oldest waiting message that isn't directed at Stampy,
+        from the same channel if possible, otherwise from anywhere on the same service"""
+        keys = [key] + [k for k in self.channel_queues if k != key and k[0] == service]
+        for k in keys:
+            queue = self.channel_queues.get(k, ())
+            for entry in queue:
+                queued, future = entry
+                if not queued.is_addressed:
+                    queue.remove(entry)
+                    self.service_depth[service] -= 1
+                    self.inbound_counts["dropped"] += 1
+                    future.set_result(Response())
+                    return True
+        return False
+
+    def inbound_summary(self) -> str:
+        """For the stats command"""
+        waiting = ", ".join(f"{service}: {depth}" for service, depth in self.service_depth.items())
+        return (
+            f"{waiting or 'nothing'} waiting; {self.inbound_counts['delayed']} delayed, "
+            f"{self.inbound_counts['dropped']} dropped, {self.inbound_counts['collapsed']} collapsed"
+        )
+
+    @staticmethod
+    def _ordering_key(message: ServiceMessage) -> tuple:
+        if message.service == Services.FLASK:
+            # every web request is its own conversation, so they don't need to wait for each other
+            return message.service, message.id
+        return message.service, message.channel.id
+
+    async def _drain_channel(self, key: tuple) -> None:
+        queue = self.channel_queues[key]
+        try:
+            while queue:
+                message, future = queue.popleft()
+                self.service_depth[message.service] -= 1
+                async with self.worker_slots:
+                    try:
+                        future.set_result(await self.process(message))
+                    except Exception as e:
+                        log.error(class_name, error=e)
+                        future.set_exception(e)
+        finally:
+            del self.channel_workers[key]
+            del self.channel_queues[key]
+
+    @property
+    def trigger_index(self) -> TriggerIndex:
+        """The TriggerIndex for the currently loaded modules, rebuilt whenever they change"""
+        modules = tuple(self.utils.modules_dict.values())
+        if self._trigger_index is None or self._trigger_index.modules != modules:
+            self._trigger_index = TriggerIndex(modules)
+        return self._trigger_index
+
+    def get_modules(self, message: ServiceMessage) -> list[Module]:
+        """The modules that should be asked about this message"""
+        requested = getattr(message, "modules", None)  # the web interface can pick which modules to ask
+        names = {module: name for name, module in self.utils.modules_dict.items()}
+        modules = []
+        for module in self.trigger_index.modules_for_message(message):
+            if requested and names[module] not in requested:
+                log.info(class_name, msg=f"# Skipping module: {names[module]}")
+                continue
+            modules.append(module)
+        return modules
+
+    async def ask_module(self, module: Module, message: ServiceMessage) -> Optional[Response]:
+        """Ask one module about the message, giving up on it if it takes longer than its deadline"""
+        log.info(class_name, msg=f"# Asking module: {module}")
+        deadline = module.process_message_deadline or module_process_message_deadline
+        if inspect.iscoroutinefunction(module.process_message):
+            answer = module.process_message(message)
+        else:
+            answer = self.loop.run_in_executor(self.module_executor, module.process_message, message)
+        try:
+            with timed("process_message", module=type(module).__name__):
+                return await asyncio.wait_for(answer, timeout=deadline)
+        except asyncio.TimeoutError:
+            log.warning(class_name, msg=f"{module} didn't answer within {deadline} seconds, dropping its response")
+        except Exception as e:
+            await self.utils.log_exception(e)
+        return None
+
+    async def ask_modules(self, message: ServiceMessage) -> list[Response]:
+        """Ask all the modules about the message at once"""
+        modules = self.get_modules(message)
+        answers = await asyncio.gather(*[self.ask_module(module, message) for module in modules])
+
+        responses = [Response()]
+        for module, response in zip(modules, answers):
+            if response:
+                response.module = module  # tag it with the module it came from, for future reference
+
+                if response.callback:  # break ties between callbacks and text in favour of text
+                    response.confidence -= 0.001
+
+                responses.append(response)
+        return responses
+
+    @staticmethod
+    def log_responses(responses: list[Response]) -> None:
+        for response in responses:
+            args_string = ""
+
+            if response.callback:
+                args_string = ", ".join([a.__repr__() for a in response.args])
+                if response.kwargs:
+                    args_string += ", " + ", ".join([f"{k}={v.__repr__()}" for k, v in response.kwargs.items()])
+            log.info(
+                class_name,
+                response_module=response.module,
+                response_confidence=response.confidence,
+                response_is_callback=bool(response.callback),
+                response_callback=response.callback,
+                response_args=args_string,
+                response_text=(response.text if not isinstance(response.text, Generator) else "[Generator]"),
+                response_reasons=response.why,
+            )
+
+    @staticmethod
+    async def run_callback(response: Response) -> Response:
+        backend = type(response.module).__name__
+        with timed("callback", module=backend):
+            if inspect.iscoroutinefunction(response.callback):
+                return await response.callback(*response.args, **response.kwargs)
+            # plain callbacks are usually waiting on some web API, which would hold up every other channel
+            return await run_blocking(backend, response.callback, *response.args, **response.kwargs)
+
+    def speculate(self, responses: list[Response], speculating: dict[int, tuple]) -> None:
+        """Start running the most promising speculative callbacks that aren't already running,
+        as long as they could still beat the best text response, up to speculative_callback_limit at once"""
+        best_text_confidence = max(r.confidence for r in responses if not r.callback)
+        for response in responses:
+            if len(speculating) >= speculative_callback_limit:
+                break
+            if not response.callback or response.confidence <= best_text_confidence:
+                break
+            if response.speculative and id(response) not in speculating:
+                log.info(class_name, msg="Speculatively calling callback", response_callback=response.callback)
+                task = self.loop.create_task(self.run_callback(response))
+                speculating[id(response)] = (response, task)
+
+    async def get_response(self, message: ServiceMessage) -> Response:
+        """Ask every module about the message, then keep calling the most promising callback
+        until the most confident response is a text response.
+
+        If speculative_callback_limit is set, speculative callbacks are started before it's their turn,
+        so that a slow callback which turns out not to have an answer doesn't hold up the next one.
+        Whatever is still running once a text response wins is cancelled."""
+        responses = await self.ask_modules(message)
+        speculating = {}  # id(response) -> (response, task)
+        deadline = self.loop.time() + speculative_response_deadline if speculative_callback_limit else None
+
+        try:
+            for _ in range(maximum_recursion_depth):  # don't hang if infinite regress
+                responses = sorted(responses, key=(lambda x: x.confidence), reverse=True)
+                self.log_responses(responses)
+                if speculative_callback_limit:
+                    self.speculate(responses, speculating)
+
+                top_response = responses.pop(0)
+                if not top_response.callback:
+                    return top_response
+
+                log.info(class_name, msg="Top response is a callback. Calling it")
+                _, task = speculating.pop(id(top_response), (None, None))
+                try:
+                    if deadline is None:
+                        new_response = await self.run_callback(top_response)
+                    else:
+                        new_response = await asyncio.wait_for(
+                            task or self.run_callback(top_response), timeout=deadline - self.loop.time()
+                        )
+                except asyncio.TimeoutError:
+                    log.warning(class_name, msg="Response deadline passed, using the best text response so far")
+                    return next(response for response in responses if not response.callback)
+                except Exception as e:
+                    log.error(class_name, error=e)
+                    await self.utils.log_exception(e)
+                    continue
+                new_response.module = top_response.module
+                responses.append(new_response)
+        finally:
+            for _, task in speculating.values():
+                task.cancel()
+
+        # if we ever get here, we've gone maximum_recursion_depth layers deep without the top response being text
+        # so that's likely an infinite regress
+        return Response(text=RECURSION_RESPONSE, why="maximum recursion depth reached")
+
+    async def process(self, message: ServiceMessage) -> Response:
+        top_response = await self.get_response(message)
+        if top_response and self.utils.test_mode:
+            # Discord content has raw <@id> mentions and the like, so look for the markers in what people see
+            content = message.clean_content if message.service == Services.DISCORD else message.content
+            if is_test_response(content):
+                return Response()  # must return after process message is called so that response can be evaluated
+            if is_test_question(content):
+                text = top_response.text
+                if isinstance(text, Generator):
+                    text = "".join(list(text))
+                top_response.text = TEST_RESPONSE_PREFIX + str(get_question_id(message)) + ": " + text
+
+        if top_response:
+            log.info(class_name, top_response=top_response.text)
+            await self.utils.service_modules_dict[message.service].send_response(message, top_response)
+        sys.stdout.flush()
+        return top_response
+
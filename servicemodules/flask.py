@@ -1,22 +1,18 @@
 from flask import Response as FlaskResponse
 from collections.abc import Iterable
-from config import TEST_RESPONSE_PREFIX, maximum_recursion_depth
+from config import stamp_leaderboard_size
 from flask import Flask, request
 from modules.module import Response
+from servicemodules.dispatcher import Dispatcher
 from structlog import get_logger
 from utilities import (
     flaskutils,
     Utilities,
     is_test_message,
-    is_test_question,
-    is_test_response,
-    get_question_id,
 )
 from utilities.flaskutils import FlaskMessage, FlaskUtilities
-import asyncio
-import inspect
+from utilities.metrics import Metrics
 import json
-import sys
 import threading
 
 class_name = "FlaskHandler"
@@ -32,6 +28,7 @@ class FlaskHandler(threading.Thread):
         self.flaskutils = FlaskUtilities.get_instance()
         self.service_utils = self.flaskutils
         self.modules = self.utils.modules_dict
+        self.dispatcher = Dispatcher.get_instance()
 
     def process_event(self) -> FlaskResponse:
         """
@@ -62,6 +59,24 @@ class FlaskHandler(threading.Thread):
     def process_list_modules(self) -> FlaskResponse:
         return FlaskResponse(json.dumps(list(self.modules.keys())))
 
+    def process_metrics(self) -> FlaskResponse:
+        return FlaskResponse(Metrics.get_instance().prometheus(), 200, mimetype="text/plain; version=0.0.4")
+
+    def process_stamp_leaderboard(self) -> FlaskResponse:
+        stamps_module = self.modules.get("StampsModule")
+        if stamps_module is None:
+            return FlaskResponse("The stamps module isn't loaded", 404)
+        count = request.args.get("limit", default=stamp_leaderboard_size, type=int)
+        leaderboard = stamps_module.get_leaderboard(max(0, min(count, 1000)))
+        return FlaskResponse(json.dumps(leaderboard), 200, mimetype="application/json")
+
+    def process_stamp_ranking(self, user_id: int) -> FlaskResponse:
+        stamps_module = self.modules.get("StampsModule")
+        ranking = stamps_module.get_user_ranking(user_id) if stamps_module is not None else None
+        if ranking is None:
+            return FlaskResponse(json.dumps({"error": "No stamps for that user"}), 404, mimetype="application/json")
+        return FlaskResponse(json.dumps(ranking), 200, mimetype="application/json")
+
     def on_message(self, message) -> FlaskResponse:
 
         if is_test_message(message.content) and self.utils.test_mode:
@@ -77,77 +92,23 @@ class FlaskHandler(threading.Thread):
             message_content=message.content,
         )
 
-        responses = [Response()]
-        for key in self.modules:
-            if message.modules and key not in message.modules:
-                log.info(class_name, msg=f"# Skipping module: {key}")
-                continue  # Skip this module if it's not requested.
-            module = self.modules[key]
-            log.info(class_name, msg=f"# Asking module: {module}")
-            response = module.process_message(message)
-            if response:
-                response.module = module
-                if response.callback:
-                    response.confidence -= 0.001
-                responses.append(response)
-
-        for i in range(maximum_recursion_depth):
-            responses = sorted(responses, key=(lambda x: x.confidence), reverse=True)
-
-            for response in responses:
-                args_string = ""
-                if response.callback:
-                    args_string = ", ".join([a.__repr__() for a in response.args])
-                    if response.kwargs:
-                        args_string += ", " + ", ".join(
-                            [f"{k}={v.__repr__()}" for k, v in response.kwargs.items()]
-                        )
-                log.info(
-                    class_name,
-                    response_module=response.module,
-                    response_confidence=response.confidence,
-                    response_is_callback=bool(response.callback),
-                    response_callback=response.callback,
-                    response_args=args_string,
-                    response_text=response.text,
-                    response_reasons=response.why,
-                )
-
-            top_response = responses.pop(0)
-
-            if top_response.callback:
-                log.info(class_name, msg="top response is a callback.  Calling it")
-                if inspect.iscoroutinefunction(top_response.callback):
-                    new_response = asyncio.run(
-                        top_response.callback(*top_response.args, **top_response.kwargs)
-                    )
-                else:
-                    new_response = top_response.callback(*top_response.args, **top_response.kwargs)
-
-                new_response.module = top_response.module
-                responses.append(new_response)
-            else:
-                if top_response:
-                    log.info(class_name, top_response=top_response.text)
-                    if isinstance(top_response.text, str):
-                        ret = FlaskResponse(top_response.text, 200)
-                    elif isinstance(top_response.text, Iterable):
-                        builder = ""
-                        for chunk in top_response.text:
-                            builder += chunk
-                        ret = FlaskResponse(builder, 200)
-                    else:
-                        ret = FlaskResponse("I don't have anything to say about that.", 200)
-                else:
-                    ret = FlaskResponse("I don't have anything to say about that.", 200)
-                sys.stdout.flush()
-                return ret
-        # If we get here we've hit maximum_recursion_depth.
-        return FlaskResponse("[Stampy's ears start to smoke.  There is a strong smell of recursion]", 200)
+        top_response = self.dispatcher.submit(message).result()
+        if top_response:
+            if isinstance(top_response.text, str):
+                return FlaskResponse(top_response.text, 200)
+            elif isinstance(top_response.text, Iterable):
+                return FlaskResponse("".join(top_response.text), 200)
+        return FlaskResponse("I don't have anything to say about that.", 200)
+
+    async def send_response(self, message: FlaskMessage, response: Response) -> None:
+        pass  # the response is returned to the web client by on_message instead
 
     def run(self):
         app.add_url_rule("/", view_func=self.process_event, methods=["POST"])
         app.add_url_rule("/list_modules", view_func=self.process_list_modules, methods=["GET"])
+        app.add_url_rule("/metrics", view_func=self.process_metrics, methods=["GET"])
+        app.add_url_rule("/stamps/leaderboard", view_func=self.process_stamp_leaderboard, methods=["GET"])
+        app.add_url_rule("/stamps/<int:user_id>", view_func=self.process_stamp_ranking, methods=["GET"])
         app.run(host="0.0.0.0", port=2300, debug=False)
 
     def stop(self):
@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from config import outbox_rate_limits, outbox_message_length_limits
+from dataclasses import dataclass
+from modules.module import Response
+from structlog import get_logger
+from utilities import Utilities
+from utilities.blocking import run_blocking
+from utilities.serviceutils import ServiceChannel, ServiceMessage
+
+log = get_logger()
+class_name = "Outbox"
+
+
+class TokenBucket:
+    """Allows `capacity` sends in any burst, refilling at `capacity` per `period` seconds"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def take(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class OutgoingResponse:
+    channel: ServiceChannel
+    response: Response
+    max_length: int
+    queued_at: float
+
+
+class Outbox:
+    """Sends responses in the background, one queue per channel, so handling a message doesn't wait for it.
+
+    Text chunks from the same response are joined and re-split at up to the service's message length limit,
+    so a list of short lines goes out as a few full messages instead of dozens of small ones. Sends to each
+    channel are paced by a token bucket (`outbox_rate_limits` in config), matching the per-channel rate
+    limit buckets, so we wait our turn instead of running into 429s.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get_instance() -> "Outbox":
+        if Outbox.__instance is None:
+            return Outbox()
+        return Outbox.__instance
+
+    def __init__(self):
+        if Outbox.__instance is not None:
+            raise Exception("This class is a singleton!")
+        Outbox.__instance = self
+        # (service, channel id) -> responses waiting to be sent, and the task sending them
+        self.queues: dict[tuple, deque[OutgoingResponse]] = {}
+        self.workers: dict[tuple, asyncio.Task] = {}
+        self.buckets: dict[tuple, TokenBucket] = {}
+
+        self.responses_sent = 0
+        self.messages_sent = 0
+        self.chunks_coalesced = 0  # how many fewer messages we sent than there were chunks
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def send(self, message: ServiceMessage, response: Response) -> None:
+        """Queue the response to go to the channel the message came from. Must be called on the event loop"""
+        service = str(message.service)
+        key = (service, message.channel.id)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(*outbox_rate_limits.get(service, (5, 5.0)))
+        outgoing = OutgoingResponse(
+            message.channel, response, outbox_message_length_limits.get(service, 2000), time.monotonic()
+        )
+        self.queues.setdefault(key, deque()).append(outgoing)
+        if key not in self.workers:
+            self.workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def _drain(self, key: tuple) -> None:
+        queue = self.queues[key]
+        try:
+            while queue:
+                outgoing = queue.popleft()
+                try:
+                    await self._deliver(key, outgoing)
+                except Exception as e:
+                    await Utilities.get_instance().log_exception(e)
+                self.responses_sent += 1
+                latency = time.monotonic() - outgoing.queued_at
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+        finally:
+            del self.workers[key]
+            del self.queues[key]
+
+    async def _deliver(self, key: tuple, outgoing: OutgoingResponse) -> None:
+        text, embed = outgoing.response.text, outgoing.response.embed
+        if embed:
+            await self._send(key, outgoing.channel, text, embed=embed)
+        elif isinstance(text, str):
+            await self._send_text(key, outgoing, [text])
+        elif isinstance(text, (list, tuple)):
+            await self._send_text(key, outgoing, text)
+        elif isinstance(text, Iterable):
+            # generators can do slow things between chunks (wiki edits, say), so send each chunk as it comes
+            chunks: Iterator = iter(text)
+            while (chunk := await run_blocking("outbox", next, chunks, None)) is not None:
+                await self._send_text(key, outgoing, [chunk])
+
+    async def _send_text(self, key: tuple, outgoing: OutgoingResponse, chunks: Iterable[str]) -> None:
+        chunks = [chunk for chunk in chunks if chunk]
+        if not chunks:
+            return
+        pieces = Utilities.split_message_for_discord("\n".join(chunks), max_length=outgoing.max_length)
+        self.chunks_coalesced += max(0, len(chunks) - len(pieces))
+        for piece in pieces:
+            await self._send(key, outgoing.channel, piece)
+
+    async def _send(self, key: tuple, channel: ServiceChannel, text: str, embed=None) -> None:
+        await self.buckets[key].take()
+        if embed:
+            await channel.send(text, embed=embed)
+        else:
+            await channel.send(text)
+        self.messages_sent += 1
+
+    def summary(self) -> str:
+        """For the stats command"""
+        mean_latency = self.total_latency / self.responses_sent if self.responses_sent else 0.0
+        return (
+            f"{self.responses_sent} responses sent as {self.messages_sent} messages "
+            f"({self.chunks_coalesced} chunks coalesced), {self.depth} queued, "
+            f"send latency mean {mean_latency:.2f}s, max {self.max_latency:.2f}s"
+        )
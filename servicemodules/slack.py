@@ -1,19 +1,15 @@
-import asyncio
-import sys
-import inspect
 import threading
-from utilities import Utilities, is_test_message, is_test_question, is_test_response, get_question_id
+from utilities import Utilities, is_test_message
 from utilities.slackutils import SlackUtilities, SlackMessage
 from modules.module import Response
-from collections.abc import Iterable
-from datetime import datetime
-from config import TEST_RESPONSE_PREFIX, maximum_recursion_depth, slack_app_token, slack_bot_token
+from config import slack_app_token, slack_bot_token
+from servicemodules.dispatcher import Dispatcher
+from servicemodules.outbox import Outbox
 from slack_sdk.socket_mode import SocketModeClient
 from slack_sdk.socket_mode.response import SocketModeResponse
 from slack_sdk.socket_mode.request import SocketModeRequest
 from slack_sdk.web import WebClient
 from structlog import get_logger
-from typing import Generator
 
 log = get_logger()
 class_name = "SlackHandler"
@@ -25,6 +21,8 @@ class SlackHandler:
         self.slackutils = SlackUtilities.get_instance()
         self.service_utils = self.slackutils
         self.modules = self.utils.modules_dict.values()
+        self.dispatcher = Dispatcher.get_instance()
+        self.outbox = Outbox.get_instance()
 
     def process_event(self, client: SocketModeClient, req: SocketModeRequest) -> None:
         if req.type == "events_api":
@@ -67,81 +65,10 @@ class SlackHandler:
             message_content=message.content,
         )
 
-        responses = [Response()]
-        for module in self.modules:
-            log.info(class_name, msg=f"# Asking module: {module}")
-            response = module.process_message(message)
-            if response:
-                response.module = module
-                if response.callback:
-                    response.confidence -= 0.001
-                responses.append(response)
-
-        for i in range(maximum_recursion_depth):
-            responses = sorted(responses, key=(lambda x: x.confidence), reverse=True)
-
-            for response in responses:
-                args_string = ""
-                if response.callback:
-                    args_string = ", ".join([a.__repr__() for a in response.args])
-                    if response.kwargs:
-                        args_string += ", " + ", ".join(
-                            [f"{k}={v.__repr__()}" for k, v in response.kwargs.items()]
-                        )
-                log.info(
-                    class_name,
-                    response_module=response.module,
-                    response_confidence=response.confidence,
-                    response_is_callback=bool(response.callback),
-                    response_callback=response.callback,
-                    response_args=args_string,
-                    response_text=(
-                        response.text if not isinstance(response.text, Generator) else "[Generator]"
-                    ),
-                    response_reasons=response.why,
-                )
+        self.dispatcher.submit(message)
 
-            top_response = responses.pop(0)
-
-            if top_response.callback:
-                log.info(class_name, msg="top response is a callback.  Calling it")
-                if inspect.iscoroutinefunction(top_response.callback):
-                    new_response = asyncio.run(
-                        top_response.callback(*top_response.args, **top_response.kwargs)
-                    )
-                else:
-                    new_response = top_response.callback(*top_response.args, **top_response.kwargs)
-
-                new_response.module = top_response.module
-                responses.append(new_response)
-            else:
-                if top_response:
-                    if self.utils.test_mode:
-                        if is_test_response(message.content):
-                            return
-                        if is_test_question(message.content):
-                            top_response.text = (
-                                TEST_RESPONSE_PREFIX
-                                + str(get_question_id(message))
-                                + ": "
-                                + (
-                                    top_response.text
-                                    if not isinstance(top_response.text, Generator)
-                                    else "".join(list(top_response.text))
-                                )
-                            )
-                    log.info(class_name, top_response=top_response.text)
-                    if isinstance(top_response.text, str):
-                        asyncio.run(message.channel.send(top_response.text))
-                    elif isinstance(top_response.text, Iterable):
-                        for chunk in top_response.text:
-                            asyncio.run(message.channel.send(chunk))
-                sys.stdout.flush()
-                return
-        # If we get here we've hit maximum_recursion_depth.
-        asyncio.run(
-            message.channel.send("[Stampy's ears start to smoke.  There is a strong smell of recursion]")
-        )
+    async def send_response(self, message: SlackMessage, response: Response) -> None:
+        self.outbox.send(message, response)
 
     def _start(self, event: threading.Event):
         import logging
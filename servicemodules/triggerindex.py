@@ -0,0 +1,111 @@
+import re
+from collections.abc import Iterable
+from modules.module import Module
+from typing import Optional, Pattern, Union
+from utilities.serviceutils import ServiceMessage, re_words
+re_named_group = re.compile(r"\(\?P<\w+>")
+
+
+def scoped_pattern(prefix: Union[str, Pattern]) -> str:
+    """The source of a prefix regex, with any flags it was compiled with scoped to it,
+    so that it can be joined into one big alternation with the others.
+    Named groups are made anonymous, since we only care whether it matches and the names may clash"""
+    if isinstance(prefix, str):
+        return f"(?:{re_named_group.sub('(?:', prefix)})"
+    flags = ""
+    if prefix.flags & re.IGNORECASE:
+        flags += "i"
+    if prefix.flags & re.MULTILINE:
+        flags += "m"
+    if prefix.flags & re.DOTALL:
+        flags += "s"
+    if prefix.flags & re.VERBOSE:
+        flags += "x"
+    pattern = re_named_group.sub("(?:", prefix.pattern)
+    if prefix.flags & re.VERBOSE:
+        pattern += "\n"  # ends any trailing comment before the group is closed
+    return f"(?{flags}:{pattern})"
+
+
+class TriggerIndex:
+    """Works out which modules need to be asked about a message from their declared Triggers,
+    without running every module's own checks.
+
+    Every prefix regex is joined into one alternation per kind of text (addressed or not), so messages that
+    don't start with any known command are ruled out with a single match, and keywords are looked up
+    word by word in a trie, so the cost of that doesn't grow with the number of keywords.
+    """
+
+    def __init__(self, modules: Iterable[Module]):
+        self.modules = tuple(modules)
+        self.keyword_trie: dict = {}
+        self.prefix_patterns: dict[Module, Pattern] = {}
+        addressed_prefixes, unaddressed_prefixes = [], []
+
+        for module in self.modules:
+            triggers = module.triggers
+            if triggers is None:
+                continue
+            for keyword in triggers.keywords:
+                node = self.keyword_trie
+                for word in re_words.findall(keyword.lower()):
+                    node = node.setdefault(word, {})
+                node.setdefault(None, set()).add(module)
+            if triggers.prefixes:
+                patterns = [scoped_pattern(prefix) for prefix in triggers.prefixes]
+                self.prefix_patterns[module] = re.compile("|".join(patterns))
+                (addressed_prefixes if triggers.addressed else unaddressed_prefixes).extend(patterns)
+
+        self.addressed_prefixes = re.compile("|".join(addressed_prefixes)) if addressed_prefixes else None
+        self.unaddressed_prefixes = re.compile("|".join(unaddressed_prefixes)) if unaddressed_prefixes else None
+        self.needs_addressed_text = any(m.triggers and m.triggers.addressed for m in self.modules)
+
+    def keyword_matches(self, words: tuple[str, ...]) -> set[Module]:
+        """The modules with a keyword that appears in the words"""
+        matches = set()
+        for start in range(len(words)):
+            node = self.keyword_trie
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                matches |= node.get(None, set())
+        return matches
+
+    def modules_for_message(self, message: ServiceMessage) -> list[Module]:
+        """The modules that should be asked about the message, in their original order"""
+        text = message.clean_content
+        at_me = message.addressed_text if self.needs_addressed_text else False
+        keyword_matches = self.keyword_matches(message.tokens) if self.keyword_trie else set()
+        addressed_prefix_hit = bool(at_me and self.addressed_prefixes and self.addressed_prefixes.match(at_me))
+        unaddressed_prefix_hit = bool(self.unaddressed_prefixes and self.unaddressed_prefixes.match(text))
+
+        modules = []
+        for module in self.modules:
+            triggers = module.triggers
+            if triggers is None:
+                modules.append(module)
+                continue
+            if triggers.services and message.service not in triggers.services:
+                continue
+            if triggers.addressed and at_me is False:
+                continue
+            if triggers.prefixes or triggers.keywords:
+                if module in keyword_matches:
+                    modules.append(module)
+                    continue
+                prefix_hit = addressed_prefix_hit if triggers.addressed else unaddressed_prefix_hit
+                pattern = self.prefix_patterns.get(module)
+                if prefix_hit and pattern and pattern.match(at_me if triggers.addressed else text):
+                    modules.append(module)
+                continue
+            modules.append(module)
+        return modules
+
+    def modules_for_reaction(self, emoji_name: Optional[str]) -> list[Module]:
+        """The modules that should be told about a reaction with this emoji"""
+        return [
+            module
+            for module in self.modules
+            if module.triggers is None or emoji_name in module.triggers.reactions
+        ]
@@ -1,7 +1,10 @@
 import os
 import sys
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from servicemodules.discord import DiscordHandler
+from servicemodules.dispatcher import Dispatcher
 from servicemodules.slack import SlackHandler
 from servicemodules.flask import FlaskHandler
 from utilities import Utilities
@@ -12,6 +15,7 @@ from config import (
     prod_local_path,
     ENVIRONMENT_TYPE,
     acceptable_environment_types,
+    module_loader_workers,
 )
 from servicemodules.serviceConstants import Services
 
@@ -20,21 +24,49 @@ log = get_logger()
 
 
 def get_stampy_modules():
-    stampy_modules = {}
+    """Import every file in modules/ and make one of each Module class in them.
+    The files are imported one at a time, but the modules are constructed in parallel,
+    since some of them do slow I/O in __init__"""
+    Utilities.get_instance()  # the constructors all use it, so make it before they race to
+    start = time.perf_counter()
+    timings = {}
+    module_classes = []
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules")
     for file_title in [f[:-3] for f in os.listdir(path) if f.endswith(".py") and f != "__init__.py"]:
         log.info("import", filename=file_title)
+        import_start = time.perf_counter()
         mod = __import__(".".join(["modules", file_title]), fromlist=[file_title])
+        timings[f"import {file_title}"] = time.perf_counter() - import_start
         log.info("import", module_name=mod)
         for attribute in dir(mod):
             cls = getattr(mod, attribute)
             if isinstance(cls, type) and issubclass(cls, Module) and cls is not Module:
                 log.info("import Module Found", module_name=attribute)
-                stampy_modules[cls.__name__] = cls()
+                module_classes.append(cls)
+
+    def construct(cls: type) -> Module:
+        construct_start = time.perf_counter()
+        try:
+            return cls()
+        finally:
+            timings[cls.__name__] = time.perf_counter() - construct_start
+
+    with ThreadPoolExecutor(max_workers=module_loader_workers, thread_name_prefix="Module Loader") as executor:
+        stampy_modules = dict(zip([cls.__name__ for cls in module_classes], executor.map(construct, module_classes)))
     log.info("LOADED MODULES", modules=sorted(stampy_modules.keys()))
+    for line in startup_report(timings, time.perf_counter() - start):
+        log.info("startup time", msg=line)
     return stampy_modules
 
 
+def startup_report(timings: dict[str, float], total: float) -> list[str]:
+    """The lines of a table of how long each import and constructor took, slowest first"""
+    width = max(len(name) for name in timings)
+    lines = [f"{name:<{width}} {seconds:8.3f}s" for name, seconds in sorted(timings.items(), key=lambda t: -t[1])]
+    lines.append(f"{'total (wall clock)':<{width}} {total:8.3f}s")
+    return lines
+
+
 if __name__ == "__main__":
     utils = Utilities.get_instance()
 
@@ -62,7 +94,7 @@ if __name__ == "__main__":
         Services.FLASK: FlaskHandler(),
     }
 
-    service_threads = []
+    service_threads = [Dispatcher.get_instance().start()]
     e = threading.Event()
     utils.stop = e
     for service in utils.service_modules_dict:
@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from api.utilities.gooseutils import GooseAIEngines
+
+fake_wiki_response = {"query": {"tokens": {"logintoken": "fake", "csrftoken": "fake"}, "results": {}}}
+
+
+class TestGooseAI(TestCase):
+    def test_reports_errors_from_a_worker_thread(self):
+        # importing it sets up Utilities, which logs in to the wiki
+        with patch("api.semanticwiki.SemanticWiki.post", return_value=fake_wiki_response):
+            from api.gooseai import GooseAI
+            from utilities import Utilities
+
+        with patch("api.gooseai.goose_api_key", "fake"):
+            goose = GooseAI()
+        utils = Utilities.get_instance()
+        error = {"error": {"code": 503, "type": "unavailable", "message": "engine is asleep"}}
+        sent = []
+
+        async def log_error(error_message: str) -> None:
+            sent.append(error_message)
+
+        async def ask() -> str:
+            loop = asyncio.get_running_loop()
+            with patch.object(goose, "post", return_value=error), patch.object(
+                utils, "client", SimpleNamespace(loop=loop)
+            ), patch.object(utils, "log_error", log_error):
+                response = await loop.run_in_executor(None, goose.get_response, list(GooseAIEngines)[0], "Hi", {})
+                await asyncio.sleep(0.01)  # for the error to be sent
+            return response
+
+        self.assertEqual(asyncio.run(ask()), "")
+        self.assertEqual(sent, ["GooseAI Error 503 (unavailable): engine is asleep"])
@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 from unittest import TestCase
 from unittest.mock import MagicMock
 from api.semanticwiki import SemanticWiki
@@ -38,3 +41,11 @@ class TestSemanticWiki(TestCase):
             + "|replycount=0"
             + "|titleoverride=TestQuestion}}",
         )
+
+    def test_imports_on_its_own(self):
+        # in a fresh interpreter, since the test run has imported utilities already
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        result = subprocess.run(
+            [sys.executable, "-c", "import api.semanticwiki"], cwd=root, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
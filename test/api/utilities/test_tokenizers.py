@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+from api.utilities import tokenizers
+from api.utilities.gooseutils import GooseAIEngines
+
+
+class TestTokenizers(TestCase):
+    def test_config_import_is_cheap(self):
+        check = "import config, sys; print('transformers' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_loaded_once(self):
+        with patch.dict(tokenizers._loaded, clear=True), patch(
+            "transformers.GPTNeoXTokenizerFast.from_pretrained"
+        ) as from_pretrained:
+            self.assertIs(GooseAIEngines.GPT_20B.tokenizer, GooseAIEngines.GPT_20B.tokenizer)
+            self.assertIs(tokenizers.gpt_neo_x, GooseAIEngines.GPT_20B.tokenizer)
+        from_pretrained.assert_called_once_with("EleutherAI/gpt-neox-20b")
@@ -0,0 +1,299 @@
+"""Replays a corpus of chat messages through the real module pipeline, with every external service faked,
+and reports throughput, per-message latency, and the CPU time and memory each module's process_message uses.
+
+    python -m test.benchmark_replay --messages 5000 --save baseline.json
+    python -m test.benchmark_replay --messages 5000 --compare baseline.json
+
+The corpus is synthetic unless --corpus is given a JSON lines file of {"author", "channel", "content"} records.
+It works on a copy of the database, so nothing it does is kept. It isn't called test_* so that unittest
+doesn't pick it up, since it takes a while.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from collections import defaultdict
+from contextlib import ExitStack
+from unittest.mock import patch
+from test.discord_mocks import MockMessage
+
+channels = ["general", "stampy-dev", "talk-to-stampy", "off-topic", "ai-safety"]
+authors = [f"user{i}" for i in range(40)]
+topics = ["mesa optimisers", "corrigibility", "the stop button problem", "instrumental convergence", "GPT-3"]
+templates = [
+    "hello everyone",
+    "has anyone read the new paper on {topic}?",
+    "I think {topic} is overrated tbh",
+    "lol",
+    "stampy, what is {topic}?",
+    "stampy what's the latest question",
+    "stampy how many stamps am I worth?",
+    "what's {topic}, stampy?",
+    "Which video was it where Rob talks about {topic}?",
+    "which paper was it that covered {topic}?",
+    "s, tell me about {topic}",
+    "stampy, what is 2+2?",
+    "why do people keep bringing up {topic}",
+    "stampy is {topic} a real problem?",
+    "good morning",
+]
+
+
+def synthetic_corpus(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "author": rng.choice(authors),
+            "channel": rng.choice(channels),
+            "content": rng.choice(templates).format(topic=rng.choice(topics)),
+        }
+        for _ in range(count)
+    ]
+
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path) as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+class FakeHTTPResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.text = content.decode("utf-8", errors="replace")
+        self.status_code = 200
+
+    def read(self) -> bytes:
+        return self.content
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+def fake_newsletter() -> bytes:
+    """A zipped sheet in the shape AlignmentNewsletterSearch downloads, with one item per topic"""
+    rows = ["<tr>" + "<td></td>" * 11 + "</tr>"] * 2  # the headers and freeze bar it skips
+    for topic in topics:
+        cells = ["", "Agent foundations", "", f'<a href="https://example.com/{len(rows)}">On {topic}</a>', "A. Author"]
+        cells += [""] * 4 + [f"A summary about {topic}.", "An opinion."]
+        rows.append("<tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>")
+    html = "<html><body><div><table><tbody>" + "".join(rows) + "</tbody></table></div></body></html>"
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        zip_file.writestr("Database.html", html)
+    return buffer.getvalue()
+
+
+def fake_urlopen(url, *args, **kwargs) -> FakeHTTPResponse:
+    url = getattr(url, "full_url", url)
+    if "duckduckgo" in url:
+        body = {"Abstract": "A fake abstract.", "Type": "A", "RelatedTopics": []}
+        return FakeHTTPResponse(json.dumps(body).encode())
+    return FakeHTTPResponse(b"42")  # Wolfram Alpha's short answers API
+
+
+fake_wiki_response = {"query": {"tokens": {"logintoken": "fake", "csrftoken": "fake"}, "results": {}}}
+fake_completion = {"ready": True, "choices": [{"text": " I'm a fake language model.", "logprobs": None}]}
+
+
+class BenchmarkHandler:
+    """Stands in for the Discord handler, recognising Stampy by name and counting responses"""
+
+    def __init__(self):
+        self.service_utils = self
+        self.responses = 0
+
+    @staticmethod
+    def is_stampy_mentioned(message) -> bool:
+        return any(user.name == "stampy" for user in message.mentions)
+
+    @staticmethod
+    def stampy_is_author(message) -> bool:
+        return message.author.name == "stampy"
+
+    async def send_response(self, message, response) -> None:
+        self.responses += 1
+
+
+def fake_services(stack: ExitStack, database_copy: str, errors: list) -> None:
+    """Swap every external service for a local fake, for as long as the stack is open"""
+
+    async def log_exception(self, e: Exception) -> None:
+        errors.append(repr(e))
+
+    async def log_error(self, error_message: str) -> None:
+        errors.append(error_message)
+
+    stack.enter_context(patch("utilities.utilities.database_path", database_copy))
+    stack.enter_context(patch("api.semanticwiki.SemanticWiki.post", return_value=fake_wiki_response))
+    stack.enter_context(patch("requests.get", return_value=FakeHTTPResponse(fake_newsletter())))
+    stack.enter_context(patch("urllib.request.urlopen", fake_urlopen))
+    stack.enter_context(patch("openai.Completion.create", return_value=fake_completion))
+    stack.enter_context(patch("api.gooseai.GooseAI.get", return_value=fake_completion))
+    stack.enter_context(patch("api.gooseai.GooseAI.post", return_value=fake_completion))
+    stack.enter_context(patch("utilities.utilities.Utilities.log_exception", log_exception))
+    stack.enter_context(patch("utilities.utilities.Utilities.log_error", log_error))
+
+
+def to_message(record: dict):
+    from utilities.discordutils import DiscordMessage
+
+    return DiscordMessage(MockMessage(record["content"], record["author"], record["channel"]))
+
+
+async def replay(dispatcher, messages: list) -> list[float]:
+    """Send each channel's messages through the dispatcher one after another, with the channels all
+    going at once, like a busy server. Returns how long each message took to get its response"""
+    by_channel = defaultdict(list)
+    for message in messages:
+        by_channel[message.channel.id].append(message)
+
+    latencies = []
+
+    async def replay_channel(channel_messages: list) -> None:
+        for message in channel_messages:
+            start = time.perf_counter()
+            await dispatcher.dispatch(message)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[replay_channel(channel_messages) for channel_messages in by_channel.values()])
+    return latencies
+
+
+def profile_modules(modules: dict, messages: list) -> dict[str, dict]:
+    """Run every module's process_message over the messages on this thread, one at a time,
+    measuring the CPU time and memory each call uses. This is a separate pass from the replay,
+    since tracing allocations slows everything down"""
+    results = {}
+    tracemalloc.start()
+    try:
+        for name, module in sorted(modules.items()):
+            cpu_seconds, allocated, failures = 0.0, 0, 0
+            for message in messages:
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                start = time.thread_time()
+                try:
+                    module.process_message(message)
+                except Exception:
+                    failures += 1
+                cpu_seconds += time.thread_time() - start
+                allocated += tracemalloc.get_traced_memory()[1] - before
+            results[name] = {
+                "cpu_us_per_message": round(cpu_seconds / len(messages) * 1e6, 1),
+                "peak_kib_per_message": round(allocated / len(messages) / 1024, 2),
+                "failures": failures,
+            }
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def run(records: list[dict], profile_count: int) -> dict:
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        database_copy = os.path.join(tmp, "stampy.db")
+        shutil.copy(os.environ.get("DATABASE_PATH", "./database/stampy.db"), database_copy)
+        fake_services(stack, database_copy, errors)
+
+        from servicemodules.dispatcher import Dispatcher
+        from servicemodules.serviceConstants import Services
+        from stam import get_stampy_modules
+        from utilities import Utilities
+
+        utils = Utilities.get_instance()
+        start = time.perf_counter()
+        utils.modules_dict = get_stampy_modules()
+        load_seconds = time.perf_counter() - start
+        handler = BenchmarkHandler()
+        utils.service_modules_dict = {Services.DISCORD: handler}
+
+        messages = [to_message(record) for record in records]
+        dispatcher = Dispatcher.get_instance()
+        dispatcher.start()
+        try:
+            start = time.perf_counter()
+            latencies = asyncio.run_coroutine_threadsafe(replay(dispatcher, messages), dispatcher.loop).result()
+            replay_seconds = time.perf_counter() - start
+        finally:
+            dispatcher.stop()
+
+        module_profiles = profile_modules(utils.modules_dict, [to_message(r) for r in records[:profile_count]])
+
+    return {
+        "python": platform.python_version(),
+        "messages": len(records),
+        "module_load_seconds": round(load_seconds, 3),
+        "replay_seconds": round(replay_seconds, 3),
+        "messages_per_second": round(len(records) / replay_seconds, 1),
+        "latency": percentiles(latencies),
+        "responses": handler.responses,
+        "errors": len(errors),
+        "modules": module_profiles,
+    }
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """How the results differ from the baseline, one line per number"""
+
+    def change(name: str, new: float, old: float) -> str:
+        if not old:
+            return f"{name}: {old} -> {new}"
+        return f"{name}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)"
+
+    lines = [change("messages_per_second", results["messages_per_second"], baseline["messages_per_second"])]
+    lines += [change(k, v, baseline["latency"].get(k, 0)) for k, v in results["latency"].items()]
+    for module, profile in results["modules"].items():
+        old_profile = baseline["modules"].get(module)
+        if old_profile is None:
+            lines.append(f"{module}: not in the baseline")
+            continue
+        for key in ("cpu_us_per_message", "peak_kib_per_message"):
+            lines.append(change(f"{module} {key}", profile[key], old_profile[key]))
+    return lines
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="how many synthetic messages to replay")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic corpus")
+    parser.add_argument("--corpus", help="replay this JSON lines file instead of a synthetic corpus")
+    parser.add_argument("--profile", type=int, default=200, help="how many messages to profile each module with")
+    parser.add_argument("--save", help="write the results to this file, to compare later runs against")
+    parser.add_argument("--compare", help="compare the results with a file saved by --save")
+    args = parser.parse_args(argv)
+
+    records = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.messages, args.seed)
+    results = run(records, min(args.profile, len(records)))
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print("\n".join(compare(results, json.load(baseline_file))))
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+    os._exit(0)  # the discord client and module threads would otherwise keep the process alive
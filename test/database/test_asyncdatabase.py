@@ -0,0 +1,38 @@
+import asyncio
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from database.asyncdatabase import AsyncDatabase
+from database.database import Database
+from utilities.metrics import Metrics
+
+
+class TestAsyncDatabase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "test.db"))
+        self.async_db = AsyncDatabase(self.db)
+
+    def tearDown(self):
+        self.async_db.executor.shutdown()
+        self.db.close()
+        self.dir.cleanup()
+
+    def test_requests_run_on_the_database_thread(self):
+        async def use_database():
+            await self.async_db.query("CREATE TABLE votes (user INT, count INT)")
+            await self.async_db.execute_many("INSERT INTO votes VALUES (?, ?)", [(1, 2), (2, 3)])
+
+            def add_up():
+                return threading.current_thread().name, self.db.query("SELECT sum(count) FROM votes")[0][0]
+
+            return await asyncio.gather(*[self.async_db.transaction(add_up) for _ in range(5)])
+
+        results = asyncio.run(use_database())
+        self.assertEqual(len(results), 5)
+        for thread_name, total in results:
+            self.assertTrue(thread_name.startswith("Database"))
+            self.assertEqual(total, 5)
+        self.assertEqual(self.async_db.depth, 0)
+        self.assertIn("stampy_database_queue_depth 0", Metrics.get_instance().prometheus())
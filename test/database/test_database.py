@@ -0,0 +1,42 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from database.database import Database
+
+
+class TestDatabase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "test.db"))
+        self.db.query("CREATE TABLE uservotes (user INT, votedFor INT, votecount INT, PRIMARY KEY(user, votedFor))")
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def test_wal_and_connection_per_thread(self):
+        self.assertEqual(self.db.query("PRAGMA journal_mode")[0][0], "wal")
+        self.assertIs(self.db.conn, self.db.conn)
+        other_thread_conn = []
+        thread = threading.Thread(target=lambda: other_thread_conn.append(self.db.conn))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_thread_conn[0], self.db.conn)
+        self.assertEqual(len(self.db.connections), 2)
+
+    def test_transaction(self):
+        self.db.execute_many("INSERT INTO uservotes VALUES (?,?,?)", [(1, 2, 1), (2, 3, 1)])
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.query("DELETE FROM uservotes")
+                with self.db.transaction():
+                    self.db.query("INSERT INTO uservotes VALUES (3, 1, 1)")
+                raise ValueError
+        self.assertEqual(self.db.query("SELECT count(*) FROM uservotes")[0][0], 2)
+
+    def test_iterate(self):
+        self.db.execute_many("INSERT INTO uservotes VALUES (?,?,?)", [(i, i + 1, i) for i in range(100)])
+        rows = self.db.iterate("SELECT votecount FROM uservotes WHERE votecount >= ? ORDER BY votecount", (90,))
+        self.assertEqual(next(rows), (90,))
+        self.assertEqual([count for (count,) in rows], list(range(91, 100)))
@@ -6,6 +6,7 @@ class MockAuthor:
         self.name = name
         self.id = name
         self.display_name = name
+        self.discriminator = "0000"
         self.roles = []
 
 
@@ -14,10 +15,13 @@ class MockMessage:
         self.content = content
         self.author = MockAuthor(author)
         self.channel = MockChannel(author, channel)
+        self.guild = self.channel.guild
         self.clean_content = content.lower()
         self.created_at = datetime.now(timezone.utc)
         self.id = author
         self.mentions = []
+        self.reference = None
+        self.reactions = []
 
     def __repr__(self):
         return f"MockMessage({self.content})"
@@ -26,6 +30,7 @@ class MockMessage:
 class MockGuild:
     def __init__(self, name):
         self.id = name
+        self.name = name
 
 
 class MockChannel:
@@ -34,6 +39,10 @@ class MockChannel:
         self.name = name
         self.guild = MockGuild(name)
         self.recipient = MockAuthor(author_name)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
 
     def __repr__(self):
         return f"MockChannel({self.id})"
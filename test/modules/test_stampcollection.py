@@ -0,0 +1,353 @@
+import asyncio
+import discord
+import gzip
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from contextlib import ExitStack
+from unittest import TestCase
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from database.asyncdatabase import AsyncDatabase
+from database.database import Database
+from test.discord_mocks import MockMessage
+from utilities import Utilities
+from utilities.scheduler import Scheduler
+from modules.stampcollection import ChannelScan, StampRanking, StampsModule, fingerprint, rank_question, vote_array
+
+
+class FakeReaction:
+    def __init__(self, emoji: str, user_ids: list[int]):
+        self.emoji = SimpleNamespace(name=emoji)
+        self.user_ids = user_ids
+
+    async def users(self):
+        for user_id in self.user_ids:
+            yield SimpleNamespace(id=user_id)
+
+
+class FakeHistoryChannel:
+    type = discord.ChannelType.text
+
+    def __init__(self, channel_id: int, messages: list, fail_after=None):
+        self.id = channel_id
+        self.name = str(channel_id)
+        self.messages = messages
+        self.fail_after = fail_after
+
+    def history(self, limit=None, oldest_first=False, after=None):
+        async def messages():
+            for i, message in enumerate(m for m in self.messages if after is None or m.id > after.id):
+                if self.fail_after is not None and i >= self.fail_after:
+                    raise ConnectionError("lost connection to Discord")
+                yield message
+
+        return messages()
+
+
+def stamped_message(message_id: int, author_id: int, reactions: list):
+    message = MockMessage("a good point", str(author_id), "general")
+    message.id, message.author.id, message.reactions = message_id, author_id, reactions
+    return message
+
+
+class TestStampsModule(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.dir.name, "stampy.db"))
+        self.db.query(
+            "CREATE TABLE uservotes (user INT NOT NULL, votedFor INT NOT NULL, votecount INT DEFAULT 1, "
+            "PRIMARY KEY(user,votedFor))"
+        )
+        # God votes for 1, who votes for 2 and 3
+        self.db.execute_many("INSERT INTO uservotes VALUES (?, ?, ?)", [(0, 1, 1), (1, 2, 3), (1, 3, 1), (2, 1, 1)])
+
+        # work on a scratch database, and put back whatever the real stamps module set up
+        utils = Utilities.get_instance()
+        self.stack = ExitStack()
+        self.stack.enter_context(patch.object(utils, "db", self.db))
+        for name in ("users", "ids", "index", "scores"):
+            self.stack.enter_context(patch.object(utils, name, getattr(utils, name, None)))
+        self.stamps = StampsModule()
+        self.stamps.set_up_database()
+
+    def tearDown(self):
+        Scheduler.get_instance().unregister("recalculate stamps")
+        Scheduler.get_instance().unregister("export stamps")
+        self.stack.close()
+        self.db.close()
+        self.dir.cleanup()
+
+    def votes_for(self, user: int) -> int:
+        return self.db.query("SELECT IFNULL(sum(votecount),0) FROM uservotes WHERE votedFor = ?", (user,))[0][0]
+
+    def test_votes_are_buffered_until_recalculation(self):
+        before = self.stamps.get_user_stamps(3)
+        for _ in range(4):
+            self.stamps.update_vote("stamp", 2, 3)
+        self.stamps.update_vote("stamp", 1, 3)
+        self.stamps.update_vote("stamp", 1, 3, negative=True)
+        self.stamps.update_vote("stamp", 3, 3)  # votes for yourself don't count
+
+        self.assertEqual(self.votes_for(3), 1)
+        self.assertEqual(self.stamps.pending_votes[(2, 3)], 4)
+        provisional = self.stamps.get_user_stamps(3)
+        self.assertGreater(provisional, before)
+
+        with patch.object(self.stamps.utils, "add_vote_events", wraps=self.stamps.utils.add_vote_events) as add_events:
+            self.stamps.calculate_stamps()
+        add_events.assert_called_once()  # all in one go, with every vote logged
+        logged = [event[3:] for event in add_events.call_args.args[0]]
+        self.assertEqual(logged, [(2, 3, 1)] * 4 + [(1, 3, 1), (1, 3, -1)])
+        self.assertEqual(self.votes_for(3), 5)  # and the vote and the unvote cancelled out
+        self.assertFalse(self.stamps.pending_votes or self.stamps.counting_votes)
+
+        self.assertAlmostEqual(self.stamps.get_user_stamps(3), provisional)
+
+    def test_starts_from_snapshot(self):
+        scores = list(self.stamps.utils.scores)
+        utils = self.stamps.utils
+        # the snapshot's stamps come from the total votes it was taken with, not whatever the total is now
+        with patch.object(StampsModule, "calculate_stamps") as calculate_stamps:
+            with patch.object(utils, "get_total_votes", return_value=1000):
+                stamps = StampsModule()
+            self.assertEqual(self.stamps.utils.scores, scores)
+            self.assertAlmostEqual(stamps.get_user_stamps(3), self.stamps.get_user_stamps(3))
+            stamps.check_snapshot()
+        calculate_stamps.assert_not_called()
+        self.assertIsNotNone(stamps.counted_votes)
+
+        history = stamps.get_user_stamps_history(3, 0)
+        self.assertAlmostEqual(history[-1][1], self.stamps.get_user_stamps(3))
+
+        # votes logged since the snapshot are applied to its votes, without reading the whole vote table
+        utils.add_vote_events([(time.time(), None, "stamp", 2, 3, 1)])
+        stamps = StampsModule()
+        with patch.object(utils, "get_all_user_votes", wraps=utils.get_all_user_votes) as get_all_user_votes:
+            stamps.check_snapshot()
+        get_all_user_votes.assert_not_called()
+        self.assertEqual(fingerprint(stamps.counted_votes), fingerprint(vote_array(utils.get_all_user_votes())))
+        self.assertEqual(stamps.last_event_id, utils.get_last_vote_event_id())
+
+        # unless the log has been cleared since
+        utils.clear_votes()
+        self.db.execute_many("INSERT INTO uservotes VALUES (?, ?, ?)", [(0, 1, 1), (1, 2, 2)])
+        stamps = StampsModule()
+        with patch.object(utils, "get_all_user_votes", wraps=utils.get_all_user_votes) as get_all_user_votes:
+            stamps.check_snapshot()
+        get_all_user_votes.assert_called()
+        self.assertEqual(stamps.counted_votes.tolist(), [[0, 1, 1], [1, 2, 2]])
+
+    def test_solves_once_at_startup(self):
+        self.db.query("DROP TABLE stamp_snapshots")
+        with patch.object(StampsModule, "solve_scores", wraps=self.stamps.solve_scores) as solve_scores:
+            stamps = StampsModule()
+            solve_scores.assert_not_called()
+            stamps.set_up_database()
+        solve_scores.assert_called_once()
+        self.assertAlmostEqual(stamps.get_user_stamps(3), self.stamps.get_user_stamps(3))
+
+    def test_export_only_when_scores_change(self):
+        csv_path = os.path.join(self.dir.name, "stamps-export.csv")
+        client = MagicMock()
+        client.get_user.side_effect = lambda user_id: SimpleNamespace(name=f"user{user_id}", discriminator="0001")
+        with patch("modules.stampcollection.stamp_scores_csv_file_path", csv_path), patch.object(
+            self.stamps.utils, "client", client
+        ):
+            self.assertTrue(self.stamps.export_scores_if_changed())
+            self.assertFalse(self.stamps.export_scores_if_changed())
+            self.stamps.update_vote("stamp", 2, 3)
+            self.stamps.calculate_stamps()
+            self.assertTrue(self.stamps.export_scores_if_changed())
+
+        with open(csv_path) as csv_file:
+            lines = csv_file.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('1,"user1",0001,'))
+        with gzip.open(csv_path + ".gz", "rt") as gzipped_csv_file:
+            self.assertEqual(gzipped_csv_file.read().splitlines(), lines)
+        with open(os.path.join(self.dir.name, "stamps-export.json")) as json_file:
+            self.assertEqual([row["id"] for row in json.load(json_file)], ["1", "2", "3"])
+        with open(os.path.join(self.dir.name, "stamps-export.meta.json")) as metadata_file:
+            metadata = json.load(metadata_file)
+        self.assertEqual(metadata["users"], 3)
+        self.assertEqual(
+            set(metadata["files"]),
+            {"stamps-export.csv", "stamps-export.csv.gz", "stamps-export.json", "stamps-export.json.gz"},
+        )
+        self.assertFalse([name for name in os.listdir(self.dir.name) if name.startswith(".")])  # no temporary files
+
+    def test_vote_log(self):
+        utils = self.stamps.utils
+        self.assertEqual(len(utils.get_vote_events_since(0)), 4)  # one for each row the vote table started with
+        before, stamps_before = time.time(), self.stamps.get_user_stamps(3)
+
+        time.sleep(0.01)
+        self.stamps.update_vote("goldstamp", 2, 3, message_id=1234)
+        self.stamps.update_vote("stamp", 1, 2, message_id=1235)
+        self.stamps.update_vote("stamp", 1, 2, negative=True, message_id=1235)
+        with patch.object(utils, "get_all_user_votes", wraps=utils.get_all_user_votes) as get_all_user_votes:
+            self.stamps.calculate_stamps()
+        get_all_user_votes.assert_not_called()  # only the new events were read
+        self.assertEqual(fingerprint(self.stamps.counted_votes), fingerprint(vote_array(utils.get_all_user_votes())))
+        self.assertEqual(
+            [event[1:] for event in utils.get_vote_events_for_user(3, since=before)], [(1234, "goldstamp", 2, 5)]
+        )
+
+        # replaying the log gives the stamps as they were, or are
+        self.assertAlmostEqual(self.stamps.get_user_stamps_at(3, before), stamps_before)
+        self.assertAlmostEqual(self.stamps.get_user_stamps_at(3, time.time()), self.stamps.get_user_stamps(3))
+
+        # the vote table can be put right from the log
+        stamps = self.stamps.get_user_stamps(3)
+        self.db.query("DELETE FROM uservotes WHERE votedFor = 3")
+        self.stamps.recount_stamps()
+        self.assertEqual(self.votes_for(3), 6)
+        self.assertAlmostEqual(self.stamps.get_user_stamps(3), stamps)
+
+    def test_ranking(self):
+        ranking = StampRanking(np.array([0, 4, 7, 9, 12]), np.array([1.0, 2.0, 5.0, 2.0, 0.5]))
+        self.assertEqual(len(ranking), 4)  # not God
+        self.assertEqual(ranking.top(2), [(7, 5.0), (4, 2.0)])
+        self.assertEqual([ranking.rank(user) for user in (7, 4, 9, 12)], [1, 2, 2, 4])
+        self.assertEqual([ranking.percentile(user) for user in (7, 4, 12)], [75.0, 25.0, 0.0])
+        self.assertIsNone(ranking.rank(0))
+
+        # the module's ranking agrees with what it says people are worth
+        stamps = self.stamps
+        self.assertEqual([user for user, _ in stamps.ranking.top(3)], [1, 2, 3])
+        self.assertEqual(stamps.get_user_ranking("3")["stamps"], stamps.get_user_stamps(3))
+        self.assertEqual(stamps.get_user_ranking(SimpleNamespace(id=2))["rank"], 2)
+        self.assertIsNone(stamps.get_user_ranking(42))
+
+        for question in ("what rank am I?", "whats my rank", "what's my stamp rank?", "what is my rank"):
+            self.assertTrue(re.match(rank_question, question.lower()), question)
+        for question in ("what ranking method does LessWrong use?", "what is rank collapse in transformers?"):
+            self.assertFalse(re.match(rank_question, question.lower()), question)
+
+    def test_history_rebuild_resumes(self):
+        general = FakeHistoryChannel(
+            100,
+            [
+                stamped_message(1, 2, [FakeReaction("stamp", [1, 3]), FakeReaction("thumbsup", [1])]),
+                stamped_message(2, 3, [FakeReaction("goldstamp", [1, 3])]),  # 3 stamping themselves doesn't count
+            ],
+        )
+        random_channel = FakeHistoryChannel(
+            200, [stamped_message(3, 2, [FakeReaction("stamp", [3])]), stamped_message(4, 1, [])], fail_after=1
+        )
+        utils = self.stamps.utils
+        guild = SimpleNamespace(name=utils.GUILD, channels=[general, random_channel])
+        async_db = AsyncDatabase(self.db)
+        self.stack.enter_context(patch.object(utils, "client", MagicMock(guilds=[guild])))
+        self.stack.enter_context(patch.object(utils, "guilds_by_name", {}))
+        self.stack.enter_context(patch.object(utils, "async_db", async_db))
+        self.stack.enter_context(patch("modules.stampcollection.utilities.stampy_is_author", return_value=False))
+        self.stack.enter_context(patch("modules.stampcollection.stamp_rebuild_batch_size", 1))
+
+        with self.assertRaises(ConnectionError):
+            asyncio.run(self.stamps.load_votes_from_history())
+        self.assertEqual(utils.get_history_checkpoints(), {100: (2, True), 200: (3, False)})
+
+        random_channel.fail_after = None
+        with patch.object(self.stamps, "scan_channel_history", wraps=self.stamps.scan_channel_history) as scan:
+            asyncio.run(self.stamps.load_votes_from_history())
+        scan.assert_called_once()  # only the unfinished channel
+        self.assertEqual(scan.call_args.args[1], 3)
+        async_db.executor.shutdown()
+
+        self.assertEqual(utils.get_history_checkpoints(), {})
+        self.assertEqual(sorted(utils.get_all_user_votes()), [(1, 2, 1), (1, 3, 5), (3, 2, 2)])
+        self.assertEqual(self.stamps.total_votes, 8)
+
+    def react(self, channel_id: int, message_id: int, event_type: str = "REACTION_ADD") -> None:
+        """User 1 stamps message_id, by user 2, in the channel"""
+        utils = self.stamps.utils
+
+        async def fetch_message(channel_id, message_id, refresh=False):
+            return stamped_message(message_id, 2, [])
+
+        event = SimpleNamespace(
+            event_type=event_type,
+            guild_id=1,
+            channel_id=channel_id,
+            message_id=message_id,
+            user_id=1,
+            emoji=SimpleNamespace(name="stamp"),
+        )
+        async_db = AsyncDatabase(self.db)
+        with patch.object(utils, "get_guild", return_value=SimpleNamespace(id=1)), patch.object(
+            utils, "fetch_message", fetch_message
+        ), patch.object(utils, "async_db", async_db), patch(
+            "modules.stampcollection.utilities.stampy_is_author", return_value=False
+        ):
+            asyncio.run(self.stamps.process_raw_reaction_event(event))
+        async_db.executor.shutdown()
+
+    def test_live_votes_during_history_rebuild(self):
+        # an interrupted rebuild has got to message 50 in channel 100, and finished channel 200
+        self.stamps.history_checkpoints = {100: (50, False), 200: (80, True)}
+
+        self.react(100, 60)  # the rebuild will find it when it carries on
+        self.react(100, 60, "REACTION_REMOVE")
+        self.assertFalse(self.stamps.pending_votes)
+
+        self.react(100, 40)  # behind the checkpoint, or in a finished channel, it's ours
+        self.react(200, 90)
+        self.assertEqual(self.stamps.pending_votes, {(1, 2): 2})
+
+        # scanned but not saved yet, so it goes in with the scan's next batch
+        self.stamps.channel_scans[100] = scan = ChannelScan(position=70)
+        self.react(100, 65)
+        self.assertEqual([vote[1:] for vote in scan.events], [(65, "stamp", 1, 2, 1)])
+        self.assertEqual(self.stamps.pending_votes, {(1, 2): 2})
+
+        self.stamps.history_checkpoints = {}  # and once it's finished, everything's ours
+        self.react(100, 60)
+        self.assertEqual(self.stamps.pending_votes, {(1, 2): 3})
+
+    def dense_scores(self, votes, index: dict) -> list:
+        """The scores the way they used to be solved, as one dense linear system"""
+        votes_by_user = {}
+        for from_id, _, count in votes:
+            votes_by_user[from_id] = votes_by_user.get(from_id, 0) + count
+        matrix = np.zeros((len(index), len(index)))
+        for from_id, to_id, count in votes:
+            matrix[index[to_id], index[from_id]] = self.stamps.gamma * count / votes_by_user[from_id]
+        for i in range(1, len(index)):
+            matrix[i, i] = -1.0
+        matrix[0, 0] = 1.0
+        constants = np.zeros(len(index))
+        constants[0] = 1.0
+        return list(np.linalg.solve(matrix, constants))
+
+    def assert_solvers_agree(self, votes) -> None:
+        users = sorted({0} | {user for from_id, to_id, _ in votes for user in (from_id, to_id)})
+        index = {user: i for i, user in enumerate(users)}
+        dense = self.dense_scores(votes, index)
+        ids, votes = np.array(users), vote_array(votes)
+        np.testing.assert_allclose(self.stamps.solve_scores(ids, votes), dense, rtol=1e-8, atol=1e-10)
+        # starting from nearly the right answer should get there too
+        np.testing.assert_allclose(
+            self.stamps.solve_scores(ids, votes, (users, [score * 1.01 for score in dense])),
+            dense,
+            rtol=1e-8,
+            atol=1e-10,
+        )
+
+    def test_iterative_solver_matches_dense_solver(self):
+        database_path = os.environ.get("DATABASE_PATH", "./database/stampy.db")
+        with sqlite3.connect(f"file:{database_path}?mode=ro", uri=True) as connection:
+            self.assert_solvers_agree(connection.execute("SELECT user,votedFor,votecount from uservotes").fetchall())
+
+        rng = random.Random(0)
+        votes = {(0, user): 1 for user in range(1, 6)}
+        for _ in range(2000):
+            from_id, to_id = rng.sample(range(1, 300), 2)
+            votes[(from_id, to_id)] = votes.get((from_id, to_id), 0) + rng.choice([1, 1, 1, 5])
+        self.assert_solvers_agree([(from_id, to_id, count) for (from_id, to_id), count in votes.items()])
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from modules.module import Module, Response, Triggers
+from servicemodules.dispatcher import Dispatcher
+from servicemodules.serviceConstants import Services
+from utilities import Utilities
+from utilities.serviceutils import ServiceChannel, ServiceMessage, ServiceUser
+
+
+class EchoModule(Module):
+    def process_message(self, message):
+        return Response(confidence=5, text=f"echo {message.content}")
+
+
+class LookupModule(Module):
+    def process_message(self, message):
+        if message.content.endswith("?"):
+            return Response(confidence=8, callback=self.look_up, args=[message.content])
+        return Response()
+
+    async def look_up(self, query):
+        return Response(confidence=9, text=f"looked up {query}")
+
+
+class SlowModule(Module):
+    process_message_deadline = 0.1
+
+    def process_message(self, message):
+        time.sleep(0.5)
+        return Response(confidence=10, text="too late")
+
+
+class SpeculativeModule(Module):
+    def process_message(self, message):
+        if not message.content.startswith("search"):
+            return Response()
+        return Response(confidence=7, callback=self.search, args=[message.content], speculative=True)
+
+    async def search(self, query):
+        await asyncio.sleep(0.5)
+        return Response(confidence=6.5, text=f"found {query}")
+
+
+class NothingModule(Module):
+    def process_message(self, message):
+        if not message.content.startswith("search"):
+            return Response()
+        return Response(confidence=8, callback=self.search, speculative=True)
+
+    async def search(self):
+        await asyncio.sleep(0.5)
+        return Response()
+
+
+class TriggeredModule(Module):
+    triggers = Triggers(prefixes=[r"count\b"], keywords=["stamp collector"])
+
+    def process_message(self, message):
+        return Response(confidence=6, text="triggered")
+
+
+class BlockingModule(Module):
+    def process_message(self, message):
+        if message.content == "block":
+            return Response(confidence=8, callback=self.block)
+        return Response()
+
+    def block(self):
+        time.sleep(0.5)
+        return Response(confidence=8, text="unblocked")
+
+
+class MockHandler:
+    def __init__(self):
+        self.sent = []
+
+    async def send_response(self, message, response):
+        self.sent.append(response.text)
+
+
+class TestDispatcher(TestCase):
+    def setUp(self):
+        self.utils = Utilities.get_instance()
+        self.old_modules = self.utils.modules_dict
+        self.old_services = dict(self.utils.service_modules_dict)
+        self.utils.modules_dict = {"EchoModule": EchoModule(), "LookupModule": LookupModule()}
+        self.handler = MockHandler()
+        self.utils.service_modules_dict[Services.DISCORD] = self.handler
+        self.dispatcher = Dispatcher.get_instance()
+        self.dispatcher.start()
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        self.utils.modules_dict = self.old_modules
+        self.utils.service_modules_dict = self.old_services
+
+    def create_mock_message(self, text, channel="channel"):
+        author = ServiceUser("author", "author", "123")
+        message = ServiceMessage("1", text, author, ServiceChannel(channel, channel, None), Services.DISCORD)
+        message.clean_content = text
+        message.addressed_text = False
+        return message
+
+    def test_text_response(self):
+        response = self.dispatcher.submit(self.create_mock_message("hello")).result(timeout=5)
+        self.assertEqual(response.text, "echo hello")
+        self.assertEqual(self.handler.sent, ["echo hello"])
+
+    def test_callback_response(self):
+        response = self.dispatcher.submit(self.create_mock_message("what?")).result(timeout=5)
+        self.assertEqual(response.text, "looked up what?")
+        self.assertIsInstance(response.module, LookupModule)
+
+    def test_channel_order(self):
+        futures = [self.dispatcher.submit(self.create_mock_message(str(i))) for i in range(20)]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(self.handler.sent, [f"echo {i}" for i in range(20)])
+
+    def test_slow_module_dropped(self):
+        self.utils.modules_dict["SlowModule"] = SlowModule()
+        response = self.dispatcher.submit(self.create_mock_message("hello")).result(timeout=5)
+        self.assertEqual(response.text, "echo hello")
+
+    def test_speculative_callbacks(self):
+        self.utils.modules_dict = {"NothingModule": NothingModule(), "SpeculativeModule": SpeculativeModule()}
+        with patch("servicemodules.dispatcher.speculative_callback_limit", 2):
+            start = time.monotonic()
+            response = self.dispatcher.submit(self.create_mock_message("search stamps")).result(timeout=5)
+        self.assertEqual(response.text, "found search stamps")
+        self.assertLess(time.monotonic() - start, 0.9)  # both searches ran at the same time
+
+    def test_triggers(self):
+        self.utils.modules_dict["TriggeredModule"] = TriggeredModule()
+        for text, expected in [
+            ("hello", "echo hello"),
+            ("recount", "echo recount"),
+            ("count the stamps", "triggered"),
+            ("I'm a Stamp Collector!", "triggered"),
+        ]:
+            response = self.dispatcher.submit(self.create_mock_message(text)).result(timeout=5)
+            self.assertEqual(response.text, expected)
+
+    def test_blocking_callback(self):
+        self.utils.modules_dict["BlockingModule"] = BlockingModule()
+        blocked = self.dispatcher.submit(self.create_mock_message("block", channel="a"))
+        start = time.monotonic()
+        response = self.dispatcher.submit(self.create_mock_message("hello", channel="b")).result(timeout=5)
+        self.assertEqual(response.text, "echo hello")
+        self.assertLess(time.monotonic() - start, 0.4)  # the other channel didn't wait for the callback
+        self.assertEqual(blocked.result(timeout=5).text, "unblocked")
+
+    def test_load_shedding(self):
+        self.utils.modules_dict["BlockingModule"] = BlockingModule()
+        blocked = self.dispatcher.submit(self.create_mock_message("block"))
+        time.sleep(0.1)  # let it start, so the queue behind it fills up
+        chatter, question = self.create_mock_message("chatter"), self.create_mock_message("stampy, what?")
+        question.addressed_text = "what?"
+        with patch("servicemodules.dispatcher.inbound_channel_limit", 2):
+            futures = [
+                self.dispatcher.submit(chatter),
+                self.dispatcher.submit(question),
+                self.dispatcher.submit(question),  # collapsed into the first copy
+                self.dispatcher.submit(self.create_mock_message("more chatter")),  # dropped, it's not addressed
+                self.dispatcher.submit(question),  # collapsed again, even though the queue is full
+            ]
+            responses = [future.result(timeout=5) for future in futures]
+        self.assertEqual(blocked.result(timeout=5).text, "unblocked")
+        self.assertEqual(
+            [response.text for response in responses],
+            ["echo chatter", "looked up stampy, what?", "looked up stampy, what?", "", "looked up stampy, what?"],
+        )
+        self.assertEqual(self.handler.sent, ["unblocked", "echo chatter", "looked up stampy, what?"])
+
+    def test_test_mode_reads_clean_content(self):
+        message = self.create_mock_message("<#42> hello")
+        message.clean_content = "TEST_QUESTION 7 hello"
+        with patch.object(self.utils, "test_mode", True):
+            response = self.dispatcher.submit(message).result(timeout=5)
+        self.assertEqual(response.text, "TEST_RESPONSE 7: echo <#42> hello")
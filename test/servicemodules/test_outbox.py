@@ -0,0 +1,44 @@
+import asyncio
+import time
+from unittest import TestCase
+from modules.module import Response
+from servicemodules.outbox import Outbox, TokenBucket
+from servicemodules.serviceConstants import Services
+from utilities.serviceutils import ServiceChannel, ServiceMessage, ServiceUser
+
+
+class MockChannel(ServiceChannel):
+    def __init__(self, name):
+        super().__init__(name, name, None)
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append((time.monotonic(), content))
+
+
+class TestOutbox(TestCase):
+    def setUp(self):
+        self.outbox = Outbox.get_instance()
+
+    def send_all(self, channel, responses):
+        async def run():
+            message = ServiceMessage("1", "", ServiceUser("a", "a", "1"), channel, Services.DISCORD)
+            for response in responses:
+                self.outbox.send(message, response)
+            while self.outbox.workers:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        return [text for _, text in channel.sent]
+
+    def test_coalesces_chunks(self):
+        lines = [f"line {i}" for i in range(30)]
+        sent = self.send_all(MockChannel("coalesce"), [Response(text=lines), Response(text="x" * 2500)])
+        self.assertEqual(sent, ["\n".join(lines), "x" * 2000, "x" * 500])
+
+    def test_rate_limit(self):
+        channel = MockChannel("rate limit")
+        self.outbox.buckets[(str(Services.DISCORD), channel.id)] = TokenBucket(2, 0.2)
+        sent = self.send_all(channel, [Response(text=str(i)) for i in range(4)])
+        self.assertEqual(sent, ["0", "1", "2", "3"])
+        self.assertGreaterEqual(channel.sent[-1][0] - channel.sent[0][0], 0.15)
@@ -1,11 +1,29 @@
 import os
+import shutil
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
+from config import database_path
+from database.database import Database
 from stam import get_stampy_modules
+from utilities import Utilities
+from utilities.scheduler import Scheduler
 
 
 class TestStam(TestCase):
     def test_get_stampy_modules(self):
-        modules = get_stampy_modules()
+        # on a copy of the database, so the modules can't change the real one
+        with tempfile.TemporaryDirectory() as tmp:
+            database_copy = os.path.join(tmp, "stampy.db")
+            shutil.copy(database_path, database_copy)
+            db = Database(database_copy)
+            try:
+                with patch.object(Utilities.get_instance(), "db", db):
+                    modules = get_stampy_modules()
+            finally:
+                db.close()
+                Scheduler.get_instance().unregister("recalculate stamps")
+                Scheduler.get_instance().unregister("export stamps")
         path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "modules")
         module_file_count = len([file for file in os.listdir(path) if ".py" in file]) - 2
         self.assertEqual(len(modules), module_file_count)
@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import TestCase
+from utilities.messagecache import MessageCache
+
+
+class CountingChannel:
+    def __init__(self):
+        self.fetches = []
+
+    async def fetch_message(self, message_id: int):
+        self.fetches.append(message_id)
+        await asyncio.sleep(0)
+        return SimpleNamespace(id=message_id, fetch=len(self.fetches))
+
+
+class TestMessageCache(TestCase):
+    def test_fetches_each_message_once(self):
+        cache = MessageCache(size=2, ttl=60)
+        channel = CountingChannel()
+
+        async def lookups():
+            # two modules handling the same reaction at once only fetch it once
+            first, second = await asyncio.gather(cache.fetch(channel, 1), cache.fetch(channel, "1"))
+            self.assertIs(first, second)
+            self.assertIs(await cache.fetch(channel, 1), first)
+
+            self.assertIsNot(await cache.fetch(channel, 1, refresh=True), first)
+            await cache.fetch(channel, 2)
+            await cache.fetch(channel, 1)
+            await cache.fetch(channel, 3)  # 2 is the least recently used, so it goes
+            await cache.fetch(channel, 1)
+            await cache.fetch(channel, 2)
+            cache.forget(1)  # edited
+            await cache.fetch(channel, 1)
+
+        asyncio.run(lookups())
+        self.assertEqual(channel.fetches, [1, 1, 2, 3, 2, 1])
+        self.assertEqual((cache.hits, cache.misses), (4, 6))
+        self.assertLessEqual(len(cache.messages), 2)
+
+    def test_entries_expire(self):
+        cache = MessageCache(size=10, ttl=0)
+        channel = CountingChannel()
+
+        async def lookups():
+            await cache.fetch(channel, 1)
+            await cache.fetch(channel, 1)
+
+        asyncio.run(lookups())
+        self.assertEqual(channel.fetches, [1, 1])
+
+    def test_cancelled_and_refreshed_fetches(self):
+        cache = MessageCache(size=10, ttl=60)
+        channel = CountingChannel()
+
+        async def lookups():
+            waiter = asyncio.ensure_future(cache.fetch(channel, 1))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.sleep(0.01)  # the fetch finishes with nobody waiting for it
+            self.assertFalse(cache.fetching)
+            first = await cache.fetch(channel, 1)
+            self.assertEqual(first.fetch, 2)
+
+            # a refresh doesn't join a fetch that was already going
+            joined, refreshed = await asyncio.gather(cache.fetch(channel, 2), cache.fetch(channel, 2, refresh=True))
+            self.assertIsNot(joined, refreshed)
+
+        asyncio.run(lookups())
+        self.assertEqual(channel.fetches, [1, 1, 2, 2])
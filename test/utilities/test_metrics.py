@@ -0,0 +1,47 @@
+import asyncio
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import patch
+from utilities.metrics import Histogram, Metrics, timed
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.metrics = Metrics.get_instance()
+        self.patches = [patch.object(self.metrics, "histograms", {}), patch.object(self.metrics, "outcomes", Counter())]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 5.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative_counts(), [2, 3, 4])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.99), 5.0)
+
+    def test_outcomes(self):
+        with timed("process_message", module="Echo"):
+            pass
+        with self.assertRaises(ValueError):
+            with timed("process_message", module="Echo"):
+                raise ValueError
+
+        async def too_slow():
+            with timed("callback", module="Slow"):
+                await asyncio.sleep(1)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(too_slow(), timeout=0.01))
+
+        text = self.metrics.prometheus()
+        self.assertIn('stampy_process_message_seconds_count{module="Echo"} 2', text)
+        self.assertIn('stampy_process_message_seconds_bucket{module="Echo",le="+Inf"} 2', text)
+        self.assertIn('stampy_process_message_total{module="Echo",outcome="ok"} 1', text)
+        self.assertIn('stampy_process_message_total{module="Echo",outcome="error"} 1', text)
+        self.assertIn('stampy_callback_total{module="Slow",outcome="timeout"} 1', text)
+        self.assertIn("callback Slow: 1 calls (1 failed)", self.metrics.summary())
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from utilities.scheduler import Scheduler
+
+
+class TestScheduler(TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler.get_instance()
+        self.loop = asyncio.new_event_loop()
+        self.patches = [patch.object(self.scheduler, "jobs", {}), patch.object(self.scheduler, "loop", None)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        for p in self.patches:
+            p.stop()
+
+    def run_for(self, seconds):
+        self.scheduler.start(self.loop)
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_jobs(self):
+        calls = []
+
+        async def quick():
+            calls.append("quick")
+
+        async def slow():
+            await asyncio.sleep(0.25)
+
+        async def stuck():
+            await asyncio.sleep(10)
+
+        def blocking():
+            time.sleep(0.01)
+            calls.append("blocking")
+
+        self.scheduler.register("quick", quick, interval=0.05)
+        slow_job = self.scheduler.register("slow", slow, interval=0.05)
+        stuck_job = self.scheduler.register("stuck", stuck, interval=0.05, max_runtime=0.05, skip_if_running=False)
+        self.scheduler.register("blocking", blocking, interval=0.05)
+        self.run_for(0.4)
+
+        self.assertGreaterEqual(calls.count("quick"), 4)
+        self.assertGreaterEqual(calls.count("blocking"), 2)
+        self.assertGreater(slow_job.skipped, 0)
+        self.assertGreater(stuck_job.timeouts, 0)
+        self.assertIn("quick: every 0.05s", self.scheduler.summary())
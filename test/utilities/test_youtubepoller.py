@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+import httplib2
+from googleapiclient.errors import HttpError
+from utilities.youtubepoller import YouTubePoller
+
+
+def make_item(comment_id, published):
+    return {
+        "snippet": {
+            "topLevelComment": {
+                "id": comment_id,
+                "snippet": {
+                    "videoId": "video",
+                    "authorDisplayName": "someone",
+                    "textOriginal": f"question {comment_id}?",
+                    "publishedAt": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "likeCount": 0,
+                },
+            },
+            "totalReplyCount": 0,
+        }
+    }
+
+
+class TestYouTubePoller(TestCase):
+    def setUp(self):
+        self.poller = YouTubePoller.get_instance()
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.poller.latest_comment_timestamp = self.now - timedelta(minutes=10)
+        self.poller.last_poll = self.now - timedelta(days=1)
+        self.poller.comments.clear()
+        self.poller.etag = None
+        self.youtube = MagicMock()
+        self.requests = []
+        self.youtube.commentThreads.return_value.list.side_effect = self.list
+        patcher = patch.object(self.poller.utils, "youtube", self.youtube)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list(self, **kwargs):
+        request = MagicMock(headers={})
+        request.execute.side_effect = lambda: self.pages[kwargs.get("pageToken")](request)
+        self.requests.append(request)
+        return request
+
+    def test_walks_pages_until_seen_comments(self):
+        self.pages = {
+            None: lambda r: {"etag": "e1", "nextPageToken": "p2", "items": [make_item("c", self.now)]},
+            "p2": lambda r: {
+                "nextPageToken": "p3",
+                "items": [
+                    make_item("b", self.now - timedelta(minutes=5)),
+                    make_item("a", self.now - timedelta(minutes=20)),
+                ],
+            },
+        }
+        self.assertEqual(self.poller.poll(), 2)
+        self.assertEqual([c["url"][-1] for c in self.poller.take_comments(10)], ["b", "c"])
+        self.assertEqual(self.poller.etag, "e1")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_not_modified(self):
+        def not_modified(request):
+            self.assertEqual(request.headers["If-None-Match"], "e1")
+            raise HttpError(httplib2.Response({"status": 304}), b"")
+
+        self.poller.etag = "e1"
+        self.pages = {None: not_modified}
+        quota_before = self.poller.quota_used
+        self.assertEqual(self.poller.poll(), 0)
+        self.assertEqual(self.poller.quota_used, quota_before + 1)
+        self.assertFalse(self.poller.comments)
+
+    def test_retries_after_a_page_fails(self):
+        def server_error(request):
+            raise HttpError(httplib2.Response({"status": 500}), b"")
+
+        first_page = {"etag": "e1", "nextPageToken": "p2", "items": [make_item("c", self.now)]}
+        self.pages = {None: lambda r: first_page, "p2": server_error}
+        self.assertEqual(self.poller.poll(), 0)
+        self.assertFalse(self.poller.comments)
+        self.assertIsNone(self.poller.etag)
+
+        # next time, page 2's comments are still new, and page 1 isn't asked for with the ETag
+        self.poller.last_poll = self.now - timedelta(days=1)
+        self.pages["p2"] = lambda r: {
+            "nextPageToken": "p3",
+            "items": [
+                make_item("b", self.now - timedelta(minutes=5)),
+                make_item("a", self.now - timedelta(minutes=20)),
+            ],
+        }
+        self.assertEqual(self.poller.poll(), 2)
+        self.assertNotIn("If-None-Match", self.requests[2].headers)
+        self.assertEqual([c["url"][-1] for c in self.poller.take_comments(10)], ["b", "c"])
+        self.assertEqual(self.poller.etag, "e1")
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import blocking_pool_workers, blocking_backend_limits, blocking_default_limit, blocking_slow_call_seconds
+from dataclasses import dataclass
+from functools import partial
+from structlog import get_logger
+from typing import Callable
+
+log = get_logger()
+class_name = "BlockingPool"
+
+
+@dataclass
+class BackendStats:
+    calls: int = 0
+    errors: int = 0
+    waiting: int = 0  # calls held back by the backend's limit
+    running: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class BlockingPool:
+    """A bounded thread pool for blocking calls (HTTP APIs, sync callbacks) made from the event loop.
+
+    Each call names the backend it talks to, and only `blocking_backend_limits[backend]` calls to the same
+    backend run at once, so one slow API can use up its own share of the pool but not everyone else's.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get_instance() -> "BlockingPool":
+        if BlockingPool.__instance is None:
+            return BlockingPool()
+        return BlockingPool.__instance
+
+    def __init__(self):
+        if BlockingPool.__instance is not None:
+            raise Exception("This class is a singleton!")
+        BlockingPool.__instance = self
+        self.executor = ThreadPoolExecutor(max_workers=blocking_pool_workers, thread_name_prefix="Blocking")
+        self.limits: dict[str, asyncio.Semaphore] = {}
+        self.stats: dict[str, BackendStats] = {}
+
+    async def run(self, backend: str, func: Callable, *args, **kwargs):
+        if backend not in self.limits:
+            self.limits[backend] = asyncio.Semaphore(blocking_backend_limits.get(backend, blocking_default_limit))
+            self.stats[backend] = BackendStats()
+        limit, stats = self.limits[backend], self.stats[backend]
+
+        stats.waiting += 1
+        try:
+            await limit.acquire()
+        finally:
+            stats.waiting -= 1
+
+        stats.running += 1
+        start = time.monotonic()
+
+        def finished(future: asyncio.Future) -> None:
+            # only release the backend once the thread is actually done, even if whoever was waiting gave up
+            limit.release()
+            elapsed = time.monotonic() - start
+            stats.running -= 1
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            if future.cancelled() or future.exception():
+                stats.errors += 1
+            if elapsed > blocking_slow_call_seconds:
+                log.warning(class_name, msg="Slow blocking call", backend=backend, seconds=round(elapsed, 2))
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+        future.add_done_callback(finished)
+        return await asyncio.shield(future)
+
+    def summary(self) -> str:
+        """One line per backend, for the stats command"""
+        lines = []
+        for backend, stats in sorted(self.stats.items()):
+            mean = stats.total_seconds / stats.calls if stats.calls else 0.0
+            lines.append(
+                f"{backend}: {stats.calls} calls ({stats.errors} failed), {stats.running} running, "
+                f"{stats.waiting} waiting, mean {mean:.2f}s, max {stats.max_seconds:.2f}s"
+            )
+        return "\n".join(lines)
+
+
+async def run_blocking(backend: str, func: Callable, *args, **kwargs):
+    """Call a blocking function from async code without holding up the event loop"""
+    return await BlockingPool.get_instance().run(backend, func, *args, **kwargs)
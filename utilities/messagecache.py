@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+from config import message_cache_size, message_cache_ttl
+from structlog import get_logger
+
+log = get_logger()
+class_name = "MessageCache"
+
+
+class MessageCache:
+    """Discord messages we've fetched recently, so a burst of reactions to one message, each handled by
+    several modules, doesn't fetch it from the API every time.
+
+    Entries expire after `message_cache_ttl` seconds, the least recently used are dropped once there are more
+    than `message_cache_size`, and edits and deletes drop them straight away. Messages are cached as they were
+    when fetched, so anything that needs up to date reactions should ask for a refresh. Only use it from the
+    Discord client's event loop.
+    """
+
+    def __init__(self, size: int = message_cache_size, ttl: float = message_cache_ttl):
+        self.size = size
+        self.ttl = ttl
+        # message id -> (when it was fetched, the message), least recently used first
+        self.messages: OrderedDict[int, tuple] = OrderedDict()
+        self.fetching: dict[int, asyncio.Future] = {}  # so two handlers asking at once only fetch it once
+        self.hits = 0
+        self.misses = 0
+
+    async def fetch(self, channel, message_id: int, refresh: bool = False):
+        """The message with that id from the channel, from the cache if we have it"""
+        message_id = int(message_id)
+        if not refresh and (entry := self.messages.get(message_id)) is not None:
+            fetched_at, message = entry
+            if time.monotonic() - fetched_at < self.ttl:
+                self.messages.move_to_end(message_id)
+                self.hits += 1
+                return message
+            del self.messages[message_id]
+
+        # a refresh mustn't get a message that was already on its way before it asked
+        if not refresh and message_id in self.fetching:
+            self.hits += 1
+            fetch = self.fetching[message_id]
+        else:
+            self.misses += 1
+            fetch = self.fetching[message_id] = asyncio.ensure_future(channel.fetch_message(message_id))
+            # done however it finishes, even if everyone waiting for it has been cancelled
+            fetch.add_done_callback(lambda done: self.forget_fetch(message_id, done))
+        message = await asyncio.shield(fetch)
+        self.add(message)
+        return message
+
+    def forget_fetch(self, message_id: int, fetch: asyncio.Future) -> None:
+        if self.fetching.get(message_id) is fetch:  # and not a refresh that's replaced it
+            del self.fetching[message_id]
+
+    def add(self, message) -> None:
+        self.messages[message.id] = (time.monotonic(), message)
+        self.messages.move_to_end(message.id)
+        while len(self.messages) > self.size:
+            self.messages.popitem(last=False)
+
+    def forget(self, message_id: int) -> None:
+        """Drop the message, if we have it, because it's been edited or deleted"""
+        self.messages.pop(int(message_id), None)
+
+    def summary(self) -> str:
+        """For the stats command"""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"{len(self.messages)} cached, {self.hits} hits, {self.misses} fetched ({hit_rate:.0f}% hit rate)"
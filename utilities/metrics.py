@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from config import metrics_latency_buckets, metrics_summary_lines
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+class_name = "Metrics"
+
+# what each kind of timing measures, for the HELP lines on /metrics
+descriptions = {
+    "process_message": "Time taken by Module.process_message",
+    "callback": "Time taken by response callbacks",
+    "reaction": "Time taken by Module.process_raw_reaction_event",
+    "job": "Time taken by scheduled jobs, including module ticks",
+    "external_call": "Time taken by calls to external services",
+    "database": "Time taken by database requests made from async code",
+    "database_wait": "Time database requests spent queued behind others",
+    "database_queue_depth": "Database requests waiting or running",
+}
+
+
+class Histogram:
+    """Counts of observations falling in each of a fixed set of buckets, like a Prometheus histogram"""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is for anything bigger than every bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self) -> list[int]:
+        totals, total = [], 0
+        for count in self.counts:
+            total += count
+            totals.append(total)
+        return totals
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket the q-quantile falls in (or the max, if it's past the last bucket)"""
+        target = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative_counts()):
+            if total >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metrics:
+    """Latency histograms and outcome counters for everything we want to keep an eye on.
+
+    Each timing has a name (one of the keys of `descriptions`) and some labels saying what was timed,
+    like the module or external service. They're published in Prometheus' text format on the Flask app's
+    /metrics route, and the slowest are listed by the stats command. Timings can come from any thread.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get_instance() -> "Metrics":
+        if Metrics.__instance is None:
+            return Metrics()
+        return Metrics.__instance
+
+    def __init__(self):
+        if Metrics.__instance is not None:
+            raise Exception("This class is a singleton!")
+        Metrics.__instance = self
+        self.lock = threading.Lock()
+        # (name, labels) -> histogram, and (name, labels, outcome) -> count
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.outcomes: Counter = Counter()
+        # name -> function giving its current value, asked whenever the metrics are
+        self.gauges: dict[str, Callable[[], float]] = {}
+
+    def register_gauge(self, name: str, value: Callable[[], float]) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float, outcome: str = "ok", **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(metrics_latency_buckets)
+            self.histograms[key].observe(seconds)
+            self.outcomes[key + (outcome,)] += 1
+
+    def prometheus(self) -> str:
+        """Everything, in Prometheus' text exposition format"""
+        lines = []
+        with self.lock:
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                metric = f"stampy_{name}_seconds"
+                lines.append(f"# HELP {metric} {descriptions.get(name, name)}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (hist_name, labels), histogram in sorted(self.histograms.items()):
+                    if hist_name != name:
+                        continue
+                    cumulative_counts = histogram.cumulative_counts()
+                    bounds = [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+                    for bound, total in zip(bounds, cumulative_counts):
+                        lines.append(f"{metric}_bucket{format_labels(labels + (('le', bound),))} {total}")
+                    lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+
+                counter = f"stampy_{name}_total"
+                lines.append(f"# HELP {counter} {descriptions.get(name, name)}, by outcome")
+                lines.append(f"# TYPE {counter} counter")
+                for (counter_name, labels, outcome), count in sorted(self.outcomes.items()):
+                    if counter_name == name:
+                        lines.append(f"{counter}{format_labels(labels + (('outcome', outcome),))} {count}")
+
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# HELP stampy_{name} {descriptions.get(name, name)}")
+                lines.append(f"# TYPE stampy_{name} gauge")
+                lines.append(f"stampy_{name} {value()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """The things that have taken the most time in total, for the stats command"""
+        lines = []
+        with self.lock:
+            slowest = sorted(self.histograms.items(), key=lambda item: item[1].sum, reverse=True)
+            for (name, labels), histogram in slowest[:metrics_summary_lines]:
+                failures = sum(
+                    count
+                    for (counter_name, counter_labels, outcome), count in self.outcomes.items()
+                    if (counter_name, counter_labels) == (name, labels) and outcome != "ok"
+                )
+                what = " ".join(str(value) for _, value in labels)
+                lines.append(
+                    f"{name} {what}: {histogram.count} calls ({failures} failed), "
+                    f"mean {histogram.sum / histogram.count:.2f}s, p95 {histogram.quantile(0.95):.2f}s, "
+                    f"max {histogram.max:.2f}s"
+                )
+        return "\n".join(lines)
+
+
+@contextmanager
+def timed(name: str, **labels: str) -> Iterator[None]:
+    """Record how long the block takes, and whether it finished ("ok"), raised ("error") or timed out.
+    Works around awaits too, and as a decorator for plain functions"""
+    start = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        outcome = "timeout"
+        raise
+    finally:
+        Metrics.get_instance().observe(name, time.monotonic() - start, outcome, **labels)
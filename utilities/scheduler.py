@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from structlog import get_logger
+from typing import Callable, Optional
+from utilities.blocking import run_blocking
+from utilities.metrics import timed
+
+log = get_logger()
+class_name = "Scheduler"
+
+
+@dataclass
+class Job:
+    """Something to do every `interval` seconds, plus up to `jitter` seconds so jobs don't all line up.
+    If a run takes longer than `max_runtime` seconds it's cancelled, and if `skip_if_running` is set a run
+    is skipped while the last one is still going, rather than starting another alongside it"""
+
+    name: str
+    func: Callable
+    interval: float
+    jitter: float = 0.0
+    max_runtime: Optional[float] = None
+    skip_if_running: bool = True
+
+    runs: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    running: int = 0
+    last_run: Optional[datetime] = None
+    last_duration: Optional[float] = None
+    max_duration: float = 0.0
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class Scheduler:
+    """Runs registered periodic jobs on the dispatcher's event loop.
+
+    Jobs can be plain or async functions. Plain functions are run on the BlockingPool,
+    counted against a backend named after the job. Jobs can be registered at any time,
+    and start running once the scheduler has been started.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get_instance() -> "Scheduler":
+        if Scheduler.__instance is None:
+            return Scheduler()
+        return Scheduler.__instance
+
+    def __init__(self):
+        if Scheduler.__instance is not None:
+            raise Exception("This class is a singleton!")
+        Scheduler.__instance = self
+        self.jobs: dict[str, Job] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.runs: set[asyncio.Task] = set()  # the loop only keeps weak references to tasks
+
+    def register(
+        self,
+        name: str,
+        func: Callable,
+        interval: float,
+        jitter: float = 0.0,
+        max_runtime: Optional[float] = None,
+        skip_if_running: bool = True,
+    ) -> Job:
+        """Add a job, replacing any existing job with the same name"""
+        self.unregister(name)
+        job = Job(name, func, interval, jitter, max_runtime, skip_if_running)
+        self.jobs[name] = job
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._start_job, job)
+        return job
+
+    def unregister(self, name: str) -> None:
+        job = self.jobs.pop(name, None)
+        if job is not None and job.task is not None:
+            self.loop.call_soon_threadsafe(job.task.cancel)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start running the jobs on the given loop. Does nothing if it's already started"""
+        if self.loop is not None:
+            return
+        self.loop = loop
+        for job in self.jobs.values():
+            loop.call_soon_threadsafe(self._start_job, job)
+
+    def _start_job(self, job: Job) -> None:
+        if self.jobs.get(job.name) is job and job.task is None:
+            job.task = self.loop.create_task(self._schedule(job))
+
+    async def _schedule(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(job.interval + random.uniform(0, job.jitter))
+            if job.running and job.skip_if_running:
+                job.skipped += 1
+                continue
+            run = self.loop.create_task(self._run(job))
+            self.runs.add(run)
+            run.add_done_callback(self.runs.discard)
+
+    async def _run(self, job: Job) -> None:
+        job.running += 1
+        job.last_run = datetime.now(timezone.utc)
+        start = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(job.func):
+                run = job.func()
+            else:
+                run = run_blocking(job.name, job.func)
+            with timed("job", job=job.name):
+                await asyncio.wait_for(run, timeout=job.max_runtime)
+        except asyncio.TimeoutError:
+            job.timeouts += 1
+            log.warning(class_name, msg=f"Job '{job.name}' took longer than {job.max_runtime} seconds, cancelled it")
+        except Exception as e:
+            job.failures += 1
+            log.error(class_name, msg=f"Job '{job.name}' failed", error=e)
+        finally:
+            job.running -= 1
+            job.runs += 1
+            job.last_duration = time.monotonic() - start
+            job.max_duration = max(job.max_duration, job.last_duration)
+
+    def summary(self) -> str:
+        """One line per job, for the stats command"""
+        lines = []
+        for job in self.jobs.values():
+            last_run = job.last_run.strftime("%H:%M:%S") if job.last_run else "never"
+            last_duration = f"{job.last_duration:.2f}s" if job.last_duration is not None else "-"
+            lines.append(
+                f"{job.name}: every {job.interval:g}s, last ran {last_run} taking {last_duration} "
+                f"(max {job.max_duration:.2f}s), {job.runs} runs, {job.failures} failed, "
+                f"{job.timeouts} timed out, {job.skipped} skipped"
+            )
+        return "\n".join(lines)
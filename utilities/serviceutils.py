@@ -1,7 +1,11 @@
+import re
 from servicemodules.serviceConstants import Services
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Optional
+from functools import cached_property
+from typing import Literal, Optional, Union
+
+re_words = re.compile(r"\w+")
 
 @dataclass
 class ServiceRole:
@@ -124,6 +128,29 @@ class ServiceMessage:
     def __repr__(self):
         return f"ServiceMessage({self.content})"
 
+    # Things worked out from the message that lots of modules need. Each is computed the first time
+    # it's asked for and then shared, so they rely on the message not being changed after it's built
+
+    @cached_property
+    def addressed_text(self) -> Union[str, Literal[False]]:
+        """If the message is directed at Stampy, its text with Stampy's name stripped away, otherwise False"""
+        from utilities.utilities import get_addressed_text  # utilities.utilities imports this module
+
+        return get_addressed_text(self)
+
+    @property
+    def is_addressed(self) -> bool:
+        return self.addressed_text is not False
+
+    @cached_property
+    def lower_content(self) -> str:
+        return self.clean_content.lower()
+
+    @cached_property
+    def tokens(self) -> tuple[str, ...]:
+        """The words in the message, lowercased"""
+        return tuple(re_words.findall(self.lower_content))
+
     def __eq__(self, other: object) -> bool:
         if isinstance(other, int):
             return self.id == other
@@ -1,5 +1,6 @@
 from functools import cache
 from servicemodules.serviceConstants import Services
+from utilities.blocking import run_blocking
 from utilities.serviceutils import ServiceUser, ServiceServer, ServiceChannel, ServiceMessage
 from typing import Any
 
@@ -115,8 +116,11 @@ class SlackChannel(ServiceChannel):
         self.channel_type = channel_type
 
     async def send(self, data: str):
-        utils.client.web_client.api_call(
-            api_method="chat.postMessage", params={"channel": self.id, "text": data}
+        await run_blocking(
+            "slack",
+            utils.client.web_client.api_call,
+            api_method="chat.postMessage",
+            params={"channel": self.id, "text": data},
         )
 
 
@@ -2,7 +2,6 @@ from api.semanticwiki import SemanticWiki, QuestionSource
 from config import (
     youtube_api_version,
     youtube_api_service_name,
-    rob_miles_youtube_channel_id,
     discord_token,
     discord_guild,
     youtube_api_key,
@@ -12,6 +11,7 @@ from config import (
     wiki_config,
 )
 from servicemodules.discordConstants import stampy_error_log_channel_id, wiki_feed_channel_id
+from database.asyncdatabase import AsyncDatabase
 from database.database import Database
 from datetime import datetime, timezone, timedelta
 from enum import Enum
@@ -21,8 +21,11 @@ from googleapiclient.errors import HttpError
 from structlog import get_logger
 from time import time
 from utilities.discordutils import DiscordMessage, DiscordUser
+from utilities.messagecache import MessageCache
+from utilities.metrics import timed
 from utilities.serviceutils import ServiceMessage
-from typing import List
+from typing import List, Literal, Optional, Union
+import asyncio
 import discord
 import json
 import os
@@ -30,6 +33,7 @@ import psutil
 import random
 import re
 import sys
+import tempfile
 import traceback
 
 # Sadly some of us run windows...
@@ -59,9 +63,6 @@ class Utilities:
     DB_PATH = None
 
     last_message_was_youtube_question = None
-    latest_comment_timestamp = None
-    last_check_timestamp = None
-    youtube_cooldown = None
     last_timestamp = None
     last_question_asked_timestamp = None
     latest_question_posted = None
@@ -99,16 +100,6 @@ class Utilities:
             # dict to keep last timestamps in
             self.last_timestamp = {}
 
-            # when was the most recent comment we saw posted?
-            self.latest_comment_timestamp = datetime.now(timezone.utc)
-
-            # when did we last hit the API to check for comments?
-            self.last_check_timestamp = datetime.now(timezone.utc)
-
-            # how many seconds should we wait before we can hit YT API again
-            # this the start value. It doubles every time we don't find anything new
-            self.youtube_cooldown = timedelta(seconds=60)
-
             # timestamp of last time we asked a youtube question
             self.last_question_asked_timestamp = datetime.now(timezone.utc)
 
@@ -130,12 +121,51 @@ class Utilities:
 
             log.info(self.class_name, status="Trying to open db - " + self.DB_PATH)
             self.db = Database(self.DB_PATH)
+            self.async_db = AsyncDatabase(self.db)  # for async code, which shouldn't use self.db directly
             intents = discord.Intents.default()
             intents.members = True
             intents.message_content = True
             self.client = discord.Client(intents=intents)
+            self.message_cache = MessageCache()
+            # guilds by name, and (guild id, channel name) -> channel, filled in as they're asked for
+            self.guilds_by_name = {}
+            self.channels_by_name = {}
             self.wiki = SemanticWiki(wiki_config["uri"], wiki_config["user"], wiki_config["password"])
 
+    def get_guild(self, name: Optional[str] = None) -> Optional["discord.Guild"]:
+        """The guild with that name, or ours if no name is given"""
+        name = name or self.GUILD
+        if name not in self.guilds_by_name:
+            self.guilds_by_name = {guild.name: guild for guild in self.client.guilds}
+        return self.guilds_by_name.get(name)
+
+    def get_channel(self, channel_id) -> Optional["discord.abc.GuildChannel"]:
+        return self.client.get_channel(int(channel_id))
+
+    def get_channel_by_name(
+        self, name: str, guild: Optional["discord.Guild"] = None
+    ) -> Optional["discord.abc.GuildChannel"]:
+        """The channel with that name in the guild, or ours if no guild is given"""
+        guild = guild or self.get_guild()
+        if guild is None:
+            return None
+        if (guild.id, name) not in self.channels_by_name:
+            self.channels_by_name.update({(guild.id, channel.name): channel for channel in guild.channels})
+        return self.channels_by_name.get((guild.id, name))
+
+    def forget_guilds(self) -> None:
+        """Call when guilds or channels are added, removed or renamed"""
+        self.guilds_by_name = {}
+        self.channels_by_name = {}
+
+    async def fetch_message(self, channel_id, message_id, refresh: bool = False) -> Optional["discord.Message"]:
+        """The message, from the message cache if it's there, or None if we can't see the channel.
+        Pass refresh=True to get its current reactions"""
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            return None
+        return await self.message_cache.fetch(channel, message_id, refresh=refresh)
+
     def rate_limit(self, timer_name, **kwargs):
         """Should I rate-limit? i.e. Has it been less than this length of time since the last time
         this function was called using the same `timer_name`?
@@ -189,7 +219,8 @@ class Utilities:
         reply_id = url_arr[-1].split(".")[0]
         request = self.youtube.comments().list(part="snippet", parentId=reply_id)
         try:
-            response = request.execute()
+            with timed("external_call", service="youtube"):
+                response = request.execute()
         except HttpError as err:
             if err.resp.get("content-type", "").startswith("application/json"):
                 message = json.loads(err.content).get("error").get("errors")[0].get("message")
@@ -222,7 +253,8 @@ class Utilities:
         reply_id = url_arr[-1].split(".")[0]
         request = self.youtube.commentThreads().list(part="snippet", id=reply_id)
         try:
-            response = request.execute()
+            with timed("external_call", service="youtube"):
+                response = request.execute()
         except HttpError as err:
             if err.resp.get("content-type", "").startswith("application/json"):
                 message = json.loads(err.content).get("error").get("errors")[0].get("message")
@@ -250,114 +282,6 @@ class Utilities:
             comment["reply_count"] = 0
         return comment
 
-    def check_for_new_youtube_comments(self):
-        """Consider getting the latest comments from the channel
-        Returns a list of dicts if there are new comments
-        Returns [] if it checked and there are no new ones
-        Returns None if it didn't check because it's too soon to check again"""
-
-        now = datetime.now(timezone.utc)
-
-        if (now - self.last_check_timestamp) > self.youtube_cooldown:
-            log.info(f"{self.class_name}: YouTube", msg="Hitting YT API")
-            self.last_check_timestamp = now
-        else:
-
-            log.info(
-                f"{self.class_name}: YouTube",
-                msg="YT waiting >%s\t- " % str(self.youtube_cooldown - (now - self.last_check_timestamp)),
-            )
-            return None
-
-        if self.youtube is None:
-            log.info(f"{self.class_name}: YouTube", msg="WARNING: YouTube API Key is invalid or not set")
-            self.youtube_cooldown = self.youtube_cooldown * 10
-            return []
-
-        request = self.youtube.commentThreads().list(
-            part="snippet", allThreadsRelatedToChannelId=rob_miles_youtube_channel_id
-        )
-        try:
-            response = request.execute()
-        except HttpError as err:
-            if err.resp.get("content-type", "").startswith("application/json"):
-                message = json.loads(err.content).get("error").get("errors")[0].get("message")
-                if message:
-                    log.error(f"{self.class_name}: YouTube", error=message)
-                    return
-            log.error(f"{self.class_name}: YouTube", error="Unknown Google API Error")
-            return
-
-        items = response.get("items", None)
-        if not items:
-            # something broke, slow way down
-            log.info(f"{self.class_name}: YouTube", msg="YT comment checking broke. I got this response:")
-            log.info(f"{self.class_name}: YouTube", response=response)
-            self.youtube_cooldown = self.youtube_cooldown * 10
-            return None
-
-        newest_timestamp = self.latest_comment_timestamp
-
-        new_items = []
-        for item in items:
-            # Find when the comment was published
-            timestamp = item["snippet"]["topLevelComment"]["snippet"]["publishedAt"]
-            # For some reason fromisoformat() doesn't like the trailing 'Z' on timestmaps
-            # And we add the "+00:00" so it knows to use UTC
-            published_timestamp = datetime.fromisoformat(timestamp[:-1] + "+00:00")
-
-            # If this comment is newer than the newest one from last time we called API, keep it
-            if published_timestamp > self.latest_comment_timestamp:
-                new_items.append(item)
-
-            # Keep track of which is the newest in this API call
-            if published_timestamp > newest_timestamp:
-                newest_timestamp = published_timestamp
-
-        log.info(
-            f"{self.class_name}: YouTube",
-            msg="Got %s items, most recent published at %s" % (len(items), newest_timestamp),
-        )
-
-        # save the timestamp of the newest comment we found, so next API call knows what's fresh
-        self.latest_comment_timestamp = newest_timestamp
-
-        new_comments = []
-        for item in new_items:
-            top_level_comment = item["snippet"]["topLevelComment"]
-            video_id = top_level_comment["snippet"]["videoId"]
-            comment_id = top_level_comment["id"]
-            username = top_level_comment["snippet"]["authorDisplayName"]
-            text = top_level_comment["snippet"]["textOriginal"]
-            timestamp = top_level_comment["snippet"]["publishedAt"][:-1]
-            likes = top_level_comment["snippet"]["likeCount"]
-            reply_count = item["snippet"]["totalReplyCount"]
-            comment = {
-                "url": "https://www.youtube.com/watch?v=%s&lc=%s" % (video_id, comment_id),
-                "username": username,
-                "text": text,
-                "title": "",
-                "timestamp": timestamp,
-                "likes": likes,
-                "reply_count": reply_count,
-            }
-
-            new_comments.append(comment)
-
-        log.info(
-            f"{self.class_name}: YouTube", msg="Got %d new comments since last check" % len(new_comments)
-        )
-
-        if not new_comments:
-            # we got nothing, double the cooldown period (but not more than 20 minutes)
-            self.youtube_cooldown = min(self.youtube_cooldown * 2, timedelta(seconds=1200))
-            log.info(
-                f"{self.class_name}: YouTube",
-                msg="No new comments, increasing cooldown timer to %s" % self.youtube_cooldown,
-            )
-
-        return new_comments
-
     def get_question(
         self, order_type: OrderType = OrderType.TOP, wiki_question_bias: float =SemanticWiki.default_wiki_question_percent_bias
     ):
@@ -425,16 +349,16 @@ class Utilities:
         return self.wiki.get_question_count()
 
     def clear_votes(self):
-        query = "DELETE FROM uservotes"
-        self.db.query(query)
-        self.db.commit()
+        """Wipe the votes, and the log of them, for a full stamp history rebuild"""
+        with self.db.transaction():
+            self.db.query("DELETE FROM uservotes")
+            self.db.query("DELETE FROM vote_events")
 
     def update_ids_list(self):
 
         self.ids = sorted(list(self.users))
         self.index = {0: 0}
-        for userid in self.ids:
-            self.index[userid] = self.ids.index(userid)
+        self.index.update((userid, i) for i, userid in enumerate(self.ids))
 
     def index_dammit(self, user):
         """Get an index into the scores array from whatever you get"""
@@ -464,15 +388,92 @@ class Utilities:
         else:
             return 0.0
 
+    update_vote_query = (
+        "INSERT OR REPLACE INTO uservotes VALUES (:user,:voted_for,IFNULL((SELECT votecount "
+        "FROM uservotes WHERE user = :user AND votedFor = :voted_for),0)+:vote_quantity)"
+    )
+
     def update_vote(self, user, voted_for, vote_quantity):
-        query = (
-            "INSERT OR REPLACE INTO uservotes VALUES (:user,:voted_for,IFNULL((SELECT votecount "
-            "FROM uservotes WHERE user = :user AND votedFor = :voted_for),0)+:vote_quantity)"
-        )
         args = {"user": user, "voted_for": voted_for, "vote_quantity": vote_quantity}
-        self.db.query(query, args)
+        self.db.query(self.update_vote_query, args)
         self.db.commit()
 
+    def add_votes(self, votes):
+        """update_vote for each (user, voted_for, vote_quantity), in one go"""
+        args = [
+            {"user": user, "voted_for": voted_for, "vote_quantity": quantity} for user, voted_for, quantity in votes
+        ]
+        self.db.execute_many(self.update_vote_query, args)
+
+    def create_vote_events_table(self):
+        """The log of every vote, which uservotes adds up. Nothing is ever changed in it, only added.
+        If it's new, it starts with one event for each row of uservotes, since we don't know when those happened"""
+        with self.db.transaction():
+            self.db.query(
+                "CREATE TABLE IF NOT EXISTS vote_events (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "timestamp REAL NOT NULL, message INT, emoji STRING, user INT NOT NULL, votedFor INT NOT NULL, "
+                "delta INT NOT NULL)"
+            )
+            self.db.query("CREATE INDEX IF NOT EXISTS vote_events_timestamp ON vote_events (timestamp)")
+            if not self.db.query("SELECT 1 FROM vote_events LIMIT 1"):
+                self.db.query(
+                    "INSERT INTO vote_events (timestamp,user,votedFor,delta) "
+                    "SELECT 0,user,votedFor,votecount FROM uservotes ORDER BY user,votedFor"
+                )
+
+    def add_vote_events(self, events):
+        """Log each (timestamp, message, emoji, user, voted_for, delta), and add it to uservotes, in one go"""
+        events = list(events)
+        with self.db.transaction():
+            self.db.execute_many(
+                "INSERT INTO vote_events (timestamp,message,emoji,user,votedFor,delta) VALUES (?,?,?,?,?,?)", events
+            )
+            self.add_votes((user, voted_for, delta) for _, _, _, user, voted_for, delta in events)
+
+    def get_vote_events_since(self, event_id):
+        """(id, user, votedFor, delta) for each event after the one with that id, oldest first"""
+        query = "SELECT id,user,votedFor,delta FROM vote_events WHERE id > ? ORDER BY id"
+        return self.db.query(query, (event_id,))
+
+    def has_vote_event(self, event_id):
+        """Whether the vote log still has that event, or hasn't been cleared since, for an id of 0"""
+        if not event_id:
+            return True
+        return bool(self.db.query("SELECT 1 FROM vote_events WHERE id = ?", (event_id,)))
+
+    def get_last_vote_event_id(self):
+        return self.db.query("SELECT IFNULL(max(id),0) FROM vote_events")[0][0]
+
+    def get_votes_at(self, timestamp):
+        """What get_all_user_votes would have said at that time, worked out from the vote log"""
+        query = (
+            "SELECT user,votedFor,sum(delta) FROM vote_events WHERE timestamp <= ? "
+            "GROUP BY user,votedFor ORDER BY user,votedFor"
+        )
+        return self.db.query(query, (timestamp,))
+
+    def get_vote_events_for_user(self, voted_for, since=0):
+        """(timestamp, message, emoji, user, delta) for each vote for the user since the given time, oldest first"""
+        query = (
+            "SELECT timestamp,message,emoji,user,delta FROM vote_events WHERE votedFor = ? AND timestamp >= ? "
+            "ORDER BY timestamp,id"
+        )
+        return self.db.query(query, (voted_for, since))
+
+    def recount_votes(self):
+        """Rebuild uservotes from the vote log"""
+        with self.db.transaction():
+            self.db.query("DELETE FROM uservotes")
+            self.db.query(
+                "INSERT INTO uservotes SELECT user,votedFor,sum(delta) FROM vote_events GROUP BY user,votedFor"
+            )
+
+    def get_stamp_snapshot_before(self, timestamp):
+        """(ids, scores) from the last snapshot taken at or before that time, or None if there isn't one"""
+        query = "SELECT ids,scores FROM stamp_snapshots WHERE timestamp <= ? ORDER BY timestamp DESC LIMIT 1"
+        snapshots = self.db.query(query, (timestamp,))
+        return snapshots[0] if snapshots else None
+
     def get_votes_by_user(self, user):
         query = "SELECT IFNULL(sum(votecount),0) FROM uservotes where user = ?"
         args = (user,)
@@ -488,14 +489,78 @@ class Utilities:
         return self.db.query(query)[0][0]
 
     def get_all_user_votes(self):
-        query = "SELECT user,votedFor,votecount from uservotes;"
+        query = "SELECT user,votedFor,votecount from uservotes ORDER BY user,votedFor;"
         return self.db.query(query)
 
+    def create_stamp_snapshots_table(self):
+        """`last_event` is the last vote log event the snapshot includes, and `votes` the vote table then,
+        which is only kept for the latest snapshot"""
+        with self.db.transaction():
+            query = (
+                "CREATE TABLE IF NOT EXISTS stamp_snapshots (timestamp REAL NOT NULL PRIMARY KEY, "
+                "fingerprint STRING NOT NULL, total_votes INT, ids BLOB NOT NULL, scores BLOB NOT NULL, "
+                "last_event INT, votes BLOB)"
+            )
+            self.db.query(query)
+            # snapshot tables from before the vote log don't have those two
+            columns = {row[1] for row in self.db.query("PRAGMA table_info(stamp_snapshots)")}
+            for column, column_type in (("last_event", "INT"), ("votes", "BLOB")):
+                if column not in columns:
+                    self.db.query(f"ALTER TABLE stamp_snapshots ADD COLUMN {column} {column_type}")
+
+    def add_stamp_snapshot(
+        self, timestamp, fingerprint, total_votes, ids, scores, last_event, votes, replace_since, keep_since
+    ):
+        """Add a snapshot of the stamp scores, replacing any taken since `replace_since`
+        and dropping any taken before `keep_since`"""
+        with self.db.transaction():
+            query = "DELETE FROM stamp_snapshots WHERE timestamp >= ? OR timestamp < ?"
+            self.db.query(query, (replace_since, keep_since))
+            self.db.query("UPDATE stamp_snapshots SET votes = NULL WHERE votes IS NOT NULL")
+            query = "INSERT INTO stamp_snapshots VALUES (?,?,?,?,?,?,?)"
+            self.db.query(query, (timestamp, fingerprint, total_votes, ids, scores, last_event, votes))
+
+    def get_latest_stamp_snapshot(self):
+        if not self.db.has_table("stamp_snapshots"):
+            return None  # we haven't taken one yet
+        query = (
+            "SELECT timestamp,fingerprint,total_votes,ids,scores,last_event,votes FROM stamp_snapshots "
+            "ORDER BY timestamp DESC LIMIT 1"
+        )
+        snapshots = self.db.query(query)
+        return snapshots[0] if snapshots else None
+
+    def create_history_checkpoints_table(self):
+        query = (
+            "CREATE TABLE IF NOT EXISTS stamp_history_checkpoints "
+            "(channel INT NOT NULL PRIMARY KEY, last_message INT, done BOOL DEFAULT false)"
+        )
+        self.db.query(query)
+
+    def get_history_checkpoints(self):
+        """channel id -> (id of the last message counted, whether the channel is done), for a stamp history
+        rebuild that hasn't finished. Empty if there isn't one"""
+        if not self.db.has_table("stamp_history_checkpoints"):
+            return {}
+        query = "SELECT channel,last_message,done FROM stamp_history_checkpoints"
+        return {channel: (last_message, bool(done)) for channel, last_message, done in self.db.query(query)}
+
+    def set_history_checkpoint(self, channel, last_message, done=False):
+        query = "INSERT OR REPLACE INTO stamp_history_checkpoints VALUES (?,?,?)"
+        self.db.query(query, (channel, last_message, done))
+
+    def clear_history_checkpoints(self):
+        self.db.query("DELETE FROM stamp_history_checkpoints")
+
+    def get_stamp_snapshots(self, since):
+        if not self.db.has_table("stamp_snapshots"):
+            return []
+        query = "SELECT timestamp,total_votes,ids,scores FROM stamp_snapshots WHERE timestamp >= ? ORDER BY timestamp"
+        return self.db.query(query, (since,))
+
     def get_users(self):
         query = "SELECT user from (SELECT user FROM uservotes UNION SELECT votedFor as user FROM uservotes)"
-        result = self.db.query(query)
-        users = [item for sublist in result for item in sublist]
-        return users
+        return [user for (user,) in self.db.iterate(query)]
 
     def add_youtube_question(self, comment):
         # Get the video title from the video URL, without the comment id
@@ -553,6 +618,17 @@ class Utilities:
         error_message = "".join(parts)
         await self.log_error(error_message)
 
+    def log_error_threadsafe(self, error_message: str, e: Optional[Exception] = None) -> None:
+        """log_error, with the traceback of e if given, from sync code that might be running on a worker thread
+        (through run_blocking), where there's no event loop to make a task on. It's sent from the Discord
+        client's loop, without waiting for it"""
+        if e is not None:
+            error_message += "\n" + "".join(traceback.format_exception(e))
+        try:
+            asyncio.run_coroutine_threadsafe(self.log_error(error_message), self.client.loop)
+        except (AttributeError, RuntimeError):
+            log.warning(self.class_name, msg="Couldn't send error to Discord", error=error_message)
+
     async def log_error(self, error_message: str) -> None:
         if self.error_channel is None:
             self.error_channel = self.client.get_channel(int(stampy_error_log_channel_id))
@@ -633,6 +709,22 @@ def get_memory_usage():
     return "I'm using %s of memory." % megabytes_string
 
 
+def write_atomically(path: str, data: bytes) -> None:
+    """Replace the file at `path` with `data` in one step, by writing it alongside and renaming it over,
+    so anything reading the file sees either the old contents or the new ones"""
+    directory, name = os.path.split(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f".{name}.", delete=False) as temp_file:
+        try:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        except BaseException:
+            os.unlink(temp_file.name)
+            raise
+    os.chmod(temp_file.name, 0o644)  # NamedTemporaryFile makes it private, but the web server needs to read it
+    os.replace(temp_file.name, path)
+
+
 def get_question_id(message):
     text = message.clean_content
     first_number_found = re.search(r"\d+", text)
@@ -675,6 +767,58 @@ def stampy_is_author(message: ServiceMessage) -> bool:
     return utils.service_modules_dict[message.service].service_utils.stampy_is_author(message)
 
 
+def clean_test_prefixes(message: ServiceMessage, prefix: str) -> str:
+    text = message.clean_content
+    prefix_number = get_question_id(message)
+    prefix_with_number = prefix + str(prefix_number) + ": "
+    if prefix_with_number == text[: len(prefix_with_number)]:
+        return text[len(prefix_with_number) :]
+    return text
+
+
+re_at_me_start = re.compile(r"^@?[Ss]tampy\W? ")
+re_s_start = re.compile(r"^[sS][,:]? ")
+re_at_me_end = re.compile(r",? @?[sS](tampy)?[.!?]?$")
+re_at_me_end_sub = re.compile(r",? @?[sS](tampy)?(?P<punctuation>[.!?]*)$")
+
+
+def get_addressed_text(message: ServiceMessage) -> Union[str, Literal[False]]:
+    """
+    Determine if the message is directed at Stampy
+    If it's not, return False. If it is, strip away the
+    name part and return the remainder of the message
+    Use message.addressed_text rather than calling this, so it's only worked out once per message
+    """
+    text = message.clean_content
+    utils = Utilities.get_instance()
+    if utils.test_mode:
+        if stampy_is_author(message):
+            if TEST_QUESTION_PREFIX in message.clean_content:
+                text = "stampy " + clean_test_prefixes(message, TEST_QUESTION_PREFIX)
+    at_me = is_stampy_mentioned(message)
+
+    if re_at_me_start.match(text) or re_s_start.match(text):
+        at_me = True
+        text = text.partition(" ")[2]
+    elif re_at_me_end.search(text):  # name can also be at the end
+        text = re_at_me_end_sub.sub(r"\g<punctuation>", text)
+        at_me = True
+
+    if message.is_dm:
+        # DMs are always at you
+        at_me = True
+
+    if utils.client.user in message.mentions:
+        # regular mentions are already covered above, this covers the case that someone reply @'s Stampy
+        log.info("is_at_me", msg="Classified as 'at stampy' because of mention")
+        at_me = True
+
+    if at_me:
+        return text
+    else:
+        return False
+
+
 def get_guild_and_invite_role():
     utils = Utilities.get_instance()
     guild = utils.client.guilds[0]
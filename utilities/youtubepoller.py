@@ -0,0 +1,205 @@
+import json
+from collections import deque
+from config import (
+    rob_miles_youtube_channel_id,
+    youtube_min_cooldown,
+    youtube_max_cooldown,
+    youtube_max_pages,
+    youtube_daily_quota,
+)
+from datetime import datetime, timedelta, timezone
+from googleapiclient.errors import HttpError
+from structlog import get_logger
+from typing import Optional
+from utilities.metrics import timed
+from utilities.utilities import Utilities
+from zoneinfo import ZoneInfo
+
+log = get_logger()
+class_name = "YouTubePoller"
+
+# the daily quota resets at midnight Pacific time
+quota_timezone = ZoneInfo("America/Los_Angeles")
+# quota units each commentThreads.list call costs, whatever the page size and even if it's a 304
+comment_threads_list_cost = 1
+
+
+class YouTubePoller:
+    """Watches Rob's channel for new top-level comments and queues them up for add_youtube_question.
+
+    Each poll walks back through the comment pages, newest first, until it reaches a comment it has
+    already seen. The first page is requested with the ETag from last time, so if nothing has changed
+    YouTube answers with a 304 and an empty body. Every call is counted against the daily quota, and
+    polling stops for the day if the quota runs out.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get_instance() -> "YouTubePoller":
+        if YouTubePoller.__instance is None:
+            return YouTubePoller()
+        return YouTubePoller.__instance
+
+    def __init__(self):
+        if YouTubePoller.__instance is not None:
+            raise Exception("This class is a singleton!")
+        YouTubePoller.__instance = self
+        self.utils = Utilities.get_instance()
+
+        # new comments, oldest first, waiting to be added to the question queue
+        self.comments: deque[dict] = deque()
+
+        # when was the most recent comment we saw posted?
+        self.latest_comment_timestamp = datetime.now(timezone.utc)
+        self.etag: Optional[str] = None
+
+        # how long to wait between polls. It goes up a step every time we don't find anything new
+        self.cooldown = timedelta(seconds=youtube_min_cooldown)
+        self.last_poll = datetime.now(timezone.utc)
+
+        self.quota_day = None
+        self.quota_used = 0
+        self.calls = 0
+        self.not_modified = 0
+
+    def poll(self) -> Optional[int]:
+        """Check for new comments if it's been long enough since the last check.
+        Returns how many new comments were queued, or None if it didn't check"""
+        now = datetime.now(timezone.utc)
+        if now - self.last_poll < self.cooldown:
+            return None
+        self.last_poll = now
+
+        if self.utils.youtube is None:
+            log.info(class_name, msg="WARNING: YouTube API Key is invalid or not set")
+            self.cooldown = timedelta(seconds=youtube_max_cooldown)
+            return None
+
+        new_items = []
+        newest_timestamp = self.latest_comment_timestamp
+        etag = self.etag
+        page_token = None
+        failed = False
+        finished = False
+        for _ in range(youtube_max_pages):
+            if not self.spend_quota(comment_threads_list_cost):
+                failed = True
+                break
+            response = self.fetch_page(page_token)
+            if response is None:
+                failed = True
+                break
+            if page_token is None:
+                etag = response.get("etag", etag)
+
+            reached_seen_comments = False
+            for item in response.get("items", []):
+                # For some reason fromisoformat() doesn't like the trailing 'Z' on timestamps
+                # And we add the "+00:00" so it knows to use UTC
+                timestamp = item["snippet"]["topLevelComment"]["snippet"]["publishedAt"]
+                published_timestamp = datetime.fromisoformat(timestamp[:-1] + "+00:00")
+                if published_timestamp > self.latest_comment_timestamp:
+                    new_items.append(item)
+                    newest_timestamp = max(newest_timestamp, published_timestamp)
+                else:
+                    reached_seen_comments = True
+
+            page_token = response.get("nextPageToken")
+            if reached_seen_comments or not page_token:
+                finished = True
+                break
+        else:
+            log.warning(class_name, msg=f"Still finding new comments after {youtube_max_pages} pages, gave up")
+
+        if not finished:
+            # the pages we didn't get to have comments older than the ones we did, so if we moved the timestamp
+            # on, they'd never be picked up. Leave it, and the ETag, where they were and try again next time
+            log.info(class_name, msg="Didn't get through the new comments, will try again", quota_used=self.quota_used)
+            # if something broke or we're out of quota, slow way down
+            self.cooldown = timedelta(seconds=youtube_max_cooldown if failed else youtube_min_cooldown)
+            return 0
+
+        # save the timestamp of the newest comment we found, so the next poll knows what's fresh
+        self.latest_comment_timestamp = newest_timestamp
+        self.etag = etag
+        # pages are newest first, but questions should be queued in the order they were asked
+        self.comments.extend(self.comment_from_item(item) for item in reversed(new_items))
+        log.info(class_name, msg="Got %d new comments since last check" % len(new_items), quota_used=self.quota_used)
+
+        if new_items:
+            self.cooldown = timedelta(seconds=youtube_min_cooldown)
+        else:
+            self.cooldown = min(
+                self.cooldown + timedelta(seconds=youtube_min_cooldown), timedelta(seconds=youtube_max_cooldown)
+            )
+            log.info(class_name, msg="No new comments, increasing cooldown timer to %s" % self.cooldown)
+        return len(new_items)
+
+    def fetch_page(self, page_token: Optional[str]) -> Optional[dict]:
+        """One page of comment threads, or None if the request failed"""
+        kwargs = {"pageToken": page_token} if page_token else {}
+        request = self.utils.youtube.commentThreads().list(
+            part="snippet",
+            allThreadsRelatedToChannelId=rob_miles_youtube_channel_id,
+            order="time",
+            maxResults=100,
+            **kwargs,
+        )
+        if page_token is None and self.etag:
+            request.headers["If-None-Match"] = self.etag
+
+        self.calls += 1
+        try:
+            with timed("external_call", service="youtube"):
+                response = request.execute()
+        except HttpError as err:
+            if err.resp.status == 304:
+                self.not_modified += 1
+                return {"items": []}
+            if err.resp.get("content-type", "").startswith("application/json"):
+                message = json.loads(err.content).get("error").get("errors")[0].get("message")
+                if message:
+                    log.error(class_name, error=message)
+                    return None
+            log.error(class_name, error="Unknown Google API Error")
+            return None
+
+        if "items" not in response:
+            log.info(class_name, msg="YT comment checking broke. I got this response:", response=response)
+            return None
+        return response
+
+    def spend_quota(self, units: int) -> bool:
+        """Count the units against today's quota. Returns False, without spending them, if there aren't enough"""
+        today = datetime.now(quota_timezone).date()
+        if today != self.quota_day:
+            self.quota_day = today
+            self.quota_used = 0
+        if self.quota_used + units > youtube_daily_quota:
+            log.warning(class_name, msg="Out of YouTube API quota for today", quota_used=self.quota_used)
+            return False
+        self.quota_used += units
+        return True
+
+    def take_comments(self, limit: int) -> list[dict]:
+        """Take up to `limit` of the oldest queued comments"""
+        comments = []
+        while self.comments and len(comments) < limit:
+            comments.append(self.comments.popleft())
+        return comments
+
+    @staticmethod
+    def comment_from_item(item: dict) -> dict:
+        top_level_comment = item["snippet"]["topLevelComment"]
+        video_id = top_level_comment["snippet"]["videoId"]
+        comment_id = top_level_comment["id"]
+        return {
+            "url": "https://www.youtube.com/watch?v=%s&lc=%s" % (video_id, comment_id),
+            "username": top_level_comment["snippet"]["authorDisplayName"],
+            "text": top_level_comment["snippet"]["textOriginal"],
+            "title": "",
+            "timestamp": top_level_comment["snippet"]["publishedAt"][:-1],
+            "likes": top_level_comment["snippet"]["likeCount"],
+            "reply_count": item["snippet"]["totalReplyCount"],
+        }